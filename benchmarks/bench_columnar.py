@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from utils.filescleanup import OUTPUT_DIR
+from utils.columnar import write_columnar, read_columnar
+
+"""
+Compare CSV and XLSX cleaned files against Parquet and Feather (Arrow IPC) files
+Write, full read, read of two logs and read of a depth range of a cleaned well.
+Run from the project root: python -m benchmarks.bench_columnar
+"""
+
+WELL_FILE = '25509696.csv'
+COLUMNS = ['Hole Depth', 'Gamma']
+# cleaned wells are short, repeat them to get a field-size well
+N_REPEAT = 20
+
+
+def get_well(file_loc, n_repeat=N_REPEAT):
+    df = pd.read_csv(file_loc, index_col=0)
+    df = pd.concat([df] * n_repeat, ignore_index=True)
+    # depth keeps increasing over the repeated rows
+    depth = df.columns[0]
+    df[depth] = df[depth].iloc[0] + np.arange(len(df)) * 0.5
+    return df
+
+
+def get_depth_range(df):
+    depth = df.iloc[:, 0].values
+    top = np.percentile(depth, 40)
+    return top, top + 0.05 * (depth[-1] - depth[0])
+
+
+def run_csv(df, file_loc, columns, depth_range):
+    write = lambda: df.to_csv(file_loc)
+    read = lambda: pd.read_csv(file_loc, index_col=0)
+    read_columns = lambda: pd.read_csv(file_loc, usecols=columns)
+
+    def read_range():
+        data = pd.read_csv(file_loc, index_col=0)
+        depth = data.iloc[:, 0]
+        return data[(depth >= depth_range[0]) & (depth <= depth_range[1])]
+
+    return write, read, read_columns, read_range
+
+
+def run_xlsx(df, file_loc, columns, depth_range):
+    write = lambda: df.to_excel(file_loc)
+    read = lambda: pd.read_excel(file_loc, index_col=0)
+    read_columns = lambda: pd.read_excel(file_loc, usecols=columns)
+
+    def read_range():
+        data = pd.read_excel(file_loc, index_col=0)
+        depth = data.iloc[:, 0]
+        return data[(depth >= depth_range[0]) & (depth <= depth_range[1])]
+
+    return write, read, read_columns, read_range
+
+
+def run_columnar(compression):
+    def get_functions(df, file_loc, columns, depth_range):
+        write = lambda: write_columnar(file_loc, df, compression=compression)
+        read = lambda: read_columnar(file_loc)
+        read_columns = lambda: read_columnar(file_loc, [column.partition(',')[0]
+                                                        for column in columns])
+        read_range = lambda: read_columnar(file_loc, depth_range=depth_range)
+        return write, read, read_columns, read_range
+    return get_functions
+
+
+def run(repeat=3, with_xlsx=True):
+    df = get_well(os.path.join(OUTPUT_DIR, WELL_FILE))
+    columns = [column for column in df.columns
+               if column.partition(',')[0] in COLUMNS]
+    depth_range = get_depth_range(df)
+    print('%s x %d: %d rows, %d logs' % (WELL_FILE, N_REPEAT, len(df), df.shape[1]))
+
+    formats = [('csv', '.csv', run_csv)]
+    if with_xlsx:
+        formats.append(('xlsx', '.xlsx', run_xlsx))
+    for compression in ('zstd', 'lz4', None):
+        formats.append(('parquet %s' % compression, '.parquet', run_columnar(compression)))
+        formats.append(('feather %s' % compression, '.feather', run_columnar(compression)))
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print('%-16s %10s %9s %9s %9s %9s' % ('format', 'size (kB)', 'write', 'read',
+                                              'logs', 'range'))
+        for name, file_ext, get_functions in formats:
+            file_loc = os.path.join(tmp_dir, 'well' + file_ext)
+            functions = get_functions(df, file_loc, columns, depth_range)
+            # xlsx is too slow to repeat
+            n_repeat = 1 if file_ext == '.xlsx' else repeat
+            times = [min(timeit.repeat(function, number=1, repeat=n_repeat))
+                     for function in functions]
+            print('%-16s %10.0f %8.3fs %8.3fs %8.3fs %8.3fs'
+                  % ((name, os.path.getsize(file_loc) / 1024) + tuple(times)))
+
+            # every format reads back the same depth range
+            n_range = len(functions[3]())
+            depth = df.iloc[:, 0]
+            assert n_range == ((depth >= depth_range[0]) & (depth <= depth_range[1])).sum()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    run()
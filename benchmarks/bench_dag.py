@@ -0,0 +1,47 @@
+import glob
+import os
+import shutil
+import tempfile
+import time
+
+from rockprops.dag import run_wells
+
+"""
+Time of the cached well DAG: first run, run with every stage cached, and runs after one
+parameter changed, over the cleaned wells of input/cleaned_up
+Run from the project root: python -m benchmarks.bench_dag
+"""
+
+
+def timed_run(wells, cache_dir, **params):
+    start = time.perf_counter()
+    runs = run_wells(wells, cache_dir=cache_dir, **params)
+    seconds = time.perf_counter() - start
+    computed = sorted(set(name for run in runs.values() for name, stats in run.stats.items()
+                          if stats.status == 'computed'))
+    return seconds, computed
+
+
+def run(workers=1):
+    wells = {os.path.basename(file_loc): [file_loc]
+             for file_loc in sorted(glob.glob(os.path.join('input', 'cleaned_up', '*.csv')))}
+    params = dict(area=60.1, mud_weight=14.0, workers=workers)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cases = [
+            ('first run', params),
+            ('all cached', params),
+            ('gr_cutoff changed', dict(params, gr_cutoff=70, porosity_method=1)),
+            ('mud weight changed', dict(params, mud_weight=14.5)),
+            ('pump efficiency changed', dict(params, pump_efficiency=0.5)),
+        ]
+        print('%d wells, %d workers' % (len(wells), workers))
+        for name, case_params in cases:
+            seconds, computed = timed_run(wells, cache_dir, **case_params)
+            print('    %-24s %.3f s, computed: %s' % (name, seconds, ', '.join(computed) or 'nothing'))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,61 @@
+import os
+import timeit
+
+import numpy as np
+
+from configuration import ROOT_DIR
+from utils.logscleanup import get_specific_attr_mapping, EDR_LOGS_NAMES, MWD_LOGS_NAMES
+from utils.las import read_las_values
+
+"""
+Compare the bulk LAS reader against the previous row-by-row reader
+Run from the project root: python -m benchmarks.bench_las_reader
+"""
+
+LAS_FILES = (
+    (os.path.join(ROOT_DIR, 'input_template', 'Middleton Unit B 47-38 No. 8SH__From EDR.las'),
+     EDR_LOGS_NAMES),
+    (os.path.join(ROOT_DIR, 'input_template', 'LAS Middleton Unit B 47-38 No. 8SH_From MWD.las'),
+     MWD_LOGS_NAMES),
+)
+
+
+def rowwise_read(las_file_loc, row_idx_start, col_idxes):
+    """Previous reader: split every row and convert each reading in Python"""
+    logs_values = []
+    with open(las_file_loc) as file:
+        for row_idx, row in enumerate(file):
+            if row_idx >= row_idx_start:
+                row = row.split()
+                logs_values.append([float(row[col_idx]) for col_idx in col_idxes])
+    return np.array(logs_values)
+
+
+def bulk_read(las_file_loc, col_idxes):
+    return read_las_values(las_file_loc, col_idxes=col_idxes)
+
+
+def run(repeat=5):
+    for las_file_loc, logs_names in LAS_FILES:
+        row_idx_start, attr_mapping_idx, _ = get_specific_attr_mapping(las_file_loc, logs_names)
+        col_idxes = list(attr_mapping_idx.values())
+
+        # both readers must agree, NULL readings become NaN in the bulk reader
+        old = rowwise_read(las_file_loc, row_idx_start, col_idxes)
+        new = bulk_read(las_file_loc, col_idxes)
+        assert old.shape == new.shape
+        assert np.array_equal(np.where(np.isnan(new), old, new), old)
+
+        t_old = min(timeit.repeat(lambda: rowwise_read(las_file_loc, row_idx_start, col_idxes),
+                                  number=1, repeat=repeat))
+        t_new = min(timeit.repeat(lambda: bulk_read(las_file_loc, col_idxes),
+                                  number=1, repeat=repeat))
+
+        print('%s' % os.path.basename(las_file_loc))
+        print('    rows: %d, curves: %d' % new.shape)
+        print('    row-by-row: %.4f s, bulk: %.4f s, speed-up: %.1fx'
+              % (t_old, t_new, t_old / t_new))
+
+
+if __name__ == '__main__':
+    run()
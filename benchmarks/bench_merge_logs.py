@@ -0,0 +1,138 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.logscleanup import merge_logs
+
+"""
+Scaling of merge_logs against the previous recursive intersect1d/isin/hstack merge
+Run from the project root: python -m benchmarks.bench_merge_logs
+"""
+
+
+def legacy_merge_logs(all_logs_reading_dicts, all_logs_values, primary_key='TVD'):
+    """"Previous merge: recursive intersect1d, isin filter and recursive hstack
+    Return:
+        - logs_reading_dict: combined log readings per log
+        - logs_values: numeric values of the logs
+    """
+
+    primary_key_list = []
+    non_primary_key_list = []
+    for log_reading_idx, log_reading in enumerate(all_logs_reading_dicts):
+        # check for primary key
+        if primary_key not in log_reading.keys():
+            raise ValueError('The primary key %s is missing in log %d.'
+                             % (primary_key, log_reading_idx+1))
+        else:
+            # find index of primary key in each dictionary
+            non_primary_key_idxes = []
+            for col_idx, col in enumerate(log_reading.keys()):
+                if col == primary_key:
+                    primary_key_list.append((col, col_idx))
+                else:
+                    non_primary_key_idxes.append((col, col_idx))
+            non_primary_key_list.append(non_primary_key_idxes)
+
+    # recursively find the common depth from all logs_reading_dict based on primary_key
+    # append all readings in all logs to a list according to primary key
+    log_values_primary_key = [logs_reading_dicts[primary_key]
+                              for logs_reading_dicts in all_logs_reading_dicts]
+
+    def _find_common_rows(S):
+        # recursive call to find common element
+        def _find(S, result, n):
+            if n == 0:
+                return result
+            result = np.intersect1d(S[n-1], result)
+            return _find(S, result, n-1)
+        return _find(S, result=S[len(S)-1], n=len(S))
+
+    primary_rows = _find_common_rows(log_values_primary_key)
+
+    # filter out rows correspond to primary rows
+    for logs_idx, (primary_key, primary_key_idx) in enumerate(primary_key_list):
+        mask = np.isin(all_logs_values[logs_idx][:, primary_key_idx], primary_rows)
+        all_logs_values[logs_idx] = all_logs_values[logs_idx][mask, :]
+
+    # stack all logs values according to non primary keys
+    def _stack_cols(S, non_primary_key_list):
+        def _stack(S, non_primary_key_list, start, stop):
+
+            col_name_start = list(zip(*non_primary_key_list[start]))[0]
+            col_name_stop = list(zip(*non_primary_key_list[stop]))[0]
+            col_idx_start = list(zip(*non_primary_key_list[start]))[1]
+            col_idx_stop = list(zip(*non_primary_key_list[stop]))[1]
+            if start == stop:
+                for log_name, log_idx in zip(col_name_start, col_idx_start):
+                    new_dict[log_name] = S[start][:, log_idx]
+                new_stack = S[start][:, col_idx_start]
+                return new_stack
+            elif start == stop - 1:
+                for i, _logs_names, _logs_idx in \
+                        ((start, col_name_start, col_idx_start), (stop, col_name_stop, col_idx_stop)):
+                    for log_name, log_idx in zip(_logs_names, _logs_idx):
+                        new_dict[log_name] = S[i][:, log_idx]
+                new_stack = np.hstack((S[start][:, col_idx_start], S[stop][:, col_idx_stop]))
+                return new_stack
+            middle = (start + stop) // 2
+            left = _stack(S, non_primary_key_list, start, middle)
+            right = _stack(S, non_primary_key_list, middle+1, stop)
+            return np.hstack((left, right))
+        new_dict = OrderedDict()
+        return new_dict, _stack(S, non_primary_key_list, start=0, stop=len(S)-1)
+
+    all_logs_reading_dicts, all_logs_values = _stack_cols(all_logs_values, non_primary_key_list)
+
+    # append primary rows to the new stacked cols and dict
+    all_logs_values = np.hstack((all_logs_values, primary_rows.reshape(-1, 1)))
+    all_logs_reading_dicts[primary_key] = primary_rows
+
+    return all_logs_reading_dicts, all_logs_values
+
+
+def make_logs(n_logs, n_samples, n_cols=3, drop_fraction=0.05, seed=0):
+    """Synthetic logs on a 1 ft grid, each missing a random fraction of the depths"""
+    rng = np.random.RandomState(seed)
+    all_logs_reading_dicts, all_logs_values = [], []
+    for log_idx in range(n_logs):
+        depth = np.arange(n_samples, dtype=np.float64)
+        depth = depth[rng.rand(n_samples) > drop_fraction]
+        logs_values = np.column_stack([rng.rand(len(depth)) for _ in range(n_cols)] + [depth])
+        logs_reading_dict = OrderedDict()
+        for col_idx in range(n_cols):
+            logs_reading_dict['LOG%d_%d' % (log_idx, col_idx)] = logs_values[:, col_idx]
+        logs_reading_dict['TVD'] = logs_values[:, -1]
+        all_logs_reading_dicts.append(logs_reading_dict)
+        all_logs_values.append(logs_values)
+    return all_logs_reading_dicts, all_logs_values
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def run(n_logs=20, sizes=(10**4, 10**5, 10**6), legacy_max_size=10**6):
+    print('%d logs' % n_logs)
+    for n_samples in sizes:
+        all_logs_reading_dicts, all_logs_values = make_logs(n_logs, n_samples)
+
+        t_new, (new_dict, new_values) = timed(merge_logs, all_logs_reading_dicts, all_logs_values)
+        line = '    samples: %9d, merged rows: %8d, new: %.4f s' % (n_samples, len(new_values), t_new)
+
+        if n_samples <= legacy_max_size:
+            # legacy merge overwrites the list it is given
+            t_old, (old_dict, old_values) = timed(legacy_merge_logs, all_logs_reading_dicts,
+                                                  list(all_logs_values))
+            assert np.array_equal(old_values, new_values)
+            assert list(old_dict) == list(new_dict)
+            line += ', previous: %.4f s, speed-up: %.1fx' % (t_old, t_old / t_new)
+        print(line)
+
+
+if __name__ == '__main__':
+    run()
+    run(n_logs=40, sizes=(10**6, 2 * 10**6), legacy_max_size=0)
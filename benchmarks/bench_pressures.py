@@ -0,0 +1,83 @@
+import bisect
+import math
+import time
+import tracemalloc
+
+import numpy as np
+
+from rockprops.pressures import pressure_profile
+
+"""
+Time and peak memory of the chunked pressure engine against a station by station loop
+Run from the project root: python -m benchmarks.bench_pressures
+"""
+
+
+def make_survey(n_samples, seed=0):
+    """Vertical to 8000 ft, build to horizontal over 2000 ft, then a lateral that turns"""
+    rng = np.random.RandomState(seed)
+    md = np.linspace(0, 30000, n_samples)
+    inclination = np.clip((md - 8000) * 90 / 2000, 0, 90) + rng.normal(0, 0.1, n_samples)
+    azimuth = 45 + np.clip(md - 10000, 0, None) * 1e-3 + rng.normal(0, 0.1, n_samples)
+    return md, np.abs(inclination), azimuth
+
+
+def loop_profile(md, inclination, azimuth, schedule, diff_pres):
+    """Station by station minimum curvature and hydrostatic pressure, psi"""
+    tops, weights = zip(*schedule)
+    tvd, pressure = [md[0]], [0.052 * weights[0] * md[0]]
+    confining = [pressure[0] + diff_pres[0] * 1000 * 14.7 / 101325]
+    for i in range(1, len(md)):
+        inc1, inc2 = math.radians(inclination[i - 1]), math.radians(inclination[i])
+        azi1, azi2 = math.radians(azimuth[i - 1]), math.radians(azimuth[i])
+        cos_dogleg = math.cos(inc2 - inc1) - math.sin(inc1) * math.sin(inc2) * \
+            (1 - math.cos(azi2 - azi1))
+        dogleg = math.acos(min(1., max(-1., cos_dogleg)))
+        factor = 1. if dogleg < 1e-9 else 2 / dogleg * math.tan(dogleg / 2)
+        tvd.append(tvd[-1] + (md[i] - md[i - 1]) / 2 * (math.cos(inc1) + math.cos(inc2)) * factor)
+
+        mud_weight = weights[max(bisect.bisect_right(tops, md[i]) - 1, 0)]
+        pressure.append(pressure[-1] + 0.052 * mud_weight * (tvd[-1] - tvd[-2]))
+        confining.append(pressure[-1] + diff_pres[i] * 1000 * 14.7 / 101325)
+    return np.array(tvd), np.array(pressure), np.array(confining)
+
+
+def measure(func, trace_memory=False):
+    """Result, seconds and peak memory of func, tracing memory slows Python code down"""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def run(n_loop=200000, n_engine=10000000):
+    schedule = [(0, 8.8), (9000, 10.5), (12000, 12.)]
+
+    md, inclination, azimuth = make_survey(n_loop)
+    diff_pres = np.full(n_loop, 2000.)
+    loop, t_loop, _ = measure(lambda: loop_profile(md, inclination, azimuth, schedule, diff_pres))
+    engine, t_engine, _ = measure(lambda: pressure_profile(md, inclination, schedule, azimuth,
+                                                           diff_pres, out_unit='psi'))
+    # both compute the same profile
+    for values, reference in zip(engine, loop):
+        assert np.allclose(values, reference, rtol=1e-9, atol=1e-6)
+    print('%d samples' % n_loop)
+    print('    loop: %.3f s, engine: %.3f s, speed-up: %.0fx' % (t_loop, t_engine, t_loop / t_engine))
+
+    md, inclination, azimuth = make_survey(n_engine)
+    diff_pres = np.full(n_engine, 2000.)
+    _, t_engine, peak = measure(lambda: pressure_profile(md, inclination, schedule, azimuth,
+                                                         diff_pres), trace_memory=True)
+    print('%d samples' % n_engine)
+    print('    engine: %.3f s, peak %.0f MB (%.0f MB outputs)'
+          % (t_engine, peak / 1e6, 3 * n_engine * 8 / 1e6))
+
+
+if __name__ == '__main__':
+    run()
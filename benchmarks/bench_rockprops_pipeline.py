@@ -0,0 +1,72 @@
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import numpy as np
+
+from rockprops.rockprops import calculate_mse, calculate_ucs, calculate_ccs, \
+    calculate_youngmodulus, calculate_porosity, calculate_permeability
+from rockprops.pipeline import RockPropsPipeline, PROPERTIES
+
+"""
+Time and peak memory of the fused RockPropsPipeline against the chain of calculate_* functions
+Run from the project root: python -m benchmarks.bench_rockprops_pipeline
+"""
+
+
+def make_logs(n_samples, seed=0):
+    rng = np.random.RandomState(seed)
+    return OrderedDict([
+        ('WOB', rng.uniform(5, 25, n_samples)),
+        ('RPM', rng.uniform(40, 120, n_samples)),
+        ('TOR', rng.uniform(2, 20, n_samples)),
+        ('ROP', rng.uniform(50, 400, n_samples)),
+        ('GR', rng.uniform(20, 150, n_samples)),
+        ('DIFP', rng.uniform(500, 5000, n_samples)),
+        ('PC', rng.uniform(5000, 40000, n_samples)),
+    ])
+
+
+def run_functions(logs, area, porosity_method):
+    mse = calculate_mse(logs['WOB'], area, logs['RPM'], logs['TOR'], logs['ROP'])
+    ucs = calculate_ucs(mse)
+    ccs = calculate_ccs(ucs, logs['GR'], logs['DIFP'])
+    E = calculate_youngmodulus(ccs, logs['PC'])
+    porosity = calculate_porosity(ucs, logs['GR'], method=porosity_method)
+    permeability = calculate_permeability(porosity)
+    return OrderedDict([('mse', mse), ('ucs', ucs), ('ccs', ccs), ('E', E),
+                        ('porosity', porosity), ('permeability', permeability)])
+
+
+def profile(func, *args):
+    """Return time, peak memory allocated on top of the inputs, result"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+def run(n_samples=10**7, area=6, porosity_method=2):
+    logs = make_logs(n_samples)
+    pipeline = RockPropsPipeline(area, porosity_method=porosity_method)
+
+    t_old, peak_old, old = profile(run_functions, logs, area, porosity_method)
+    t_new, peak_new, new = profile(pipeline.run, logs)
+
+    for prop in PROPERTIES:
+        assert np.allclose(old[prop], new[prop], rtol=1e-12, atol=0)
+    # both return the six properties, the rest of the peak is temporaries
+    output = 6 * n_samples * 8
+
+    print('%d samples, porosity method %d' % (n_samples, porosity_method))
+    print('    calculate_*: %.3f s, peak %.0f MB (%.0f MB temporaries)'
+          % (t_old, peak_old / 1e6, (peak_old - output) / 1e6))
+    print('    pipeline:    %.3f s, peak %.0f MB (%.0f MB temporaries)'
+          % (t_new, peak_new / 1e6, (peak_new - output) / 1e6))
+
+
+if __name__ == '__main__':
+    run()
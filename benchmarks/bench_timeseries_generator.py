@@ -0,0 +1,73 @@
+import time
+
+import numpy as np
+
+from machine_learning.data_wrangling.preprocessing import timeseries_generator, \
+    input_output_concatenate
+
+"""
+Samples per second of timeseries_generator against the previous per-row copy loop
+Run from the project root: python -m benchmarks.bench_timeseries_generator
+"""
+
+
+def legacy_timeseries_generator(data_in, data_out, min_index=0, max_index=None, lookback=2,
+                                delay=0, include_out=True, shuffle=False, batch_size=32, step=1):
+    """Previous generator: one slice copy per row of the batch"""
+    if include_out:
+        data_in = input_output_concatenate(data_in, data_out)
+
+    if max_index is None:
+        max_index = len(data_in) - delay - 1
+    i = min_index + lookback
+
+    while True:
+        if shuffle:
+            rows = np.random.randint(min_index + lookback, max_index, size=batch_size)
+        else:
+            if i + batch_size >= max_index:
+                i = min_index + lookback
+            rows = np.arange(i, min(i + batch_size, max_index))
+            i += len(rows)
+
+        samples = np.zeros((len(rows), lookback // step, data_in.shape[-1]))
+        targets = np.zeros((len(rows), data_out.shape[-1]))
+        for j, row in enumerate(rows):
+            indices = range(rows[j] - lookback, rows[j], step)
+            samples[j] = data_in[indices]
+            targets[j] = data_out[rows[j] + delay]
+        yield samples, targets
+
+
+def samples_per_second(generator, n_batches, batch_size):
+    next(generator)
+    start = time.perf_counter()
+    for _ in range(n_batches):
+        next(generator)
+    return n_batches * batch_size / (time.perf_counter() - start)
+
+
+def run(n_samples=10**6, n_inputs=8, n_outputs=1, lookback=60, step=2, batch_size=256,
+        n_batches=400):
+    rng = np.random.RandomState(0)
+    data_in = rng.rand(n_samples, n_inputs)
+    data_out = rng.rand(n_samples, n_outputs)
+    params = dict(lookback=lookback, step=step, batch_size=batch_size, delay=1)
+
+    print('%d samples, %d inputs, lookback %d, step %d, batch size %d'
+          % (n_samples, n_inputs + n_outputs, lookback, step, batch_size))
+    for shuffle in (False, True):
+        cases = [
+            ('legacy', legacy_timeseries_generator(data_in, data_out, shuffle=shuffle, **params)),
+            ('take', timeseries_generator(data_in, data_out, shuffle=shuffle, **params)),
+            ('take, reused buffers', timeseries_generator(data_in, data_out, shuffle=shuffle,
+                                                          reuse_buffers=True, **params)),
+        ]
+        print('    shuffle=%s' % shuffle)
+        for name, generator in cases:
+            print('        %-22s %10.0f samples/s'
+                  % (name, samples_per_second(generator, n_batches, batch_size)))
+
+
+if __name__ == '__main__':
+    run()
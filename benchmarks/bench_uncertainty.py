@@ -0,0 +1,65 @@
+import time
+import tracemalloc
+
+import numpy as np
+
+from rockprops.pipeline import RockPropsPipeline, PSI_TO_MPA
+from rockprops.uncertainty import MonteCarloRockProps
+from benchmarks.bench_rockprops_pipeline import make_logs
+
+"""
+Time and peak memory of the broadcast Monte Carlo bands against a Python loop over
+the realizations
+Run from the project root: python -m benchmarks.bench_uncertainty
+"""
+
+
+def loop_bands(mc, logs, area):
+    """Every realization evaluated over the whole well one after the other, then percentiles"""
+    params = {name: values[:, 0] for name, values in mc.parameters.items()}
+    mse = RockPropsPipeline(area, properties=('mse',)).run(logs)['mse']
+    pres = logs['DIFP'] * 1000 * 14.7 / 101325
+    realizations = {prop: [] for prop in mc.properties}
+    for i in range(mc.n_realizations):
+        ucs = params['pump_efficiency'][i] * mse
+        shale = logs['GR'] > params['gr_cutoff'][i]
+        ccs = ucs * (1 + np.where(shale, params['ccs_k_shale'][i] * pres ** params['ccs_m_shale'][i],
+                                  params['ccs_k_sand'][i] * pres ** params['ccs_m_sand'][i]))
+        E = ccs * PSI_TO_MPA * params['E_a'][i] * (logs['PC'] / 1000) ** params['E_b'][i]
+        porosity = params['porosity_c'][i] / (logs['GR'] ** 0.25 * (ucs * PSI_TO_MPA) ** 0.47)
+        permeability = params['permeability_c'][i] * (100 * porosity) ** params['permeability_m'][i]
+        for prop, values in zip(('mse', 'ucs', 'ccs', 'E', 'porosity', 'permeability'),
+                                (mse, ucs, ccs, E, porosity, permeability)):
+            realizations[prop].append(values)
+    return {prop: np.percentile(np.array(values), mc.percentiles, axis=0)
+            for prop, values in realizations.items()}
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def run(n_samples=20000, n_realizations=2000, area=6):
+    logs = make_logs(n_samples)
+    mc = MonteCarloRockProps(area, n_realizations=n_realizations, seed=0)
+
+    bands, t_broadcast, peak_broadcast = measure(lambda: mc.run(logs))
+    reference, t_loop, peak_loop = measure(lambda: loop_bands(mc, logs, area))
+
+    for prop, prop_bands in reference.items():
+        for percentile, band in zip(mc.percentiles, prop_bands):
+            assert np.allclose(bands['%s p%g' % (prop, percentile)], band, rtol=1e-12)
+
+    print('%d samples x %d realizations' % (n_samples, n_realizations))
+    print('    loop: %.2f s, peak %.0f MB' % (t_loop, peak_loop / 1e6))
+    print('    broadcast: %.2f s, peak %.0f MB' % (t_broadcast, peak_broadcast / 1e6))
+
+
+if __name__ == '__main__':
+    run()
@@ -14,3 +14,18 @@ LOG_NAMES_UNITS_DICT = {
         'Gamma': 'API'
 }
 
+"""
+Mnemonics commonly used in LAS files for the logs above
+Used to find the logs in a LAS curve catalog
+"""
+
+LOG_MNEMONICS_DICT = {
+        'Hole Depth': ['DEPT', 'DEPTH', 'MD'],
+        'Rate Of Penetration': ['ROP'],
+        'Rotary RPM': ['RPM'],
+        'Rotary Torque': ['TOR', 'TORQUE'],
+        'Weight on Bit': ['WOB'],
+        'Differential Pressure': ['DIFP'],
+        'Inclination': ['INC', 'INCL'],
+        'Gamma': ['GR', 'GR_1', 'GRC']
+}
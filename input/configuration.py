@@ -1,3 +1,9 @@
 import os
 
 INPUT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# parsed wells saved by utils.logstore.WellStore
+STORE_DIR = os.sep.join((INPUT_DIR, 'store'))
+
+# results of the pipeline stages memoized by rockprops.dag.DiskCache
+CACHE_DIR = os.sep.join((INPUT_DIR, 'cache'))
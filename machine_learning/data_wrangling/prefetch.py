@@ -0,0 +1,204 @@
+import math
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    from tensorflow.keras.utils import Sequence
+except ImportError:
+    Sequence = object
+
+from .preprocessing import input_output_concatenate, get_windows, get_window_offsets, \
+    check_index_range
+
+"""
+Prefetching of training batches
+Batches are built by worker threads into a bounded queue while the model trains on the
+previous ones. Windows are gathered with np.take, which releases the GIL, so threads
+overlap with the model step without the copies of a process pool.
+tensorflow is optional: TimeseriesBatches is a keras Sequence when it is installed.
+"""
+
+
+class TimeseriesBatches(Sequence):
+    """Indexable batches of timeseries windows, a keras Sequence when tensorflow is installed
+    Same windows as preprocessing.timeseries_generator. In shuffle mode every window is
+    used once per epoch, in an order drawn from seed and the epoch number, so any batch
+    can be built by any worker and a run can be replayed.
+
+    batches = TimeseriesBatches(data_in, data_out, lookback=2, batch_size=200, shuffle=True)
+    samples, targets = batches[0]
+    model.fit(batches, epochs=10)
+    """
+
+    def __init__(self, data_in, data_out, min_index=0, max_index=None, lookback=2, delay=0,
+                 include_out=True, shuffle=False, batch_size=32, step=1, seed=0, **kwargs):
+        """kwargs: options of keras PyDataset (workers, use_multiprocessing, max_queue_size)"""
+        super().__init__(**kwargs)
+        if include_out:
+            data_in = input_output_concatenate(data_in, data_out)
+        self.data_in = np.asarray(data_in, dtype=np.float64)
+        self.data_out = np.asarray(data_out, dtype=np.float64)
+
+        max_index = check_index_range(len(self.data_out), min_index, max_index, delay)
+
+        self.lookback = lookback
+        self.delay = delay
+        self.step = step
+        self.shuffle = shuffle
+        self.batch_size = batch_size
+        self.seed = seed
+        self.shape = (len(get_window_offsets(lookback, step)), self.data_in.shape[-1])
+
+        self.rows = np.arange(min_index + lookback, max_index)
+        self.epoch = 0
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch):
+        """Draw the window order of an epoch"""
+        self.epoch = epoch
+        if self.shuffle:
+            self.order = np.random.RandomState([self.seed, epoch]).permutation(self.rows)
+        else:
+            self.order = self.rows
+
+    def on_epoch_end(self):
+        self.set_epoch(self.epoch + 1)
+
+    def __len__(self):
+        return math.ceil(len(self.rows) / self.batch_size)
+
+    def __getitem__(self, batch_idx):
+        if not 0 <= batch_idx < len(self):
+            raise IndexError('Batch %d out of %d batches.' % (batch_idx, len(self)))
+        rows = self.order[batch_idx * self.batch_size:(batch_idx + 1) * self.batch_size]
+        return get_windows(self.data_in, self.data_out, rows, lookback=self.lookback,
+                           delay=self.delay, step=self.step)
+
+
+class _Stop():
+    """Queue item marking the end of the source"""
+
+    def __init__(self, error=None):
+        self.error = error
+
+
+def prefetch_generator(generator, queue_size=8):
+    """Run a batch generator in a background thread, up to queue_size batches ahead
+    Batches must not be overwritten by the generator once yielded (reuse_buffers=False)
+    Exceptions of the generator are raised in the caller.
+    """
+    batches = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        """put with timeout so the thread ends once the consumer is gone, False then"""
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for batch in generator:
+                if not put(batch):
+                    return
+            put(_Stop())
+        except Exception as error:
+            put(_Stop(error))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            batch = batches.get()
+            if isinstance(batch, _Stop):
+                if batch.error is not None:
+                    raise batch.error
+                return
+            yield batch
+    finally:
+        stop.set()
+
+
+def prefetch_batches(batches, workers=2, queue_size=8, epochs=None):
+    """Yield the batches of an indexable source (TimeseriesBatches) in order,
+    built by worker threads up to queue_size batches ahead
+    Input:
+        epochs: number of epochs, endless if None; on_epoch_end is called between epochs
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        epoch = 0
+        while epochs is None or epoch < epochs:
+            pending = deque()
+            for batch_idx in range(len(batches)):
+                pending.append(executor.submit(batches.__getitem__, batch_idx))
+                if len(pending) >= queue_size:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+            epoch += 1
+            if hasattr(batches, 'on_epoch_end'):
+                batches.on_epoch_end()
+
+
+def prefetch(source, workers=2, queue_size=8, epochs=None):
+    """Prefetch the batches of a generator (timeseries_generator, DataBuilder.batch_generator)
+    or of an indexable source (TimeseriesBatches)"""
+    if hasattr(source, '__getitem__') and hasattr(source, '__len__'):
+        return prefetch_batches(source, workers=workers, queue_size=queue_size, epochs=epochs)
+    return prefetch_generator(source, queue_size=queue_size)
+
+
+def to_tf_dataset(source, sample_shape, n_outputs, workers=2, queue_size=8):
+    """tf.data.Dataset of the prefetched batches of source, see prefetch
+    The dataset is iterated again at every epoch, so source is an indexable source
+    (TimeseriesBatches, one pass per epoch) or a function returning a new generator,
+    e.g. lambda: timeseries_generator(data_in, data_out, shuffle=True)
+    Input:
+        sample_shape: (timesteps, features) of one window
+        n_outputs: number of targets
+    """
+    import tensorflow as tf
+
+    if hasattr(source, '__getitem__') and hasattr(source, '__len__'):
+        def make_batches():
+            return prefetch_batches(source, workers=workers, queue_size=queue_size, epochs=1)
+    elif callable(source):
+        def make_batches():
+            return prefetch_generator(source(), queue_size=queue_size)
+    else:
+        raise ValueError('A generator can only be iterated once, give a function returning '
+                         'the generator.')
+
+    signature = (tf.TensorSpec(shape=(None,) + tuple(sample_shape), dtype=tf.float64),
+                 tf.TensorSpec(shape=(None, n_outputs), dtype=tf.float64))
+    return tf.data.Dataset.from_generator(make_batches, output_signature=signature)
+
+
+if __name__ == '__main__':
+    import time
+
+    rng = np.random.RandomState(0)
+    data_in, data_out = rng.rand(10**6, 8), rng.rand(10**6, 1)
+    batches = TimeseriesBatches(data_in, data_out, lookback=60, step=2, batch_size=256,
+                                shuffle=True)
+
+    def train_step(batch, seconds=0.002):
+        # stands in for the model step
+        time.sleep(seconds)
+
+    n_batches = 500
+    for name, source in (('serial', (batches[batch_idx] for batch_idx in range(n_batches))),
+                         ('prefetched', prefetch(batches, workers=2, epochs=1))):
+        start = time.perf_counter()
+        for _, batch in zip(range(n_batches), source):
+            train_step(batch)
+        print('%s: %.2f s' % (name, time.perf_counter() - start))
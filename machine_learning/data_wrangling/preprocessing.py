@@ -17,23 +17,81 @@ def input_output_concatenate(data_in, data_out):
     return np.concatenate((data_in, data_out), axis=1)
 
 
+def get_window_offsets(lookback=2, step=1):
+    """Offsets of the timesteps of a window relative to its row"""
+    if lookback % step:
+        raise ValueError('lookback (%d) must be a multiple of step (%d).' % (lookback, step))
+    return np.arange(-lookback, 0, step)
+
+
+def get_windows(data_in, data_out, rows, lookback=2, delay=0, step=1, samples=None, targets=None):
+    """Gather the input windows ending before each row and the target of each row
+    Each window is data_in[row - lookback:row:step] and its target is data_out[row + delay].
+    All windows are gathered with one indexed take, into samples and targets if given.
+    Return
+    - samples: (len(rows), lookback//step, n_inputs)
+    - targets: (len(rows), n_outputs)
+    """
+    offsets = get_window_offsets(lookback, step)
+    rows = np.asarray(rows)
+    if samples is None:
+        samples = np.empty((len(rows), len(offsets), data_in.shape[-1]))
+    if targets is None:
+        targets = np.empty((len(rows), data_out.shape[-1]))
+
+    # rows are checked by the callers, clip skips the bound check copy of mode='raise'
+    np.take(data_in, rows[:, np.newaxis] + offsets, axis=0, out=samples, mode='clip')
+    np.take(data_out, rows + delay, axis=0, out=targets, mode='clip')
+
+    return samples, targets
+
+
+def check_index_range(n_rows, min_index=0, max_index=None, delay=0):
+    """Check the rows windows are drawn from, rows min_index + lookback to max_index
+    (excluded) whose targets are delay rows later
+    Return:
+        max_index, n_rows - delay - 1 if None
+    """
+    if max_index is None:
+        max_index = n_rows - delay - 1
+    # the last window row is max_index - 1, its target max_index - 1 + delay
+    if max_index + delay > n_rows:
+        raise ValueError('max_index (%d) + delay (%d) is beyond the data (%d rows).'
+                         % (max_index, delay, n_rows))
+    if min_index < 0:
+        raise ValueError('min_index (%d) must not be negative.' % min_index)
+    return max_index
+
+
 def timeseries_generator(data_in, data_out, min_index=0, max_index=None, lookback=2, delay=0,
                          include_out=True,
-                         shuffle=False, batch_size=32, step=1):
+                         shuffle=False, batch_size=32, step=1, reuse_buffers=False,
+                         random_state=None):
     """Adopted and modified from Deep Learning by Francois Chollet, listing 6.33, page 211
+    Each batch is gathered with one indexed take (see get_windows).
+
+    reuse_buffers: yield the same samples/targets arrays, overwritten for every batch.
+        Only safe if each batch is consumed before the next one is requested
+    random_state: np.random.RandomState used to draw shuffled rows, np.random if None
     """
 
     # concatenate output as one of the input from previous timesteps
     if include_out:
         data_in = input_output_concatenate(data_in, data_out)
+    data_in = np.asarray(data_in, dtype=np.float64)
+    data_out = np.asarray(data_out, dtype=np.float64)
 
-    if max_index is None:
-        max_index = len(data_in) - delay - 1
+    max_index = check_index_range(len(data_out), min_index, max_index, delay)
     i = min_index + lookback
+    random_state = np.random if random_state is None else random_state
+
+    n_offsets = len(get_window_offsets(lookback, step))
+    samples_buffer = np.empty((batch_size, n_offsets, data_in.shape[-1]))
+    targets_buffer = np.empty((batch_size, data_out.shape[-1]))
 
     while True:
         if shuffle:
-            rows = np.random.randint(
+            rows = random_state.randint(
                 min_index + lookback, max_index, size=batch_size
             )
         else:
@@ -42,16 +100,14 @@ def timeseries_generator(data_in, data_out, min_index=0, max_index=None, lookbac
             rows = np.arange(i, min(i + batch_size, max_index))
             i += len(rows)                      # within batch_sizes and not exceeding max
 
-        # holder type for dataframe
-        samples = np.zeros((len(rows), lookback//step, data_in.shape[-1]))
-        targets = np.zeros((len(rows), data_out.shape[-1]))
-
-        for j, row in enumerate(rows):
-            indices = range(rows[j] - lookback, rows[j], step)
-            samples[j] = data_in[indices]
-            targets[j] = data_out[rows[j] + delay]
+        if reuse_buffers:
+            samples, targets = samples_buffer[:len(rows)], targets_buffer[:len(rows)]
+        else:
+            samples = np.empty((len(rows), n_offsets, data_in.shape[-1]))
+            targets = np.empty((len(rows), data_out.shape[-1]))
 
-        yield samples, targets
+        yield get_windows(data_in, data_out, rows, lookback=lookback, delay=delay, step=step,
+                          samples=samples, targets=targets)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,159 @@
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+"""
+Standard scaling fitted in one pass over chunks
+Per-column mean and variance are accumulated chunk by chunk and merged with the parallel
+formula of Chan et al., so statistics of many wells combine without loading them together.
+Batches are scaled as they are built instead of scaling a copy of the whole dataset.
+"""
+
+
+class StreamingScaler():
+    """Standardize columns to zero mean and unit variance, like sklearn StandardScaler
+
+    scaler = StreamingScaler(columns)
+    for chunk in chunks:
+        scaler.partial_fit(chunk)
+    scaler.transform(batch, copy=False)
+    """
+
+    def __init__(self, columns=None):
+        self.columns = None if columns is None else list(columns)
+        self.n_samples_ = 0
+        self.mean_ = None
+        self.m2_ = None
+
+    @property
+    def var_(self):
+        return self.m2_ / self.n_samples_
+
+    @property
+    def scale_(self):
+        """Standard deviation of each column, 1 for constant columns"""
+        scale = np.sqrt(self.var_)
+        scale[scale == 0] = 1.
+        return scale
+
+    def _merge_stats(self, n_samples, mean, m2):
+        if self.n_samples_ == 0:
+            self.n_samples_, self.mean_, self.m2_ = n_samples, mean, m2
+            return
+        if len(mean) != len(self.mean_):
+            raise ValueError('Cannot merge %d columns with %d columns.' % (len(mean), len(self.mean_)))
+
+        total = self.n_samples_ + n_samples
+        delta = mean - self.mean_
+        self.mean_ = self.mean_ + delta * (n_samples / total)
+        self.m2_ = self.m2_ + m2 + delta ** 2 * (self.n_samples_ * n_samples / total)
+        self.n_samples_ = total
+
+    def partial_fit(self, chunk):
+        """Update the statistics with the rows of a 2D chunk"""
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if chunk.ndim != 2:
+            raise ValueError('Expected a 2D chunk, got %d dimensions.' % chunk.ndim)
+        if not len(chunk):
+            return self
+        mean = chunk.mean(axis=0)
+        m2 = ((chunk - mean) ** 2).sum(axis=0)
+        self._merge_stats(len(chunk), mean, m2)
+        return self
+
+    def fit(self, data, chunk_size=1 << 16):
+        """Fit on a 2D array chunk by chunk, data may be memory-mapped"""
+        self.n_samples_, self.mean_, self.m2_ = 0, None, None
+        for start in range(0, len(data), chunk_size):
+            self.partial_fit(data[start:start + chunk_size])
+        return self
+
+    def merge(self, other):
+        """Add the statistics of a scaler fitted on other rows, e.g. another well"""
+        if other.n_samples_:
+            self._merge_stats(other.n_samples_, other.mean_, other.m2_)
+        return self
+
+    def select(self, col_idxes):
+        """Scaler of a subset of the columns"""
+        scaler = StreamingScaler(None if self.columns is None else
+                                 [self.columns[col_idx] for col_idx in col_idxes])
+        scaler.n_samples_ = self.n_samples_
+        scaler.mean_, scaler.m2_ = self.mean_[col_idxes], self.m2_[col_idxes]
+        return scaler
+
+    def transform(self, data, copy=True):
+        """Scale the last axis of data, in place if copy is False (data must be float64)"""
+        if self.mean_ is None:
+            raise ValueError('The scaler is not fitted.')
+        data = np.array(data, dtype=np.float64) if copy else data
+        data -= self.mean_
+        data /= self.scale_
+        return data
+
+    def inverse_transform(self, data, copy=True):
+        """Undo transform"""
+        if self.mean_ is None:
+            raise ValueError('The scaler is not fitted.')
+        data = np.array(data, dtype=np.float64) if copy else data
+        data *= self.scale_
+        data += self.mean_
+        return data
+
+    def to_dict(self):
+        return OrderedDict([
+            ('columns', self.columns),
+            ('n_samples', self.n_samples_),
+            ('mean', None if self.mean_ is None else self.mean_.tolist()),
+            ('m2', None if self.m2_ is None else self.m2_.tolist()),
+        ])
+
+    @classmethod
+    def from_dict(cls, scaler_dict):
+        scaler = cls(scaler_dict['columns'])
+        scaler.n_samples_ = scaler_dict['n_samples']
+        if scaler_dict['mean'] is not None:
+            scaler.mean_ = np.array(scaler_dict['mean'])
+            scaler.m2_ = np.array(scaler_dict['m2'])
+        return scaler
+
+    def save(self, file_loc, **info):
+        """Save the statistics as json, info is saved with them (e.g. wells fitted on)"""
+        scaler_dict = self.to_dict()
+        scaler_dict['info'] = info
+        os.makedirs(os.path.dirname(os.path.abspath(file_loc)), exist_ok=True)
+        with open(file_loc, 'w') as file:
+            json.dump(scaler_dict, file, indent=1)
+
+    @classmethod
+    def load(cls, file_loc):
+        """Return the scaler saved in file_loc and its info"""
+        with open(file_loc) as file:
+            scaler_dict = json.load(file)
+        return cls.from_dict(scaler_dict), scaler_dict.get('info', {})
+
+
+def scale_batches(batches, sample_scaler, target_scaler=None):
+    """Scale (samples, targets) batches in place as they are yielded
+    Batches must be new arrays (not reused buffers of the generator)"""
+    for samples, targets in batches:
+        sample_scaler.transform(samples, copy=False)
+        if target_scaler is not None:
+            target_scaler.transform(targets, copy=False)
+        yield samples, targets
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+    wells = [rng.normal(rng.uniform(0, 100, 4), rng.uniform(1, 10, 4), (n_samples, 4))
+             for n_samples in (1000, 25000, 300)]
+
+    # one scaler per well, merged
+    scaler = StreamingScaler()
+    for well in wells:
+        scaler.merge(StreamingScaler().fit(well, chunk_size=4096))
+
+    data = np.concatenate(wells)
+    print(np.allclose(scaler.mean_, data.mean(axis=0)), np.allclose(scaler.var_, data.var(axis=0)))
@@ -1,8 +1,377 @@
+import json
+import logging
+import math
+import os
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from utils.filescleanup import OUTPUT_DIR
+from utils.logstore import WellStore
+from machine_learning.data_wrangling.preprocessing import get_windows, get_window_offsets
+from machine_learning.data_wrangling.scaler import StreamingScaler
+
 """
 Base class to pre-process data prior to training
-
+Every cleaned well is parsed once into the WellStore and opened memory-mapped, so the
+dataset can be larger than RAM. Wells are split into segments (train/validation/test) and
+batches are built block by block: each block of a segment is read once per epoch and its
+windows never cross a well boundary.
 """
 
+logger = logging.getLogger(__name__)
+
+WELL_FILE_EXTS = ('.csv', '.xlsx', '.parquet', '.feather')
+SPLITS = ('train', 'validation', 'test')
+
+# rows [start, stop) of a stored well
+Segment = namedtuple('Segment', ['well_name', 'start', 'stop'])
+
+
+def find_column(columns, name):
+    """Column of a cleaned well for a log name, cleaned columns are named 'log name,unit'"""
+    if name in columns:
+        return name
+    for column in columns:
+        if column.partition(',')[0] == name:
+            return column
+    return None
+
 
 class DataBuilder():
-    pass
\ No newline at end of file
+    """Index the cleaned wells and build timeseries batches across wells
+
+    builder = DataBuilder(['Rate Of Penetration', 'Weight on Bit'], ['Gamma'])
+    splits = builder.split_by_well((0.7, 0.1, 0.2))
+    train_generator = builder.batch_generator(splits['train'], lookback=2, shuffle=True)
+    model.fit(train_generator, steps_per_epoch=builder.steps_per_epoch(splits['train'], lookback=2))
+    """
+
+    def __init__(self, input_names, output_names, cleaned_dir=OUTPUT_DIR, store=None,
+                 wells=None):
+        """
+        Input:
+            input_names, output_names: logs, as log names or 'log name,unit' columns
+            cleaned_dir: directory of the cleaned well files
+            store: WellStore the wells are parsed into, default store if None
+            wells: file names of the wells to use, all files of cleaned_dir if None
+        """
+        self.input_names = list(input_names)
+        self.output_names = list(output_names)
+        self.cleaned_dir = cleaned_dir
+        self.store = store or WellStore()
+
+        # well name -> (input columns, output columns, n_samples, depth column)
+        self.wells = OrderedDict()
+        self.index(wells)
+
+    def index(self, wells=None):
+        """Parse new or changed wells into the store and record their columns"""
+        if wells is None:
+            wells = sorted(file_name for file_name in os.listdir(self.cleaned_dir)
+                           if os.path.splitext(file_name)[1].lower() in WELL_FILE_EXTS)
+
+        self.wells.clear()
+        for file_name in wells:
+            # cleaned wells are already filtered, keep every row
+            self.store.get(os.path.join(self.cleaned_dir, file_name), well_name=file_name,
+                           filternull=False)
+            meta = self.store.read_meta(file_name)
+            columns = [curve['name'] for curve in meta['curves']]
+
+            input_columns = [find_column(columns, name) for name in self.input_names]
+            output_columns = [find_column(columns, name) for name in self.output_names]
+            if None in input_columns or None in output_columns:
+                missing = [name for name, column in zip(self.input_names + self.output_names,
+                                                        input_columns + output_columns)
+                           if column is None]
+                logger.warning('Skip well %s, missing logs: %s', file_name, ', '.join(missing))
+                continue
+
+            self.wells[file_name] = (input_columns, output_columns, meta['n_samples'],
+                                     meta['depth_key'])
+
+        if not self.wells:
+            raise ValueError('No well in %s has all logs %s.'
+                             % (self.cleaned_dir, ', '.join(self.input_names + self.output_names)))
+
+    def split_by_well(self, fractions=(0.7, 0.1, 0.2), seed=0):
+        """Assign whole wells to train/validation/test
+        Wells go, largest first, to the split furthest below its fraction of the samples,
+        wells of equal size in an order shuffled with seed. Every split with a non-zero
+        fraction gets at least one well if there are enough wells
+        Return OrderedDict of split -> list of Segment
+        """
+        if len(fractions) != len(SPLITS):
+            raise ValueError('fractions must give the train, validation and test fractions.')
+
+        well_names = list(self.wells)
+        np.random.RandomState(seed).shuffle(well_names)
+        n_samples = OrderedDict((well_name, self.wells[well_name][2]) for well_name in well_names)
+        targets = np.asarray(fractions, dtype=np.float64) / np.sum(fractions) * \
+            sum(n_samples.values())
+
+        # largest wells first, each to the split furthest below its number of samples
+        # (ties of equal wells keep the shuffled order)
+        splits = OrderedDict((split, []) for split in SPLITS)
+        assigned = np.zeros(len(SPLITS))
+        for well_name in sorted(well_names, key=lambda well_name: -n_samples[well_name]):
+            split_idx = int(np.argmax(targets - assigned))
+            splits[SPLITS[split_idx]].append(well_name)
+            assigned[split_idx] += n_samples[well_name]
+
+        # an empty split takes the smallest well of the split with the largest surplus
+        for split_idx, (split, fraction) in enumerate(zip(SPLITS, fractions)):
+            if fraction > 0 and not splits[split]:
+                donors = [other_idx for other_idx, other in enumerate(SPLITS)
+                          if len(splits[other]) > 1]
+                if not donors:
+                    continue
+                surplus = assigned - targets
+                donor_idx = max(donors, key=lambda other_idx: surplus[other_idx])
+                donor = splits[SPLITS[donor_idx]]
+                well_name = min(donor, key=lambda well_name: n_samples[well_name])
+                donor.remove(well_name)
+                splits[split].append(well_name)
+                assigned[donor_idx] -= n_samples[well_name]
+                assigned[split_idx] += n_samples[well_name]
+
+        for split in SPLITS:
+            splits[split] = [Segment(well_name, 0, n_samples[well_name])
+                             for well_name in splits[split]]
+        return splits
+
+    def split_by_depth(self, fractions=(0.7, 0.1, 0.2), depth_ranges=None):
+        """Split every well by depth: train on the shallow part, validate and test deeper
+        Input:
+            fractions: fractions of the samples of each well, in depth order
+            depth_ranges: (top, bottom) of each split instead of fractions,
+                a sample belongs to a split if top <= depth < bottom
+        Return OrderedDict of split -> list of Segment
+        """
+        splits = OrderedDict((split, []) for split in SPLITS)
+        for well_name, (_, _, n_samples, depth_key) in self.wells.items():
+            if depth_ranges is None:
+                bounds = np.round(np.r_[0, np.cumsum(fractions)] / np.sum(fractions) * n_samples)
+                rows = zip(bounds[:-1], bounds[1:])
+            else:
+                # cleaned wells are sorted by depth, only the pages around the bounds are read
+                depth = self.store.load(well_name, [depth_key])[depth_key]
+                rows = [(np.searchsorted(depth, top, side='left'),
+                         np.searchsorted(depth, bottom, side='left'))
+                        for top, bottom in depth_ranges]
+
+            for split, (start, stop) in zip(SPLITS, rows):
+                if stop > start:
+                    splits[split].append(Segment(well_name, int(start), int(stop)))
+
+        return splits
+
+    def scaler_loc(self, name):
+        """Scaler file saved next to the stored wells"""
+        return os.path.join(self.store.store_dir, 'scalers', name + '.json')
+
+    def fit_scaler(self, segments, name='train', refit=False, chunk_size=1 << 16):
+        """Scaler of the input and output columns fitted on the rows of the segments
+        Each segment is read chunk by chunk. The scaler is saved as name and loaded back
+        while the segments and the wells they come from are unchanged.
+        Columns of the scaler are the input names followed by the output names.
+        """
+        info = OrderedDict([
+            ('segments', [list(segment) for segment in segments]),
+            ('hashes', [self.store.read_meta(well_name)['source']['hash']
+                        for well_name, _, _ in segments]),
+        ])
+        info = json.loads(json.dumps(info))
+        scaler_loc = self.scaler_loc(name)
+        if not refit and os.path.isfile(scaler_loc):
+            scaler, saved_info = StreamingScaler.load(scaler_loc)
+            if saved_info == info and scaler.columns == self.input_names + self.output_names:
+                return scaler
+
+        scaler = StreamingScaler(self.input_names + self.output_names)
+        for well_name, start, stop in segments:
+            input_columns, output_columns, _, _ = self.wells[well_name]
+            curves = list(self.store.load(well_name, input_columns + output_columns).values())
+            for chunk_start in range(start, stop, chunk_size):
+                chunk_stop = min(chunk_start + chunk_size, stop)
+                chunk = np.empty((chunk_stop - chunk_start, len(curves)))
+                for col_idx, curve in enumerate(curves):
+                    chunk[:, col_idx] = curve[chunk_start:chunk_stop]
+                scaler.partial_fit(chunk)
+
+        scaler.save(scaler_loc, **info)
+        return scaler
+
+    def _get_blocks(self, segments, lookback, delay, block_size):
+        """Blocks of window rows (well, first row, end row) of all segments"""
+        blocks = []
+        for well_name, start, stop in segments:
+            # a window needs lookback rows before its row and its target delay rows after
+            first, end = start + lookback, stop - delay
+            for block_start in range(first, end, block_size):
+                blocks.append((well_name, block_start, min(block_start + block_size, end)))
+        return blocks
+
+    def n_windows(self, segments, lookback=2, delay=0):
+        """Number of windows of the segments"""
+        return sum(max(stop - delay - start - lookback, 0) for _, start, stop in segments)
+
+    def steps_per_epoch(self, segments, lookback=2, delay=0, batch_size=32):
+        """Number of batches batch_generator yields per epoch"""
+        return math.ceil(self.n_windows(segments, lookback, delay) / batch_size)
+
+    def _read_blocks(self, blocks, lookback, delay, include_out):
+        """Read the rows of the blocks into one input and one output array
+        Return
+        - data_in, data_out
+        - rows: window rows of all blocks in data_in
+        """
+        block_data_in, block_data_out, rows = [], [], []
+        offset = 0
+        for well_name, block_start, block_end in blocks:
+            input_columns, output_columns, _, _ = self.wells[well_name]
+            curves = self.store.load(well_name, input_columns + output_columns)
+            read_start, read_stop = block_start - lookback, block_end + delay
+
+            data = np.empty((read_stop - read_start, len(curves)))
+            for col_idx, curve in enumerate(curves.values()):
+                data[:, col_idx] = curve[read_start:read_stop]
+            data_in, data_out = data[:, :len(input_columns)], data[:, len(input_columns):]
+            block_data_in.append(data if include_out else data_in)
+            block_data_out.append(data_out)
+
+            rows.append(np.arange(offset + lookback, offset + lookback + block_end - block_start))
+            offset += len(data)
+
+        return np.concatenate(block_data_in), np.concatenate(block_data_out), np.concatenate(rows)
+
+    def _split_scaler(self, scaler, include_out):
+        """Scalers of the input windows and of the targets"""
+        n_inputs = len(self.input_names)
+        input_scaler = scaler if include_out else scaler.select(np.arange(n_inputs))
+        output_scaler = scaler.select(np.arange(n_inputs, len(scaler.mean_)))
+        return input_scaler, output_scaler
+
+    def sample_windows(self, segments, n_samples, lookback=2, delay=0, include_out=True, step=1,
+                       block_size=1 << 15, seed=None, scaler=None):
+        """n_samples windows of the segments drawn uniformly without replacement
+        Windows are returned in the order of the segments, only the blocks holding drawn
+        windows are read.
+        Return:
+            samples, targets as yielded by batch_generator
+        """
+        get_window_offsets(lookback, step)
+        blocks = self._get_blocks(segments, lookback, delay, block_size)
+        block_sizes = np.array([block_end - block_start for _, block_start, block_end in blocks])
+        n_windows = block_sizes.sum()
+        if n_samples > n_windows:
+            raise ValueError('Cannot draw %d windows out of %d.' % (n_samples, n_windows))
+        window_idxes = np.sort(np.random.RandomState(seed).choice(n_windows, n_samples,
+                                                                  replace=False))
+        if scaler is not None:
+            input_scaler, output_scaler = self._split_scaler(scaler, include_out)
+
+        # first window of each block in the numbering of all windows
+        block_firsts = np.concatenate(([0], np.cumsum(block_sizes)))
+        bounds = np.searchsorted(window_idxes, block_firsts)
+        all_samples, all_targets = [], []
+        for block_idx, block in enumerate(blocks):
+            block_idxes = window_idxes[bounds[block_idx]:bounds[block_idx + 1]]
+            if not len(block_idxes):
+                continue
+            data_in, data_out, rows = self._read_blocks([block], lookback, delay, include_out)
+            if scaler is not None:
+                input_scaler.transform(data_in, copy=False)
+                output_scaler.transform(data_out, copy=False)
+            samples, targets = get_windows(data_in, data_out,
+                                           rows[block_idxes - block_firsts[block_idx]],
+                                           lookback=lookback, delay=delay, step=step)
+            all_samples.append(samples)
+            all_targets.append(targets)
+        return np.concatenate(all_samples), np.concatenate(all_targets)
+
+    def batch_generator(self, segments, lookback=2, delay=0, include_out=True, shuffle=False,
+                        batch_size=32, step=1, block_size=1 << 15, blocks_in_memory=4, seed=None,
+                        epochs=None, scaler=None):
+        """Yield (samples, targets) batches of the windows of the segments
+        Windows of a segment end at rows start + lookback to stop - delay (excluded), the
+        windows of preprocessing.timeseries_generator with min_index=start and
+        max_index=stop - delay. This is one more window than its default max_index
+        (len - delay - 1), which leaves out the last window whose target exists.
+        An epoch reads each block of block_size windows once. In shuffle mode blocks are
+        visited in random order and the windows of blocks_in_memory blocks, possibly from
+        different wells, are shuffled together.
+        Every batch has batch_size windows except the last one of each epoch.
+
+        Input:
+            seed: seed of the shuffles, each epoch draws a new order from it
+            epochs: number of epochs to yield, endless if None (as needed by Keras fit)
+            scaler: scaler from fit_scaler, applied to each block as it is read
+        """
+        get_window_offsets(lookback, step)
+        blocks = self._get_blocks(segments, lookback, delay, block_size)
+        if not blocks:
+            raise ValueError('The segments have no window of lookback %d and delay %d.'
+                             % (lookback, delay))
+        random_state = np.random.RandomState(seed)
+        if scaler is not None:
+            input_scaler, output_scaler = self._split_scaler(scaler, include_out)
+
+        epoch = 0
+        while epochs is None or epoch < epochs:
+            epoch += 1
+            order = random_state.permutation(len(blocks)) if shuffle else np.arange(len(blocks))
+
+            # windows of the previous blocks not yet yielded
+            leftover = None
+            for group_start in range(0, len(blocks), blocks_in_memory if shuffle else 1):
+                group = [blocks[block_idx] for block_idx in
+                         order[group_start:group_start + (blocks_in_memory if shuffle else 1)]]
+                data_in, data_out, rows = self._read_blocks(group, lookback, delay, include_out)
+                if scaler is not None:
+                    input_scaler.transform(data_in, copy=False)
+                    output_scaler.transform(data_out, copy=False)
+                if shuffle:
+                    random_state.shuffle(rows)
+
+                batch_start = 0
+                if leftover is not None:
+                    # complete the leftover batch with the first windows of this group
+                    batch_start = batch_size - len(leftover[0])
+                    samples, targets = get_windows(data_in, data_out, rows[:batch_start],
+                                                   lookback=lookback, delay=delay, step=step)
+                    samples = np.concatenate((leftover[0], samples))
+                    targets = np.concatenate((leftover[1], targets))
+                    if len(samples) < batch_size:
+                        leftover = samples, targets
+                        continue
+                    leftover = None
+                    yield samples, targets
+
+                for batch_start in range(batch_start, len(rows), batch_size):
+                    batch = get_windows(data_in, data_out, rows[batch_start:batch_start + batch_size],
+                                        lookback=lookback, delay=delay, step=step)
+                    if len(batch[0]) < batch_size:
+                        leftover = batch
+                    else:
+                        yield batch
+
+            if leftover is not None:
+                yield leftover
+
+
+if __name__ == '__main__':
+    builder = DataBuilder(['Rate Of Penetration', 'Rotary RPM', 'Rotary Torque', 'Weight on Bit',
+                           'Differential Pressure'], ['Gamma'])
+    print(builder.wells.keys())
+
+    for splits in (builder.split_by_well(), builder.split_by_depth()):
+        for split, segments in splits.items():
+            print(split, segments, builder.steps_per_epoch(segments, batch_size=200))
+
+    splits = builder.split_by_depth()
+    train_generator = builder.batch_generator(splits['train'], lookback=2, shuffle=True,
+                                              batch_size=200, seed=0)
+    samples, targets = next(train_generator)
+    print(samples.shape, targets.shape)
@@ -0,0 +1,301 @@
+import argparse
+import json
+import logging
+import os
+import pickle
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from input.LOG_UNITS import LOG_NAMES_UNITS_DICT
+from utils.las import write_las
+from utils.logstore import WellStore, get_well_name
+from utils.tail import get_table_layout, get_depth_col_idx, find_layout_columns, follow
+from machine_learning.databuilder import find_column, WELL_FILE_EXTS
+from machine_learning.data_wrangling.preprocessing import get_window_offsets
+from machine_learning.data_wrangling.scaler import StreamingScaler
+
+"""
+Prediction of GR (or any trained output) from drilling parameters
+A model is saved with its scaler and window parameters in a model directory. Wells are
+predicted batch by batch from the memory-mapped WellStore, so memory does not grow with
+the well, and predictions are saved as a new curve of the store, a CSV or a LAS file.
+A growing file can also be followed to predict rows as they are logged.
+"""
+
+logger = logging.getLogger(__name__)
+
+MODEL_META = 'meta.json'
+OUTPUTS = ('store', 'csv', 'las')
+# file types the predictions can be written to
+OUTPUT_EXTS = {'csv': '.csv', 'las': '.las'}
+
+
+def save_model(model_dir, model, scaler, inputs, outputs, lookback=2, delay=0, step=1,
+               include_out=False):
+    """Save a trained model with its scaler and the window parameters it was trained with
+    Input:
+        model: sklearn-style model (pickled) or keras model (saved with model.save)
+        scaler: StreamingScaler of the inputs followed by the outputs (DataBuilder.fit_scaler)
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    is_keras = type(model).__module__.startswith(('keras', 'tensorflow'))
+    model_file = 'model.keras' if is_keras else 'model.pkl'
+    if is_keras:
+        model.save(os.path.join(model_dir, model_file))
+    else:
+        with open(os.path.join(model_dir, model_file), 'wb') as file:
+            pickle.dump(model, file)
+    scaler.save(os.path.join(model_dir, 'scaler.json'))
+
+    meta = OrderedDict([
+        ('model_file', model_file),
+        ('inputs', list(inputs)),
+        ('outputs', list(outputs)),
+        ('lookback', lookback),
+        ('delay', delay),
+        ('step', step),
+        ('include_out', include_out),
+        # sklearn models take windows flattened to (windows, lookback * features)
+        ('flatten', not is_keras),
+    ])
+    with open(os.path.join(model_dir, MODEL_META), 'w') as file:
+        json.dump(meta, file, indent=1)
+
+
+def load_model(model_dir):
+    """Return the Predictor of a model saved with save_model"""
+    with open(os.path.join(model_dir, MODEL_META)) as file:
+        meta = json.load(file)
+    model_loc = os.path.join(model_dir, meta.pop('model_file'))
+    if model_loc.endswith('.keras'):
+        from tensorflow import keras
+        model = keras.models.load_model(model_loc)
+    else:
+        with open(model_loc, 'rb') as file:
+            model = pickle.load(file)
+    scaler, _ = StreamingScaler.load(os.path.join(model_dir, 'scaler.json'))
+    return Predictor(model, scaler, **meta)
+
+
+class Predictor():
+    """Predict the outputs of a model for every depth step of a well
+
+    predictor = load_model('models/ridge_gr')
+    gr = predictor.predict([rop, rpm, torque, wob, diff_pres])
+    """
+
+    def __init__(self, model, scaler, inputs, outputs, lookback=2, delay=0, step=1,
+                 include_out=False, flatten=True):
+        self.model = model
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.lookback = lookback
+        self.delay = delay
+        self.step = step
+        self.include_out = include_out
+        self.flatten = flatten
+        self.offsets = get_window_offsets(lookback, step)
+
+        # logs read from the well, outputs are inputs of the windows if include_out
+        self.columns = self.inputs + (self.outputs if include_out else [])
+        n_inputs = len(self.inputs)
+        self.input_scaler = scaler if include_out else scaler.select(np.arange(n_inputs))
+        self.output_scaler = scaler.select(np.arange(n_inputs, n_inputs + len(self.outputs)))
+
+    def predict(self, curves, batch_size=1 << 14):
+        """Predict the outputs of every row
+        The window of row r is rows r - lookback to r - 1, its prediction is for row r + delay.
+        Rows without a complete window, or with NaN readings in it, are NaN.
+
+        Input:
+            curves: arrays of the logs in self.columns order, may be memory-mapped
+        Return:
+            predictions: (rows, outputs)
+        """
+        n_samples = len(curves[0])
+        predictions = np.full((n_samples, len(self.outputs)), np.nan)
+        first, end = self.lookback, n_samples - self.delay
+        block = np.empty((min(batch_size, max(end - first, 0)) + self.lookback, len(curves)))
+
+        for start in range(first, end, batch_size):
+            stop = min(start + batch_size, end)
+            # rows of the block read from the curves, windows only use the rows before
+            data = block[:stop - start + self.lookback]
+            for col_idx, curve in enumerate(curves):
+                data[:, col_idx] = curve[start - self.lookback:stop]
+            self.input_scaler.transform(data, copy=False)
+
+            windows = np.take(data, np.arange(stop - start)[:, np.newaxis] + self.lookback +
+                              self.offsets, axis=0)
+            valid = ~np.isnan(windows).any(axis=(1, 2))
+            if not valid.any():
+                continue
+            windows = windows[valid]
+            if self.flatten:
+                windows = windows.reshape(len(windows), -1)
+
+            batch_predictions = np.asarray(self.model.predict(windows), dtype=np.float64)
+            batch_predictions = batch_predictions.reshape(len(windows), len(self.outputs))
+            self.output_scaler.inverse_transform(batch_predictions, copy=False)
+            predictions[start + self.delay:stop + self.delay][valid] = batch_predictions
+
+        return predictions
+
+    def predicted_names(self):
+        return ['%s predicted' % output for output in self.outputs]
+
+
+def get_output_loc(source_loc, output, out_dir=None):
+    file_name = os.path.splitext(os.path.basename(source_loc))[0] + '_predicted' + \
+        OUTPUT_EXTS[output]
+    return os.path.join(out_dir or os.path.dirname(source_loc), file_name)
+
+
+def predict_file(predictor, source_loc, output='store', out_dir=None, store=None,
+                 batch_size=1 << 14):
+    """Predict a well file (LAS, CSV or XLSX) and save the predictions
+    Input:
+        output: 'store' adds the predictions as curves of the well in the WellStore,
+            'csv' or 'las' writes the well logs and predictions into out_dir
+            (next to the source if None)
+    Return:
+        summary dict of the file
+    """
+    if output not in OUTPUTS:
+        raise ValueError('Unknown output: %s.' % output)
+    start_time = time.perf_counter()
+    store = store or WellStore()
+    well_name = os.path.basename(source_loc)
+    store_name = get_well_name(source_loc)
+
+    # the well is parsed once into the store and read memory-mapped
+    logs_reading_dict = store.get(source_loc, well_name=store_name, filternull=False)
+    units = store.units(store_name)
+    columns = [find_column(list(logs_reading_dict), name) for name in predictor.columns]
+    if None in columns:
+        raise ValueError('Well %s has no log %s.'
+                         % (well_name, predictor.columns[columns.index(None)]))
+
+    predictions = predictor.predict([logs_reading_dict[column] for column in columns],
+                                    batch_size=batch_size)
+    predicted_names = predictor.predicted_names()
+    predicted_units = [LOG_NAMES_UNITS_DICT.get(output_name, '')
+                       for output_name in predictor.outputs]
+
+    out_loc = None
+    if output == 'store':
+        for col_idx, (name, unit) in enumerate(zip(predicted_names, predicted_units)):
+            store.add_curve(store_name, name, predictions[:, col_idx], unit)
+    else:
+        out_loc = get_output_loc(source_loc, output, out_dir)
+        logs_reading_dict = OrderedDict(logs_reading_dict)
+        for col_idx, (name, unit) in enumerate(zip(predicted_names, predicted_units)):
+            logs_reading_dict[name] = predictions[:, col_idx]
+            units[name] = unit
+        if output == 'las':
+            write_las(out_loc, logs_reading_dict, units, well_name=well_name)
+        else:
+            write_csv(out_loc, logs_reading_dict)
+
+    return {'file': well_name, 'rows': len(predictions),
+            'predicted': int((~np.isnan(predictions).any(axis=1)).sum()), 'output': out_loc,
+            'seconds': time.perf_counter() - start_time}
+
+
+def write_csv(out_loc, logs_reading_dict, chunk_size=1 << 16):
+    """Write logs to a CSV chunk by chunk"""
+    n_samples = len(next(iter(logs_reading_dict.values())))
+    for start in range(0, max(n_samples, 1), chunk_size):
+        chunk = pd.DataFrame(OrderedDict((name, np.asarray(values[start:start + chunk_size]))
+                                         for name, values in logs_reading_dict.items()))
+        chunk.to_csv(out_loc, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+
+def predict(model_dir, source, output='store', out_dir=None, batch_size=1 << 14, store=None):
+    """Predict a well file or every well file of a directory with a saved model
+    Return:
+        summary DataFrame with one row per file
+    """
+    predictor = load_model(model_dir)
+    if os.path.isdir(source):
+        source_locs = [os.path.join(source, file_name) for file_name in sorted(os.listdir(source))
+                       if os.path.splitext(file_name)[1].lower() in WELL_FILE_EXTS + ('.las',)]
+    else:
+        source_locs = [source]
+
+    summary = []
+    for source_loc in source_locs:
+        try:
+            summary.append(predict_file(predictor, source_loc, output, out_dir, store, batch_size))
+        except Exception:
+            logger.exception('Failed to predict %s.', source_loc)
+            summary.append({'file': os.path.basename(source_loc), 'rows': None, 'predicted': None,
+                            'output': None, 'seconds': None})
+
+    return pd.DataFrame(summary, columns=['file', 'rows', 'predicted', 'output', 'seconds'])
+
+
+def predict_stream(predictor, file_loc, out_loc=None, offset=None, poll_seconds=1.,
+                   timeout=None):
+    """Predict the rows appended to a growing CSV or LAS file
+    Only the last lookback + delay rows are kept between reads.
+    Input:
+        out_loc: CSV the depth and predictions of the new rows are appended to
+        offset, poll_seconds, timeout: see utils.tail.follow
+    Yield:
+        depth, predictions and file offset of each read
+    """
+    layout = get_table_layout(file_loc)
+    col_idxes = list(find_layout_columns(file_loc, layout, predictor.columns)[0].values())
+    depth_col_idx = get_depth_col_idx(layout)
+
+    # only the depth and the predictor columns are parsed, depth last
+    history = np.empty((0, len(col_idxes) + 1))
+    n_history = predictor.lookback + predictor.delay
+    for values, offset in follow(file_loc, offset, poll_seconds, timeout, layout,
+                                 col_idxes + [depth_col_idx]):
+        if not len(values):
+            continue
+        buffer = np.concatenate((history, values))
+        predictions = predictor.predict([buffer[:, col_idx] for col_idx in range(len(col_idxes))])
+        predictions = predictions[len(history):]
+        depth = values[:, -1]
+        history = buffer[-n_history:]
+
+        if out_loc is not None:
+            new_file = not os.path.isfile(out_loc)
+            pd.DataFrame(np.column_stack((depth, predictions)),
+                         columns=[layout.columns[depth_col_idx]] + predictor.predicted_names()
+                         ).to_csv(out_loc, mode='a', header=new_file, index=False)
+
+        yield depth, predictions, offset
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    parser = argparse.ArgumentParser(description='Predict wells with a saved model.')
+    parser.add_argument('model_dir', help='directory of the model saved with save_model')
+    parser.add_argument('source', help='well file or directory of well files')
+    parser.add_argument('--output', choices=OUTPUTS, default='store')
+    parser.add_argument('--out-dir', default=None)
+    parser.add_argument('--batch-size', type=int, default=1 << 14)
+    parser.add_argument('--follow', action='store_true',
+                        help='follow the source file and predict rows as they are appended')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='stop following after this many seconds without new rows')
+    args = parser.parse_args()
+
+    if args.follow:
+        out_loc = os.path.join(args.out_dir or os.path.dirname(args.source),
+                               os.path.splitext(os.path.basename(args.source))[0] +
+                               '_predicted_stream.csv')
+        for depth, predictions, _ in predict_stream(load_model(args.model_dir), args.source,
+                                                    out_loc, timeout=args.timeout):
+            logger.info('Predicted %d rows, last depth %g.', len(depth), depth[-1])
+    else:
+        print(predict(args.model_dir, args.source, args.output, args.out_dir,
+                      args.batch_size).to_string(index=False))
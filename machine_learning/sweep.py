@@ -0,0 +1,235 @@
+import hashlib
+import importlib
+import itertools
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from configuration import ROOT_DIR
+from input.configuration import STORE_DIR
+from input.LOG_UNITS import LOG_NAMES_UNITS_DICT
+from utils.filescleanup import OUTPUT_DIR
+from utils.logstore import WellStore
+from machine_learning.databuilder import DataBuilder
+
+"""
+Sweep of GR prediction models over input logs and lookbacks
+Each configuration is fitted in a worker process. Workers open the wells memory-mapped from
+the WellStore, so only the configuration is sent to them, not the data. Every finished
+configuration is appended to one results csv and skipped when the sweep is run again.
+"""
+
+logger = logging.getLogger(__name__)
+
+RESULTS_LOC = os.sep.join((ROOT_DIR, 'output', 'sweep_results.csv'))
+RESULTS_COLUMNS = ['config_id', 'model', 'params', 'inputs', 'lookback', 'status',
+                   'n_train', 'n_validation', 'train_mse', 'validation_mse', 'validation_r2',
+                   'fit_seconds', 'predict_seconds', 'error']
+
+# model name -> (class path, parameters), classes follow the sklearn fit/predict interface
+MODELS = OrderedDict([
+    ('ridge', ('machine_learning.sweep.Ridge', {'alpha': 1.0})),
+    ('ridgecv', ('sklearn.linear_model.RidgeCV', {'alphas': [0.01, 0.1, 0.2, 0.5, 1, 2, 5, 10],
+                                                  'cv': 10})),
+    ('svr', ('sklearn.svm.SVR', {'C': 10, 'gamma': 'auto'})),
+])
+
+
+class Ridge():
+    """Ridge regression solved with the normal equations, for sweeps without sklearn"""
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+
+    def fit(self, X, y):
+        x_mean, y_mean = X.mean(axis=0), y.mean(axis=0)
+        X, y = X - x_mean, y - y_mean
+        self.coef_ = np.linalg.solve(X.T @ X + self.alpha * np.eye(X.shape[1]), X.T @ y)
+        self.intercept_ = y_mean - x_mean @ self.coef_
+        return self
+
+    def predict(self, X):
+        return X @ self.coef_ + self.intercept_
+
+
+def get_config_id(config):
+    """Hash of a configuration, used to skip finished configurations"""
+    return hashlib.blake2b(json.dumps(config, sort_keys=True).encode(),
+                           digest_size=8).hexdigest()
+
+
+def get_scaler_name(inputs, outputs, split):
+    return 'sweep_%s' % get_config_id({'inputs': inputs, 'outputs': outputs, 'split': split})
+
+
+def get_split(builder, split, fractions):
+    if split == 'depth':
+        return builder.split_by_depth(fractions)
+    if split == 'well':
+        return builder.split_by_well(fractions)
+    raise ValueError('Unknown split: %s.' % split)
+
+
+def get_windows_matrix(builder, segments, lookback, scaler, max_windows=None, seed=0):
+    """Scaled windows of the segments flattened to (windows, lookback * inputs), and targets"""
+    n_windows = builder.n_windows(segments, lookback)
+    if max_windows is not None and max_windows < n_windows:
+        # uniform over all windows, not the windows of the first shuffled blocks
+        samples, targets = builder.sample_windows(segments, max_windows, lookback=lookback,
+                                                  include_out=False, seed=seed, scaler=scaler)
+    else:
+        batches = builder.batch_generator(segments, lookback=lookback, include_out=False,
+                                          batch_size=max(n_windows, 1), epochs=1, scaler=scaler)
+        samples, targets = next(batches)
+    return samples.reshape(len(samples), -1), targets
+
+
+def run_config(config, store_dir=STORE_DIR, cleaned_dir=OUTPUT_DIR):
+    """Fit and evaluate one configuration, return its results row"""
+    model_path, params = config['model_path'], config['params']
+    module_name, _, class_name = model_path.rpartition('.')
+    model = getattr(importlib.import_module(module_name), class_name)(**params)
+
+    builder = DataBuilder(config['inputs'], config['outputs'], cleaned_dir=cleaned_dir,
+                          store=WellStore(store_dir), wells=config['wells'])
+    splits = get_split(builder, config['split'], config['fractions'])
+    scaler = builder.fit_scaler(splits['train'],
+                                name=get_scaler_name(config['inputs'], config['outputs'],
+                                                     config['split']))
+
+    train_X, train_y = get_windows_matrix(builder, splits['train'], config['lookback'], scaler,
+                                          config['max_train_windows'])
+    validation_X, validation_y = get_windows_matrix(builder, splits['validation'],
+                                                    config['lookback'], scaler)
+    # sklearn models expect 1D targets for one output
+    if train_y.shape[1] == 1:
+        train_y, validation_y = train_y[:, 0], validation_y[:, 0]
+
+    start = time.perf_counter()
+    model.fit(train_X, train_y)
+    fit_seconds = time.perf_counter() - start
+    train_mse = np.mean((model.predict(train_X) - train_y) ** 2)
+    start = time.perf_counter()
+    validation_pred = model.predict(validation_X)
+    predict_seconds = time.perf_counter() - start
+
+    validation_mse = np.mean((validation_pred - validation_y) ** 2)
+    validation_r2 = 1 - validation_mse / np.var(validation_y) if len(validation_y) else np.nan
+
+    return {'n_train': len(train_X), 'n_validation': len(validation_X), 'train_mse': train_mse,
+            'validation_mse': validation_mse, 'validation_r2': validation_r2,
+            'fit_seconds': fit_seconds, 'predict_seconds': predict_seconds}
+
+
+def read_results(results_loc=RESULTS_LOC):
+    if not os.path.isfile(results_loc):
+        return pd.DataFrame(columns=RESULTS_COLUMNS)
+    return pd.read_csv(results_loc)
+
+
+def append_result(result, results_loc=RESULTS_LOC):
+    """Append one results row, so an interrupted sweep keeps its finished configurations"""
+    os.makedirs(os.path.dirname(results_loc), exist_ok=True)
+    pd.DataFrame([result], columns=RESULTS_COLUMNS).to_csv(
+        results_loc, mode='a', header=not os.path.isfile(results_loc), index=False)
+
+
+def run_sweep(models, input_sets, lookbacks, output_names=('Gamma',), split='depth',
+              fractions=(0.7, 0.1, 0.2), max_train_windows=None, workers=1, wells=None,
+              results_loc=RESULTS_LOC, store_dir=STORE_DIR, cleaned_dir=OUTPUT_DIR):
+    """Fit every model on every input set and lookback
+    Input:
+        models: model names of MODELS, or dict of name -> (class path, parameters)
+        input_sets: lists of input logs, names of LOG_NAMES_UNITS_DICT
+        lookbacks: window lengths, in samples
+        split: 'depth' or 'well', see DataBuilder.split_by_depth, split_by_well
+        max_train_windows: random subset of the training windows for slow models (SVR)
+        workers: number of processes fitting configurations at the same time,
+            all CPUs if None
+        wells: file names of the cleaned wells to use, all if None
+    Return:
+        results DataFrame of the whole sweep, including earlier runs
+    """
+    if not isinstance(models, dict):
+        models = OrderedDict((name, MODELS[name]) for name in models)
+    output_names = list(output_names)
+    for log_name in set(itertools.chain(output_names, *input_sets)):
+        if log_name not in LOG_NAMES_UNITS_DICT:
+            raise ValueError('Unknown log: %s.' % log_name)
+
+    store = WellStore(store_dir)
+    configs = []
+    for inputs in input_sets:
+        # wells are parsed and scalers fitted here once, workers only read them
+        builder = DataBuilder(inputs, output_names, cleaned_dir=cleaned_dir, store=store,
+                              wells=wells)
+        builder.fit_scaler(get_split(builder, split, fractions)['train'],
+                           name=get_scaler_name(list(inputs), output_names, split))
+        for (model, (model_path, params)), lookback in itertools.product(models.items(), lookbacks):
+            configs.append(OrderedDict([
+                ('model', model), ('model_path', model_path), ('params', params),
+                ('inputs', list(inputs)), ('outputs', output_names), ('lookback', lookback),
+                ('split', split), ('fractions', list(fractions)),
+                ('max_train_windows', max_train_windows), ('wells', list(builder.wells)),
+            ]))
+
+    results = read_results(results_loc)
+    done = set(results.loc[results['status'] == 'done', 'config_id'])
+    pending = []
+    for config in configs:
+        config_id = get_config_id(config)
+        if config_id in done:
+            logger.info('Skipping %s %s lookback %d, already done.',
+                        config['model'], config['inputs'], config['lookback'])
+        else:
+            pending.append((config_id, config))
+
+    def get_row(config_id, config, status, metrics=None, error=None):
+        row = {'config_id': config_id, 'model': config['model'],
+               'params': json.dumps(config['params']), 'inputs': json.dumps(config['inputs']),
+               'lookback': config['lookback'], 'status': status, 'error': error}
+        row.update(metrics or {})
+        return row
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        if executor is None:
+            outcomes = ((config_id, config, lambda config=config: run_config(config, store_dir,
+                                                                              cleaned_dir))
+                        for config_id, config in pending)
+        else:
+            futures = {executor.submit(run_config, config, store_dir, cleaned_dir):
+                       (config_id, config) for config_id, config in pending}
+            outcomes = ((futures[future] + (future.result,)) for future in as_completed(futures))
+
+        # a configuration that fails is recorded instead of stopping the sweep
+        for config_id, config, result in outcomes:
+            try:
+                row = get_row(config_id, config, 'done', result())
+            except Exception as error:
+                logger.exception('Failed to run %s %s lookback %d.',
+                                 config['model'], config['inputs'], config['lookback'])
+                row = get_row(config_id, config, 'failed', error=repr(error))
+            append_result(row, results_loc)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # failed configurations run again are kept with their last outcome only
+    return read_results(results_loc).drop_duplicates('config_id', keep='last')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(message)s')
+
+    drilling = ['Rate Of Penetration', 'Rotary RPM', 'Rotary Torque', 'Weight on Bit',
+                'Differential Pressure']
+    results = run_sweep(['ridge', 'ridgecv', 'svr'], [drilling, drilling[:3]], [1, 2, 5],
+                        max_train_windows=20000, workers=None)
+    print(results.sort_values('validation_mse').to_string(index=False))
@@ -1,2 +1,9 @@
-from .pressures import hydsta_pres, conf_pres
+from .pressures import hydsta_pres, conf_pres, pressure_profile, minimum_curvature
 from .rockprops import *
+from .pipeline import RockPropsPipeline
+from .statistics import interval_stats, rolling_stats, tops_to_intervals
+from .uncertainty import MonteCarloRockProps
+from .coefficients import get_coefficients, use_coefficients
+from .calibration import calibrate, load_lab_data
+from .dag import DAG, DiskCache, Node, run_wells
+from .batch import run_batch
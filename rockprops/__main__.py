@@ -0,0 +1,99 @@
+import argparse
+import logging
+import os
+import sys
+
+from input.configuration import CACHE_DIR
+from utils.readfile import read
+from rockprops.batch import OUTPUT_EXTS, SUMMARY_FILE, run_batch
+from rockprops.pipeline import PROPERTIES
+
+"""
+Command line of the rock properties
+    python -m rockprops run --wells input/raw --out output/rockprops --workers 4 --area 60.1 --mud-weight 14
+Paths are taken as given, relative to the working directory, so the command runs from
+anywhere the project is importable. See batch.py for the checkpoint and the summary.
+"""
+
+logger = logging.getLogger('rockprops')
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='python -m rockprops',
+                                     description='Rock properties of field-scale well data.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='cleanup, merge and rock properties of every well of a '
+                                          'directory')
+    run.add_argument('--wells', required=True,
+                     help='directory of wells: each well file is a well, each subdirectory is a '
+                          'well made of its files (e.g. EDR and MWD LAS files)')
+    run.add_argument('--out', required=True, help='directory of the rock properties of each well')
+    run.add_argument('--workers', type=int, default=1, help='number of processes, 0 for all CPUs')
+    run.add_argument('--format', choices=sorted(OUTPUT_EXTS), default='csv',
+                     help='format of the outputs, parquet and feather need pyarrow')
+    run.add_argument('--compression', default='zstd', help='compression of parquet/feather outputs')
+
+    well = run.add_argument_group('well parameters, a bit size and mud weight written in a well '
+                                  'name (e.g. "_Bit 8 75_Mud 14 0") take precedence')
+    well.add_argument('--input', help='input workbook (see input_template) to read the bit area '
+                                      'and mud weight from')
+    well.add_argument('--area', type=float, help='bit area, in^2')
+    well.add_argument('--mud-weight', type=float, help='mud weight, ppg')
+
+    props = run.add_argument_group('rock properties')
+    props.add_argument('--properties', nargs='+', choices=PROPERTIES, default=list(PROPERTIES))
+    props.add_argument('--pump-efficiency', type=float, default=0.60)
+    props.add_argument('--gr-cutoff', type=float, default=65)
+    props.add_argument('--porosity-method', type=int, choices=(1, 2, 3), default=3)
+    props.add_argument('--formation', help='constants calibrated for this formation')
+    props.add_argument('--coefficients', help='coefficients file to use instead of the default')
+    props.add_argument('--merge', choices=('exact', 'nearest', 'interpolate'), default='exact',
+                       help='alignment of the files of a well, see merge_logs')
+    props.add_argument('--tolerance', type=float, default=0.5)
+
+    runs = run.add_argument_group('caching and resuming')
+    runs.add_argument('--cache-dir', default=CACHE_DIR, help='cache of the stages of every well')
+    runs.add_argument('--cache-size', type=float, default=1024, help='size of the cache, MB')
+    runs.add_argument('--no-cache', action='store_true', help='compute every stage')
+    runs.add_argument('--restart', action='store_true',
+                      help='run every well again instead of resuming from the checkpoint')
+    runs.add_argument('--summary', help='JSON summary of the run, OUT/%s if not given' % SUMMARY_FILE)
+    return parser
+
+
+def run_command(args):
+    """Run the wells, return the exit code: 1 if a well failed"""
+    area, mud_weight = args.area, args.mud_weight
+    if args.input is not None:
+        input_area, input_mud_weight = read(os.path.abspath(args.input))[:2]
+        area = input_area if area is None else area
+        mud_weight = input_mud_weight if mud_weight is None else mud_weight
+
+    summary = run_batch(
+        args.wells, args.out, workers=args.workers or None, resume=not args.restart,
+        summary_loc=args.summary, output_format=args.format, compression=args.compression,
+        use_cache=not args.no_cache, cache_dir=os.path.abspath(args.cache_dir),
+        max_bytes=int(args.cache_size * 1e6),
+        coefficients_loc=args.coefficients and os.path.abspath(args.coefficients),
+        area=area, mud_weight=mud_weight, properties=args.properties,
+        pump_efficiency=args.pump_efficiency, gr_cutoff=args.gr_cutoff,
+        porosity_method=args.porosity_method, formation=args.formation, how=args.merge,
+        tolerance=args.tolerance)
+
+    counts = summary['counts']
+    logger.info('%d wells done, %d skipped, %d failed in %.1f s. Stages: %s.',
+                counts['done'], counts['skipped'], counts['failed'], summary['seconds'],
+                ', '.join('%s %.2f s' % item for item in summary['stages'].items()))
+    return 1 if counts['failed'] else 0
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(message)s')
+    if args.command == 'run':
+        return run_command(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
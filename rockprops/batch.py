@@ -0,0 +1,258 @@
+import datetime
+import json
+import logging
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from input.configuration import CACHE_DIR
+from utils.columnar import COLUMNAR_EXTS
+from .coefficients import use_coefficients
+from .dag import DiskCache, build_well_dag
+from .pipeline import save_rockprops
+
+"""
+Batch runs of rock properties over a directory of wells, see __main__.py for the command line
+Each well goes through the cached DAG of dag.py (cleanup, merge, properties) in a process
+pool and its properties are written to the output directory. A checkpoint file in the
+output directory records the key of every finished well, so a run that is stopped resumes
+where it was and a well is only run again if its files or parameters changed. The run
+writes a JSON summary with the status and the time of each stage of each well.
+"""
+
+logger = logging.getLogger(__name__)
+
+# files read as wells, see utils.logstore.read_well_file
+SOURCE_EXTS = ('.las', '.csv', '.xlsx', '.parquet', '.feather')
+
+OUTPUT_EXTS = dict(COLUMNAR_EXTS, csv='.csv')
+
+CHECKPOINT_FILE = 'checkpoint.json'
+SUMMARY_FILE = 'run_summary.json'
+# bump when the layout of the checkpoint or the summary changes
+BATCH_VERSION = 1
+
+# bit diameter and mud weight written in file names, e.g. 'HALL STATE UNIT A1H_Bit 8 75_Mud 14 0'
+# for a 8.75 in bit and 14.0 ppg mud
+BIT_PATTERN = re.compile(r'Bit (\d+)(?: (\d+))?')
+MUD_PATTERN = re.compile(r'Mud (\d+)(?: (\d+))?')
+
+# stage of the summary of each stage of dag.build_well_dag
+STAGE_GROUPS = OrderedDict([('read', 'cleanup'), ('filter', 'cleanup'), ('merge', 'merge')])
+
+
+def _tag_value(match):
+    """8.75 from the groups ('8', '75') of a file name tag"""
+    return float('%s.%s' % (match.group(1), match.group(2) or '0'))
+
+
+def get_well_params(well_name):
+    """Bit area (in^2) and mud weight (ppg) written in the name of a well, if any"""
+    params = {}
+    bit = BIT_PATTERN.search(well_name)
+    if bit is not None:
+        params['area'] = math.pi / 4 * _tag_value(bit) ** 2
+    mud = MUD_PATTERN.search(well_name)
+    if mud is not None:
+        params['mud_weight'] = _tag_value(mud)
+    return params
+
+
+def find_wells(wells_dir):
+    """Wells of a directory: each well file is a well, and each subdirectory is a well
+    made of the well files it contains (e.g. the EDR and MWD LAS files of one well)
+    Return:
+        OrderedDict of well name -> list of source files
+    """
+    wells = OrderedDict()
+    for entry in sorted(os.scandir(wells_dir), key=lambda entry: entry.name):
+        if entry.name.startswith('.'):
+            continue
+        if entry.is_dir():
+            well_name = entry.name
+            sources = sorted(os.path.join(entry.path, file_name) for file_name in os.listdir(entry.path)
+                             if os.path.splitext(file_name)[1].lower() in SOURCE_EXTS)
+            if not sources:
+                continue
+        elif os.path.splitext(entry.name)[1].lower() in SOURCE_EXTS:
+            well_name = os.path.splitext(entry.name)[0]
+            sources = [entry.path]
+        else:
+            continue
+        if well_name in wells:
+            raise ValueError('Well %s is found twice in %s.' % (well_name, wells_dir))
+        wells[well_name] = sources
+    return wells
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+def _save_json(file_loc, data):
+    """Write JSON atomically, a stopped run never leaves a half-written file"""
+    tmp_loc = file_loc + '.tmp'
+    with open(tmp_loc, 'w') as file:
+        json.dump(data, file, indent=1)
+    os.replace(tmp_loc, file_loc)
+
+
+def load_checkpoint(checkpoint_loc):
+    """Wells finished by earlier runs, empty if there is no checkpoint"""
+    try:
+        with open(checkpoint_loc) as file:
+            checkpoint = json.load(file, object_pairs_hook=OrderedDict)
+    except (OSError, ValueError):
+        checkpoint = None
+    if checkpoint is None or checkpoint.get('version') != BATCH_VERSION:
+        checkpoint = OrderedDict([('version', BATCH_VERSION), ('wells', OrderedDict())])
+    return checkpoint
+
+
+def _stage_times(stats, write_seconds):
+    """Seconds of each stage (cleanup, merge, properties, write) and of each DAG stage"""
+    stages = OrderedDict((stage, 0.) for stage in ('cleanup', 'merge', 'properties', 'write'))
+    steps = OrderedDict()
+    for name, stage_stats in stats.items():
+        stage = STAGE_GROUPS.get(name.split(' ')[0], 'properties')
+        stages[stage] += stage_stats.seconds
+        steps[name] = OrderedDict([('status', stage_stats.status),
+                                   ('seconds', stage_stats.seconds)])
+    stages['write'] = write_seconds
+    return stages, steps
+
+
+def process_well(well_name, sources, out_dir, output_format='csv', compression='zstd',
+                 checkpoint=None, use_cache=True, cache_dir=CACHE_DIR, max_bytes=1 << 30,
+                 coefficients_loc=None, **params):
+    """Run the DAG of a well and write its properties to out_dir
+    Input:
+        checkpoint: entry of the well in the checkpoint, the well is skipped if its key and
+            output are unchanged
+        use_cache, cache_dir, max_bytes: see dag.DiskCache
+        coefficients_loc: coefficients file to use instead of the default (see coefficients.py)
+        params: see dag.build_well_dag, area and mud weight written in the well name
+            (see get_well_params) take precedence
+    Return:
+        OrderedDict summary of the well
+    """
+    start = time.perf_counter()
+    if coefficients_loc is not None:
+        use_coefficients(coefficients_loc)
+    params = dict(params, **get_well_params(well_name))
+    for param in ('area', 'mud_weight'):
+        if params.get(param) is None:
+            raise ValueError('No %s for well %s.' % (param, well_name))
+
+    cache = DiskCache(cache_dir, max_bytes) if use_cache else None
+    dag = build_well_dag(sources, cache=cache, **params)
+    key = dag.keys()['rockprops']
+    out_loc = os.path.join(out_dir, well_name + OUTPUT_EXTS[output_format])
+    summary = OrderedDict([
+        ('status', 'done'),
+        ('sources', [os.path.abspath(source_loc) for source_loc in sources]),
+        ('output', out_loc),
+        ('key', key),
+        ('rows', None),
+        ('seconds', None),
+        ('stages', None),
+        ('steps', None),
+        ('error', None),
+    ])
+    if checkpoint and checkpoint.get('key') == key and checkpoint.get('output') == out_loc \
+            and os.path.isfile(out_loc):
+        summary.update(status='skipped', rows=checkpoint.get('rows'),
+                       seconds=time.perf_counter() - start)
+        return summary
+
+    result = dag.run(['rockprops'])['rockprops']
+    write_start = time.perf_counter()
+    save_rockprops(out_loc, result.rockprops, result.depth, result.depth_name, result.depth_unit,
+                   compression=compression)
+    stages, steps = _stage_times(dag.stats, time.perf_counter() - write_start)
+    summary.update(rows=len(result.depth), seconds=time.perf_counter() - start, stages=stages,
+                   steps=steps)
+    return summary
+
+
+def run_batch(wells_dir, out_dir, workers=1, resume=True, summary_loc=None, **kwargs):
+    """Run every well of wells_dir, see find_wells and process_well
+    Input:
+        workers: number of processes, all CPUs if None
+        resume: skip the wells the checkpoint of out_dir records as finished and unchanged
+        summary_loc: JSON summary of the run, out_dir/run_summary.json if None
+        kwargs: see process_well
+    Return:
+        OrderedDict summary of the run, also saved to summary_loc
+    """
+    start_time, start = _now(), time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    wells = find_wells(wells_dir)
+    checkpoint_loc = os.path.join(out_dir, CHECKPOINT_FILE)
+    checkpoint = load_checkpoint(checkpoint_loc) if resume else load_checkpoint(None)
+    logger.info('%d wells in %s, %d finished by earlier runs.', len(wells), wells_dir,
+                len(set(wells) & set(checkpoint['wells'])))
+
+    well_summaries = {}
+    executor = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        if executor is None:
+            results = ((well_name, lambda well_name=well_name, sources=sources: process_well(
+                well_name, sources, out_dir, checkpoint=checkpoint['wells'].get(well_name),
+                **kwargs)) for well_name, sources in wells.items())
+        else:
+            futures = {executor.submit(process_well, well_name, sources, out_dir,
+                                       checkpoint=checkpoint['wells'].get(well_name), **kwargs):
+                       well_name for well_name, sources in wells.items()}
+            results = ((futures[future], future.result) for future in as_completed(futures))
+
+        # wells are checkpointed as soon as they finish, a failed well does not stop the batch
+        for well_name, result in results:
+            try:
+                well_summary = result()
+            except Exception as error:
+                logger.exception('Failed to run well %s.', well_name)
+                well_summary = OrderedDict([
+                    ('status', 'failed'),
+                    ('sources', [os.path.abspath(source_loc) for source_loc in wells[well_name]]),
+                    ('error', '%s: %s' % (type(error).__name__, error)),
+                ])
+            well_summaries[well_name] = well_summary
+            if well_summary['status'] == 'done':
+                checkpoint['wells'][well_name] = OrderedDict([
+                    ('key', well_summary['key']), ('output', well_summary['output']),
+                    ('rows', well_summary['rows']), ('finished', _now())])
+                _save_json(checkpoint_loc, checkpoint)
+            elif well_summary['status'] == 'failed':
+                checkpoint['wells'].pop(well_name, None)
+                _save_json(checkpoint_loc, checkpoint)
+            logger.info('Well %s %s.', well_name, well_summary['status'])
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    stages = OrderedDict((stage, 0.) for stage in ('cleanup', 'merge', 'properties', 'write'))
+    counts = OrderedDict((status, 0) for status in ('done', 'skipped', 'failed'))
+    for well_summary in well_summaries.values():
+        counts[well_summary['status']] += 1
+        for stage, seconds in (well_summary.get('stages') or {}).items():
+            stages[stage] += seconds
+
+    summary = OrderedDict([
+        ('version', BATCH_VERSION),
+        ('started', start_time),
+        ('finished', _now()),
+        ('seconds', time.perf_counter() - start),
+        ('wells_dir', os.path.abspath(wells_dir)),
+        ('out_dir', os.path.abspath(out_dir)),
+        ('workers', workers),
+        ('params', OrderedDict(sorted(kwargs.items()))),
+        ('counts', counts),
+        ('stages', stages),
+        ('wells', OrderedDict((well_name, well_summaries[well_name]) for well_name in wells)),
+    ])
+    _save_json(summary_loc or os.path.join(out_dir, SUMMARY_FILE), summary)
+    return summary
@@ -0,0 +1,332 @@
+import logging
+import os
+import re
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .coefficients import (COEFFICIENTS_LOC, load_coefficients, new_coefficients,
+                           save_coefficients, set_coefficients)
+from .rockprops import _get_scale
+
+"""
+Fit the constants of the correlations of rockprops.py to lab measurements
+Every correlation is a power law y = k * x1 ** m1 * x2 ** m2 ..., a linear model of log y,
+so it is fitted by least squares in log space. Bootstrap confidence intervals resample the
+lab data n_bootstrap times and solve the normal equations of a whole batch of resamples at
+once. Fitted constants are saved to the coefficients file (see coefficients.py), for the
+default or for one formation.
+"""
+
+logger = logging.getLogger(__name__)
+
+# column names of the lab data (lower case, without unit) -> input of the fits
+LAB_COLUMNS = {
+    'ec': 'E',
+    'e': 'E',
+    'ccs': 'ccs',
+    'ucs': 'ucs',
+    'pc': 'pc',
+    'presdiff': 'presdiff',
+    'diff_pres': 'presdiff',
+    'gr': 'gr',
+    'porosity': 'porosity',
+    'phi': 'porosity',
+    'permeability': 'permeability',
+    'k': 'permeability',
+    'formation': 'formation',
+}
+
+# inputs each model is fitted from
+MODEL_COLUMNS = OrderedDict([
+    ('ccs', ('ucs', 'ccs', 'presdiff', 'gr')),
+    ('youngmodulus', ('E', 'ccs', 'pc')),
+    ('porosity_1', ('porosity', 'ucs', 'gr')),
+    ('porosity_2', ('porosity', 'ucs', 'gr')),
+    ('porosity_3', ('porosity', 'ucs', 'gr')),
+    ('permeability_1', ('permeability', 'porosity')),
+])
+
+FitResult = namedtuple('FitResult', ['coefficients', 'intervals', 'r2', 'n_samples'])
+
+# 'Ec (Gpa)' -> 'Ec', 'Gpa'
+_HEADER_PATTERN = re.compile(r'^\s*(.*?)\s*(?:\((.*)\))?\s*$')
+
+
+def load_lab_data(file_loc, sheet_name=0):
+    """Read lab measurements from an Excel or CSV file, e.g. labdata/youngmodulus.xlsx
+    Headers are 'name (unit)', names known to LAB_COLUMNS are renamed to the inputs of the
+    fits, empty columns and rows are dropped.
+    Return:
+        DataFrame
+        dict of column -> unit, None if the header has no unit
+    """
+    if os.path.splitext(file_loc)[1].lower() in ('.xls', '.xlsx'):
+        lab_df = pd.read_excel(file_loc, sheet_name=sheet_name)
+    else:
+        lab_df = pd.read_csv(file_loc)
+    lab_df = lab_df.dropna(axis=1, how='all').dropna(axis=0, how='all')
+
+    columns, units = [], {}
+    for header in lab_df.columns:
+        name, unit = _HEADER_PATTERN.match(str(header)).groups()
+        name = LAB_COLUMNS.get(name.lower(), name)
+        columns.append(name)
+        units[name] = unit.strip() if unit else None
+    lab_df.columns = columns
+    return lab_df.reset_index(drop=True), units
+
+
+def _solve_batch(products, counts, n_params):
+    """Least squares parameters of a batch of resamples, NaN if singular
+    Input:
+        products: samples x (params ** 2 + params), products of the columns of the design
+            matrix with each other and with log y
+        counts: batch x samples, times each sample is drawn in each resample
+    """
+    # normal equations of all resamples at once, gram = X'X and moment = X'y
+    sums = counts.dot(products)
+    gram = sums[:, :n_params ** 2].reshape(-1, n_params, n_params)
+    moment = sums[:, n_params ** 2:]
+    # a resample with too few distinct x cannot be fitted, its gram matrix is singular:
+    # det(gram) / prod(diag(gram)) is 1 for orthogonal columns and 0 for dependent ones
+    singular = np.linalg.det(gram) <= 1e-12 * np.prod(np.diagonal(gram, axis1=1, axis2=2), axis=1)
+    gram[singular] = np.eye(n_params)
+    params = np.linalg.solve(gram, moment[..., np.newaxis])[..., 0]
+    params[singular] = np.nan
+    return params
+
+
+def fit_power_law(y, x, n_bootstrap=0, seed=None, batch_elements=1 << 22):
+    """Fit y = k * x1 ** m1 * x2 ** m2 ... by least squares on log y
+    Input:
+        y: n_samples values, positive
+        x: n_samples values, or list of such, positive
+        n_bootstrap: number of bootstrap resamples, 0 for none
+        batch_elements: resamples x samples drawn at once
+    Return:
+        parameters (k, m1, m2, ...)
+        bootstrap parameters, n_bootstrap x parameters, None if n_bootstrap is 0
+        R^2 of log y
+    """
+    y = np.asarray(y, dtype=np.float64)
+    x = np.atleast_2d(np.asarray(x, dtype=np.float64))
+    design = np.column_stack([np.ones(len(y))] + [np.log(values) for values in x])
+    log_y = np.log(y)
+    n_samples, n_params = design.shape
+    if n_samples <= n_params:
+        raise ValueError('%d samples are not enough to fit %d parameters.' % (n_samples, n_params))
+
+    params = np.linalg.lstsq(design, log_y, rcond=None)[0]
+    residuals = log_y - design.dot(params)
+    r2 = float(1 - residuals.dot(residuals) / np.sum((log_y - log_y.mean()) ** 2))
+    params[0] = np.exp(params[0])
+
+    bootstrap = None
+    if n_bootstrap:
+        rng = np.random.RandomState(seed)
+        bootstrap = np.empty((n_bootstrap, n_params))
+        products = np.column_stack([(design[:, :, np.newaxis] * design[:, np.newaxis, :])
+                                    .reshape(n_samples, -1), design * log_y[:, np.newaxis]])
+        batch_size = max(1, batch_elements // n_samples)
+        for start in range(0, n_bootstrap, batch_size):
+            stop = min(start + batch_size, n_bootstrap)
+            # each resample as the number of times each sample is drawn
+            idx = rng.randint(0, n_samples, (stop - start, n_samples))
+            idx += np.arange(stop - start)[:, np.newaxis] * n_samples
+            counts = np.bincount(idx.ravel(), minlength=idx.size).reshape(idx.shape)
+            bootstrap[start:stop] = _solve_batch(products, counts.astype(np.float64), n_params)
+        np.exp(bootstrap[:, 0], out=bootstrap[:, 0])
+        n_singular = np.isnan(bootstrap[:, 0]).sum()
+        if n_singular:
+            logger.info('%d of %d bootstrap resamples are singular and left out.',
+                        n_singular, n_bootstrap)
+
+    return params, bootstrap, r2
+
+
+def _fit_groups(groups, n_bootstrap, confidence, seed):
+    """Fit each group of (y, x) and name the parameters
+    Input:
+        groups: OrderedDict of group -> (y, x, names of the parameters, signs of the parameters)
+    Return:
+        FitResult
+    """
+    coefficients, intervals = OrderedDict(), OrderedDict()
+    r2, n_samples = OrderedDict(), OrderedDict()
+    tail = (1 - confidence) / 2 * 100
+    for group, (y, x, params_names, signs) in groups.items():
+        valid = (y > 0) & np.all(np.atleast_2d(x) > 0, axis=0) & np.isfinite(y)
+        if not valid.all():
+            logger.warning('%d %s samples are not positive and left out.',
+                           np.sum(~valid), group)
+        x = np.atleast_2d(x)[:, valid]
+        params, bootstrap, r2[group] = fit_power_law(y[valid], x, n_bootstrap, seed)
+        n_samples[group] = int(valid.sum())
+        for col_idx, (name, sign) in enumerate(zip(params_names, signs)):
+            coefficients[name] = float(sign * params[col_idx])
+            if bootstrap is not None:
+                low, high = sorted(sign * np.nanpercentile(bootstrap[:, col_idx],
+                                                           [tail, 100 - tail]))
+                intervals[name] = (float(low), float(high))
+    return FitResult(coefficients, intervals, r2, n_samples)
+
+
+def fit_youngmodulus(E, ccs, pc, units=None, n_bootstrap=0, confidence=0.95, seed=None):
+    """Fit a and b of E = a * ccs * pc ** b (see calculate_youngmodulus)
+    Input units (others are given by units, e.g. {'ccs': 'MPa', 'pc': 'MPa'}):
+        E: GPa
+        ccs: psi
+        pc: kPa
+    Return:
+        FitResult(coefficients, intervals, r2, n_samples), intervals are the bootstrap
+        confidence intervals of each constant, empty if n_bootstrap is 0
+    """
+    E = np.asarray(E, dtype=np.float64) * _get_scale('E', E, units, 'GPa', 'GPa')
+    ccs = np.asarray(ccs, dtype=np.float64) * _get_scale('ccs', ccs, units, 'psi', 'MPa')
+    pc = np.asarray(pc, dtype=np.float64) * _get_scale('pc', pc, units, 'kPa', 'MPa')
+    groups = OrderedDict([('all', (E / ccs, pc, ('a', 'b'), (1, 1)))])
+    return _fit_groups(groups, n_bootstrap, confidence, seed)
+
+
+def fit_ccs(ucs, ccs, presdiff, gr, gr_cutoff=65, units=None, n_bootstrap=0, confidence=0.95,
+            seed=None):
+    """Fit k and m of ccs = ucs * (1 + k * presdiff ** m) for shale and sand (see calculate_ccs)
+    Input units:
+        ucs, ccs: psi
+        presdiff: kPa
+        gr: API
+    """
+    ucs = np.asarray(ucs, dtype=np.float64) * _get_scale('ucs', ucs, units, 'psi', 'psi')
+    ccs = np.asarray(ccs, dtype=np.float64) * _get_scale('ccs', ccs, units, 'psi', 'psi')
+    presdiff = np.asarray(presdiff, dtype=np.float64) * \
+        _get_scale('presdiff', presdiff, units, 'kPa', 'psi')
+    shale = np.asarray(gr) > gr_cutoff
+    y = ccs / ucs - 1
+    groups = OrderedDict([
+        ('shale', (y[shale], presdiff[shale], ('k_shale', 'm_shale'), (1, 1))),
+        ('sand', (y[~shale], presdiff[~shale], ('k_sand', 'm_sand'), (1, 1))),
+    ])
+    return _fit_groups(groups, n_bootstrap, confidence, seed)
+
+
+def fit_porosity(porosity, ucs, gr, method=3, gr_cutoff=65, units=None, n_bootstrap=0,
+                 confidence=0.95, seed=None):
+    """Fit the constants of a porosity method (see calculate_porosity)
+    method=1, 2: k1, k2 of shale and k3, k4 of sand, both methods have the same form
+    method=3: c, gr_exponent and ucs_exponent
+    Input units:
+        porosity: fraction
+        ucs: psi
+        gr: API
+    """
+    porosity = np.asarray(porosity, dtype=np.float64) * \
+        _get_scale('porosity', porosity, units, 'fraction', 'fraction')
+    ucs = np.asarray(ucs, dtype=np.float64) * _get_scale('ucs', ucs, units, 'psi', 'MPa')
+    gr = np.asarray(gr, dtype=np.float64)
+    if method == 3:
+        # the exponents are fitted with the sign of the power law
+        groups = OrderedDict([
+            ('all', (porosity, [gr, ucs], ('c', 'gr_exponent', 'ucs_exponent'), (1, -1, -1))),
+        ])
+    elif method in (1, 2):
+        # unit of methods 1 and 2, see calculate_porosity
+        ucs = ucs * 101.325 / 14.7
+        shale = gr > gr_cutoff
+        groups = OrderedDict([
+            ('shale', (porosity[shale] * 100, ucs[shale], ('k1', 'k2'), (1, 1))),
+            ('sand', (porosity[~shale] * 100, ucs[~shale], ('k3', 'k4'), (1, 1))),
+        ])
+    else:
+        raise ValueError('Unknown method.')
+    return _fit_groups(groups, n_bootstrap, confidence, seed)
+
+
+def fit_permeability(permeability, porosity, units=None, n_bootstrap=0, confidence=0.95,
+                     seed=None):
+    """Fit c and m of permeability = c * (100 * porosity) ** m (see calculate_permeability)
+    Input units:
+        permeability: nD
+        porosity: fraction
+    """
+    permeability = np.asarray(permeability, dtype=np.float64) * \
+        _get_scale('permeability', permeability, units, 'nD', 'nD')
+    porosity = np.asarray(porosity, dtype=np.float64) * \
+        _get_scale('porosity', porosity, units, 'fraction', 'fraction')
+    groups = OrderedDict([('all', (permeability, porosity * 100, ('c', 'm'), (1, 1)))])
+    return _fit_groups(groups, n_bootstrap, confidence, seed)
+
+
+def fit_model(model, lab_df, units=None, gr_cutoff=65, n_bootstrap=0, confidence=0.95,
+              seed=None):
+    """Fit a model of MODEL_COLUMNS to the columns of lab data (see load_lab_data)"""
+    if model not in MODEL_COLUMNS:
+        raise ValueError('Unknown model: %s.' % model)
+    missing = [column for column in MODEL_COLUMNS[model] if column not in lab_df]
+    if missing:
+        raise ValueError('Columns %s are required to fit %s.' % (', '.join(missing), model))
+    columns = {column: lab_df[column].values for column in MODEL_COLUMNS[model]}
+    options = dict(units=units, n_bootstrap=n_bootstrap, confidence=confidence, seed=seed)
+    if model == 'ccs':
+        return fit_ccs(gr_cutoff=gr_cutoff, **dict(columns, **options))
+    if model == 'youngmodulus':
+        return fit_youngmodulus(**dict(columns, **options))
+    if model.startswith('porosity'):
+        return fit_porosity(method=int(model[-1]), gr_cutoff=gr_cutoff, **dict(columns, **options))
+    return fit_permeability(**dict(columns, **options))
+
+
+def calibrate(lab_loc, models=None, formation=None, coefficients_loc=COEFFICIENTS_LOC,
+              gr_cutoff=65, n_bootstrap=1000, confidence=0.95, seed=None, save=True):
+    """Fit models to a lab data file and save the constants to a coefficients file
+    Input:
+        models: models to fit, all models whose columns are in the lab data if None
+        formation: formation the constants are for, None for the default; if None and the
+            lab data has a formation column, each formation is fitted on its own rows
+        coefficients_loc: coefficients file to update, created if it does not exist
+    Return:
+        OrderedDict of formation -> model -> FitResult, formation is None for the default
+    """
+    lab_df, units = load_lab_data(lab_loc)
+    if models is None:
+        models = [model for model, columns in MODEL_COLUMNS.items()
+                  if all(column in lab_df for column in columns)]
+        if not models:
+            raise ValueError('No model can be fitted from the columns of %s.' % lab_loc)
+
+    if formation is None and 'formation' in lab_df:
+        datasets = OrderedDict((name, rows) for name, rows in lab_df.groupby('formation', sort=False))
+    else:
+        datasets = OrderedDict([(formation, lab_df)])
+
+    coefficients = load_coefficients(coefficients_loc) if os.path.isfile(coefficients_loc) \
+        else new_coefficients()
+    results = OrderedDict()
+    for formation_name, rows in datasets.items():
+        results[formation_name] = OrderedDict()
+        for model in models:
+            result = fit_model(model, rows, units, gr_cutoff, n_bootstrap, confidence, seed)
+            results[formation_name][model] = result
+            fit = OrderedDict([
+                ('source', os.path.basename(lab_loc)),
+                ('n_samples', result.n_samples),
+                ('r2', result.r2),
+                ('confidence', confidence if n_bootstrap else None),
+                ('intervals', result.intervals),
+            ])
+            set_coefficients(coefficients, model, result.coefficients, formation_name, fit)
+            logger.info('%s of %s: %s', model, formation_name or 'default',
+                        ', '.join('%s=%g' % item for item in result.coefficients.items()))
+
+    if save:
+        save_coefficients(coefficients_loc, coefficients)
+    return results
+
+
+if __name__ == '__main__':
+    lab_df, units = load_lab_data(r'labdata/youngmodulus.xlsx')
+    result = fit_model('youngmodulus', lab_df, units, n_bootstrap=2000, seed=0)
+    print(result.coefficients)
+    print(result.intervals)
+    print(result.r2)
@@ -0,0 +1,147 @@
+import json
+import os
+from collections import OrderedDict
+
+"""
+Constants of the correlations of rockprops.py
+The constants live in a versioned JSON file (coefficients.json next to this module), loaded
+once when rockprops is imported. Each formation can override any constant of any model, the
+other constants fall back to the defaults. calibration.py fits new constants from lab data
+and saves them here, so recalibrating a formation does not change any code.
+"""
+
+# bump when the layout of the file changes
+COEFFICIENTS_VERSION = 1
+
+COEFFICIENTS_LOC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'coefficients.json')
+
+# constants the correlations were published with, every model and constant the file can set
+DEFAULT_COEFFICIENTS = OrderedDict([
+    # ccs = ucs * (1 + k * presdiff ** m), presdiff in psi
+    ('ccs', OrderedDict([('k_shale', 0.00432), ('m_shale', 0.782),
+                         ('k_sand', 0.0133), ('m_sand', 0.577)])),
+    # E = a * ccs * pc ** b, ccs and pc in MPa
+    ('youngmodulus', OrderedDict([('a', 4.5396), ('b', 0.1926)])),
+    # porosity = k1 * ucs ** k2 / 100 (shale), k3 * ucs ** k4 / 100 (sand)
+    ('porosity_1', OrderedDict([('k1', 92.529), ('k2', -0.63), ('k3', 424.8), ('k4', -0.825)])),
+    ('porosity_2', OrderedDict([('k1', 88.331), ('k2', -0.636), ('k3', 256.25), ('k4', -0.788)])),
+    # porosity = c / (gr ** gr_exponent * ucs ** ucs_exponent), ucs in MPa
+    ('porosity_3', OrderedDict([('c', 1.75), ('gr_exponent', 0.25), ('ucs_exponent', 0.47)])),
+    # permeability = c * (100 * porosity) ** m
+    ('permeability_1', OrderedDict([('c', 6.93), ('m', 2.5313)])),
+])
+
+
+def _check_models(models, file_loc):
+    """Models and constants as floats, raise ValueError for unknown names"""
+    checked = OrderedDict()
+    for model, values in models.items():
+        if model not in DEFAULT_COEFFICIENTS:
+            raise ValueError('Unknown model %s in %s.' % (model, file_loc))
+        for name in values:
+            if name not in DEFAULT_COEFFICIENTS[model]:
+                raise ValueError('Unknown constant %s of %s in %s.' % (name, model, file_loc))
+        checked[model] = OrderedDict((name, float(value)) for name, value in values.items())
+    return checked
+
+
+def new_coefficients():
+    """Coefficients with the published constants and no formation"""
+    return OrderedDict([
+        ('version', COEFFICIENTS_VERSION),
+        ('revision', 0),
+        ('default', OrderedDict((model, OrderedDict(values))
+                                for model, values in DEFAULT_COEFFICIENTS.items())),
+        ('formations', OrderedDict()),
+        ('fits', OrderedDict()),
+    ])
+
+
+def load_coefficients(file_loc=COEFFICIENTS_LOC):
+    """Read a coefficients file
+    Return:
+        OrderedDict with
+            version, revision: layout of the file and number of times it was saved
+            default: model -> constant -> value, missing constants are the published ones
+            formations: formation -> model -> constant -> value, overrides of the default
+            fits: formation ('default' for the default) -> model -> fit statistics
+    """
+    with open(file_loc) as file:
+        stored = json.load(file, object_pairs_hook=OrderedDict)
+    if stored.get('version') != COEFFICIENTS_VERSION:
+        raise ValueError('Coefficients file %s has version %s, expected %s.'
+                         % (file_loc, stored.get('version'), COEFFICIENTS_VERSION))
+
+    coefficients = new_coefficients()
+    coefficients['revision'] = stored.get('revision', 0)
+    for model, values in _check_models(stored.get('default', {}), file_loc).items():
+        coefficients['default'][model].update(values)
+    for formation, models in stored.get('formations', {}).items():
+        coefficients['formations'][formation] = _check_models(models, file_loc)
+    coefficients['fits'] = stored.get('fits', OrderedDict())
+    return coefficients
+
+
+def save_coefficients(file_loc, coefficients):
+    """Save coefficients atomically, the revision is incremented"""
+    coefficients['revision'] = coefficients.get('revision', 0) + 1
+    tmp_loc = file_loc + '.tmp'
+    with open(tmp_loc, 'w') as file:
+        json.dump(coefficients, file, indent=1)
+        file.write('\n')
+    os.replace(tmp_loc, file_loc)
+
+
+def set_coefficients(coefficients, model, values, formation=None, fit=None):
+    """Set the constants of a model, for a formation or for the default if formation is None
+    Input:
+        values: dict of constant -> value, constants not given are left as they are
+        fit: statistics of the fit the values come from, saved along
+    """
+    values = _check_models({model: values}, 'coefficients')[model]
+    if formation is None:
+        coefficients['default'][model].update(values)
+    else:
+        models = coefficients['formations'].setdefault(formation, OrderedDict())
+        models.setdefault(model, OrderedDict()).update(values)
+    if fit is not None:
+        coefficients['fits'].setdefault(formation or 'default', OrderedDict())[model] = fit
+
+
+# coefficients used by rockprops, see use_coefficients
+_coefficients = load_coefficients()
+
+
+def use_coefficients(coefficients):
+    """Use other coefficients from now on
+    Input:
+        coefficients: file location or coefficients given by load_coefficients
+    """
+    global _coefficients
+    if isinstance(coefficients, str):
+        coefficients = load_coefficients(coefficients)
+    _coefficients = coefficients
+
+
+def get_formations():
+    """Formations with their own constants"""
+    return list(_coefficients['formations'])
+
+
+def get_coefficients(model, formation=None):
+    """Constants of a model, e.g. get_coefficients('youngmodulus', 'Eagle Ford')['a']
+    Constants the formation does not override are the default ones."""
+    if model not in DEFAULT_COEFFICIENTS:
+        raise ValueError('Unknown model: %s.' % model)
+    values = OrderedDict(_coefficients['default'][model])
+    if formation is not None:
+        if formation not in _coefficients['formations']:
+            raise ValueError('Unknown formation: %s.' % formation)
+        values.update(_coefficients['formations'][formation].get(model, {}))
+    return values
+
+
+if __name__ == '__main__':
+    print('Revision %d of %s' % (_coefficients['revision'], COEFFICIENTS_LOC))
+    for model in DEFAULT_COEFFICIENTS:
+        print(model, dict(get_coefficients(model)))
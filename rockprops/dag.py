@@ -0,0 +1,527 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from importlib import import_module
+
+import numpy as np
+
+from input.configuration import CACHE_DIR
+from input.LOG_UNITS import LOG_NAMES_UNITS_DICT
+from utils.logscleanup import merge_logs
+from utils.logstore import get_file_hash, read_well_file
+from utils.units import get_scale
+from .coefficients import get_coefficients
+from .pipeline import PROPERTIES, _get_required
+from .pressures import PressureProfile, get_mud_weight, hydrostatic_pressure, pressure_profile
+from .rockprops import (calculate_mse, calculate_ucs, calculate_ccs, calculate_youngmodulus,
+                        calculate_porosity, calculate_permeability)
+
+"""
+Cached pipeline from raw well files to rock properties
+Each stage is a node of a DAG. Its key hashes the stage function, its parameters, the keys
+of the stages it reads and the content of the files it reads, so the key changes exactly
+when the result would. Results are pickled to a disk cache under their key and evicted
+least recently used first once the cache outgrows its size. Changing one parameter, e.g.
+gr_cutoff or the mud weight, only changes the keys of the stages downstream of it, and
+only those are recomputed; cached stages nobody needs are not even read from disk.
+Wells are independent and run in parallel processes sharing the cache.
+"""
+
+logger = logging.getLogger(__name__)
+
+# bump when the stages change in a way no hashed source shows (e.g. a dependency upgrade),
+# so old results are not reused
+DAG_CACHE_VERSION = 1
+
+# modules the stages call: an edit to their source invalidates every cached stage
+STAGE_MODULES = ('rockprops.rockprops', 'rockprops.kernels', 'rockprops.pressures',
+                 'utils.logscleanup', 'utils.logstore', 'utils.units')
+
+
+def _modules_hash(module_names):
+    """Hash of the source of modules"""
+    hasher = hashlib.blake2b(digest_size=8)
+    for module_name in module_names:
+        try:
+            source = inspect.getsource(import_module(module_name))
+        except (OSError, TypeError):
+            source = ''
+        hasher.update(module_name.encode())
+        hasher.update(source.encode())
+    return hasher.hexdigest()
+
+
+# version of the cache keys: DAG_CACHE_VERSION and the source of STAGE_MODULES
+DAG_CACHE_KEY = '%d:%s' % (DAG_CACHE_VERSION, _modules_hash(STAGE_MODULES))
+
+# a stage: func(*results of inputs, **params), files are hashed by content into the key
+Node = namedtuple('Node', ['name', 'func', 'inputs', 'params', 'files'],
+                  defaults=((), None, ()))
+
+# how a stage was obtained by DAG.run
+StageStats = namedtuple('StageStats', ['status', 'seconds'])
+
+# depth of the merged logs and structured array of the properties (see RockPropsPipeline.run)
+WellResult = namedtuple('WellResult', ['depth', 'rockprops', 'depth_name', 'depth_unit'])
+
+# result of a well run by run_wells, error is the message of the exception if it failed
+WellRun = namedtuple('WellRun', ['result', 'stats', 'seconds', 'error'])
+
+
+class DiskCache():
+    """Pickled results by key, evicted least recently used first past max_bytes
+
+    cache = DiskCache(max_bytes=1 << 30)
+    cache.put(key, value)
+    value = cache.get(key)
+
+    The mtime of an entry is its last use, so processes sharing the directory share the
+    same LRU order.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def __contains__(self, key):
+        return os.path.isfile(self._path(key))
+
+    def get(self, key):
+        """Value of key, raise KeyError if it is not cached"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError) as error:
+            # evicted by another process or half-written by a killed one
+            raise KeyError(key) from error
+        return value
+
+    def put(self, key, value):
+        """Cache value under key, then evict past max_bytes"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        if os.path.getsize(tmp_path) > self.max_bytes:
+            logger.warning('Result %s is larger than the cache, it is not cached.', key)
+            os.remove(tmp_path)
+            return
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def entries(self):
+        """List of (last use, size, path) of the cached results"""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.pkl'):
+                continue
+            try:
+                entry_stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        """Bytes used by the cached results"""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes=None):
+        """Remove the least recently used results until the cache fits in max_bytes"""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # removed by another process
+                pass
+            total -= size
+
+    def clear(self):
+        self.evict(0)
+
+
+def _json_default(value):
+    """JSON of the parameters numpy and tuples give"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return repr(value)
+
+
+@lru_cache(maxsize=None)
+def _func_id(func):
+    """Name and hash of the source of a stage function, so editing a stage invalidates it"""
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = ''
+    return '%s.%s:%s' % (func.__module__, func.__qualname__,
+                         hashlib.blake2b(source.encode(), digest_size=8).hexdigest())
+
+
+@lru_cache(maxsize=None)
+def _file_key(file_loc, size, mtime):
+    return get_file_hash(file_loc)
+
+
+def file_key(file_loc):
+    """Hash of the content of a file, hashed once per process while it is unchanged"""
+    file_stat = os.stat(file_loc)
+    return _file_key(os.path.abspath(file_loc), file_stat.st_size, file_stat.st_mtime)
+
+
+class DAG():
+    """Stages run in dependency order, memoized by a DiskCache
+
+    dag = DAG([Node('a', load, params={'file_loc': loc}, files=(loc,)),
+               Node('b', process, inputs=('a',), params={'k': 2})], cache=DiskCache())
+    results = dag.run(['b'])
+    dag.stats['b']
+    """
+
+    def __init__(self, nodes, cache=None):
+        """
+        Input:
+            nodes: list of Node, in any order
+            cache: DiskCache, results are only kept in memory if None
+        """
+        self.nodes = OrderedDict()
+        for node in nodes:
+            if node.name in self.nodes:
+                raise ValueError('Stage %s is defined twice.' % node.name)
+            self.nodes[node.name] = node
+        self.cache = cache
+        self.order = self._sort()
+        self.stats = OrderedDict()
+        self._keys = None
+
+    def _sort(self):
+        """Names of the stages, every stage after its inputs"""
+        order, state = [], {}
+        for name in self.nodes:
+            stack = [(name, False)]
+            while stack:
+                name, done = stack.pop()
+                if done:
+                    state[name] = 'done'
+                    order.append(name)
+                    continue
+                if state.get(name) == 'done':
+                    continue
+                if state.get(name) == 'visiting':
+                    raise ValueError('Stage %s depends on itself.' % name)
+                if name not in self.nodes:
+                    raise ValueError('Unknown stage: %s.' % name)
+                state[name] = 'visiting'
+                stack.append((name, True))
+                stack.extend((input_name, False) for input_name in reversed(self.nodes[name].inputs)
+                             if state.get(input_name) != 'done')
+        return order
+
+    def keys(self):
+        """OrderedDict of stage -> key, the hash of everything its result depends on"""
+        if self._keys is not None:
+            return self._keys
+        keys = OrderedDict()
+        for name in self.order:
+            node = self.nodes[name]
+            description = json.dumps([DAG_CACHE_KEY, name, _func_id(node.func),
+                                      node.params or {}, [keys[input_name] for input_name in node.inputs],
+                                      [file_key(file_loc) for file_loc in node.files]],
+                                     sort_keys=True, default=_json_default)
+            keys[name] = hashlib.blake2b(description.encode(), digest_size=16).hexdigest()
+        self._keys = keys
+        return keys
+
+    def run(self, targets=None):
+        """Results of the target stages, all stages without dependent stage if None
+        Stages are taken from the cache when their key is cached, and computed otherwise.
+        self.stats records for each stage used whether it was 'cached' or 'computed', and
+        the seconds it took.
+        Return:
+            OrderedDict of target -> result
+        """
+        if targets is None:
+            used = set(input_name for node in self.nodes.values() for input_name in node.inputs)
+            targets = [name for name in self.order if name not in used]
+        keys = self.keys()
+        results = {}
+        self.stats = OrderedDict()
+
+        def resolve(name):
+            if name in results:
+                return results[name]
+            node, key = self.nodes[name], keys[name]
+            if self.cache is not None:
+                start = time.perf_counter()
+                try:
+                    results[name] = self.cache.get(key)
+                    self.stats[name] = StageStats('cached', time.perf_counter() - start)
+                    return results[name]
+                except KeyError:
+                    pass
+            inputs = [resolve(input_name) for input_name in node.inputs]
+            start = time.perf_counter()
+            results[name] = node.func(*inputs, **(node.params or {}))
+            self.stats[name] = StageStats('computed', time.perf_counter() - start)
+            if self.cache is not None:
+                self.cache.put(key, results[name])
+            return results[name]
+
+        return OrderedDict((name, resolve(name)) for name in targets)
+
+
+def _find_log(logs, log_name, required=True):
+    """Values and unit of a log of (logs, units)"""
+    logs, units = logs
+    if log_name not in logs:
+        if required:
+            raise ValueError('Log %s is required, logs are %s.' % (log_name, ', '.join(logs)))
+        return None, None
+    return logs[log_name], units.get(log_name) or None
+
+
+def read_source(source_loc, logs_names=None):
+    """Logs of a well file and their units, see utils.logstore.read_well_file
+    Cleaned files name their columns 'log name,unit', logs are named 'log name' here so all
+    sources share the same names. If logs_names is None, only the logs of
+    LOG_NAMES_UNITS_DICT are kept, as utils.filescleanup does for raw files."""
+    logs_reading_dict, units, _ = read_well_file(source_loc, logs_names, filternull=False)
+    logs, logs_units = OrderedDict(), OrderedDict()
+    for column, values in logs_reading_dict.items():
+        log_name, _, column_unit = column.partition(',')
+        if logs_names is None and log_name not in LOG_NAMES_UNITS_DICT:
+            continue
+        logs[log_name] = values
+        logs_units[log_name] = units.get(column) or column_unit
+    return logs, logs_units
+
+
+def filter_source(source, filternull=True):
+    """Only keep rows where all logs are positive, see get_filtered_log_reading_dict"""
+    logs, units = source
+    if not filternull or not logs:
+        return source
+    mask = np.logical_and.reduce([values > 0 for values in logs.values()])
+    return OrderedDict((log_name, values[mask]) for log_name, values in logs.items()), units
+
+
+def merge_sources(*sources, primary_key='Hole Depth', how='exact', tolerance=0.5):
+    """Align the logs of all sources on the primary key, see utils.merge_logs
+    A log found in several sources is taken from the first one."""
+    all_logs, units, seen = [], OrderedDict(), set()
+    for logs, logs_units in sources:
+        logs = OrderedDict((log_name, values) for log_name, values in logs.items()
+                           if log_name == primary_key or log_name not in seen)
+        seen.update(logs)
+        all_logs.append(logs)
+        units.update((log_name, logs_units.get(log_name)) for log_name in logs
+                     if log_name not in units)
+    logs, _ = merge_logs(all_logs, primary_key=primary_key, how=how, tolerance=tolerance)
+    # merge_logs gives columns of one array, copy them so each log is pickled on its own
+    logs = OrderedDict((log_name, np.ascontiguousarray(values)) for log_name, values in logs.items())
+    return logs, OrderedDict((log_name, units[log_name]) for log_name in logs)
+
+
+def well_pressures(logs, mud_weight, primary_key='Hole Depth'):
+    """TVD, hydrostatic and confining pressure in kPa, see pressures.pressure_profile
+    TVD is computed from the inclination if the well has one, else the depth is the TVD"""
+    depth, depth_unit = _find_log(logs, primary_key)
+    diff_pres, diff_pres_unit = _find_log(logs, 'Differential Pressure')
+    inclination, inclination_unit = _find_log(logs, 'Inclination', required=False)
+    units = {'md': depth_unit, 'tvd': depth_unit, 'inclination': inclination_unit,
+             'diff_pres': diff_pres_unit}
+    if inclination is not None:
+        return pressure_profile(depth, inclination, mud_weight, diff_pres=diff_pres, units=units)
+
+    mud_weight = get_mud_weight(depth, mud_weight) if np.ndim(mud_weight) else mud_weight
+    hydrostatic = hydrostatic_pressure(depth, mud_weight, units=units)
+    confining = diff_pres * get_scale(diff_pres_unit or 'kPa', 'kPa')
+    confining += hydrostatic
+    return PressureProfile(depth, hydrostatic, confining)
+
+
+def well_mse(logs, area):
+    """MSE in psi, see calculate_mse"""
+    inputs, units = {}, {}
+    for name, log_name in (('wob', 'Weight on Bit'), ('rpm', 'Rotary RPM'),
+                           ('torque', 'Rotary Torque'), ('rop', 'Rate Of Penetration')):
+        inputs[name], units[name] = _find_log(logs, log_name)
+    return calculate_mse(area=area, units=units, **inputs)
+
+
+def well_ccs(ucs, logs, gr_cutoff=65, formation=None, coefficients=None):
+    """CCS in psi, see calculate_ccs
+    coefficients: constants of the formation, only part of the key so that a recalibration
+        recomputes the stage"""
+    gr, _ = _find_log(logs, 'Gamma')
+    diff_pres, diff_pres_unit = _find_log(logs, 'Differential Pressure')
+    return calculate_ccs(ucs, gr, diff_pres, gr_cutoff=gr_cutoff,
+                         units={'presdiff': diff_pres_unit}, formation=formation)
+
+
+def well_youngmodulus(ccs, pressures, formation=None, coefficients=None):
+    """E in GPa from the confining pressure, see calculate_youngmodulus"""
+    return calculate_youngmodulus(ccs, pressures.confining, units={'pc': 'kPa'},
+                                  formation=formation)
+
+
+def well_porosity(ucs, logs, method=3, gr_cutoff=65, formation=None, coefficients=None):
+    """Porosity, fraction, see calculate_porosity"""
+    gr, _ = _find_log(logs, 'Gamma')
+    return calculate_porosity(ucs, gr, method=method, gr_cutoff=gr_cutoff, formation=formation)
+
+
+def well_permeability(porosity, method=1, formation=None, coefficients=None):
+    """Permeability in nD, see calculate_permeability"""
+    return calculate_permeability(porosity, method=method, formation=formation)
+
+
+def well_result(logs, *props, properties=PROPERTIES, primary_key='Hole Depth'):
+    """Depth and structured array of the properties"""
+    depth, depth_unit = _find_log(logs, primary_key)
+    rockprops = np.empty(len(depth), dtype=[(prop, np.float64) for prop in properties])
+    for prop, values in zip(properties, props):
+        rockprops[prop] = values
+    return WellResult(depth, rockprops, primary_key, depth_unit or '')
+
+
+def build_well_dag(sources, area, mud_weight, properties=PROPERTIES, logs_names=None,
+                   filternull=True, primary_key='Hole Depth', how='exact', tolerance=0.5,
+                   pump_efficiency=0.60, gr_cutoff=65, porosity_method=3, permeability_method=1,
+                   formation=None, cache=None):
+    """DAG of one well: read -> filter -> merge -> pressures, mse -> ucs -> ccs -> E,
+    ucs -> porosity -> permeability -> rockprops
+    Input:
+        sources: well files (LAS, CSV, XLSX, Parquet, Feather), e.g. the EDR and MWD files
+        area: bit area, in^2
+        mud_weight: ppg, one value or (top MD, mud weight) pairs (see get_mud_weight)
+        logs_names: logs to read from each source, one entry per source (see read_well_file)
+        primary_key: log the sources are merged on
+        how, tolerance: see merge_logs
+        other inputs: see RockPropsPipeline
+    The 'rockprops' stage gives a WellResult.
+    """
+    if porosity_method not in (1, 2, 3):
+        raise ValueError('Unknown method.')
+    logs_names = logs_names or [None] * len(sources)
+    nodes = []
+    for source_idx, (source_loc, source_logs_names) in enumerate(zip(sources, logs_names)):
+        nodes.append(Node('read %d' % source_idx, read_source,
+                          params={'source_loc': os.path.abspath(source_loc),
+                                  'logs_names': source_logs_names},
+                          files=(source_loc,)))
+        nodes.append(Node('filter %d' % source_idx, filter_source, ('read %d' % source_idx,),
+                          {'filternull': filternull}))
+    nodes.append(Node('merge', merge_sources,
+                      tuple('filter %d' % source_idx for source_idx in range(len(sources))),
+                      {'primary_key': primary_key, 'how': how, 'tolerance': tolerance}))
+
+    def formation_params(model, **params):
+        return dict(params, formation=formation, coefficients=get_coefficients(model, formation))
+
+    porosity_params = {'method': porosity_method}
+    if porosity_method != 3:
+        # methods 1 and 2 split shale and sand by gr_cutoff, method 3 does not use it
+        porosity_params['gr_cutoff'] = gr_cutoff
+    nodes.extend([
+        Node('pressures', well_pressures, ('merge',),
+             {'mud_weight': mud_weight, 'primary_key': primary_key}),
+        Node('mse', well_mse, ('merge',), {'area': area}),
+        Node('ucs', calculate_ucs, ('mse',), {'pump_efficiency': pump_efficiency}),
+        Node('ccs', well_ccs, ('ucs', 'merge'), formation_params('ccs', gr_cutoff=gr_cutoff)),
+        Node('E', well_youngmodulus, ('ccs', 'pressures'), formation_params('youngmodulus')),
+        Node('porosity', well_porosity, ('ucs', 'merge'),
+             formation_params('porosity_%d' % porosity_method, **porosity_params)),
+        Node('permeability', well_permeability, ('porosity',),
+             formation_params('permeability_%d' % permeability_method,
+                              method=permeability_method)),
+    ])
+    properties = tuple(properties)
+    _get_required(properties)
+    nodes.append(Node('rockprops', well_result, ('merge',) + properties,
+                      {'properties': properties, 'primary_key': primary_key}))
+    return DAG(nodes, cache)
+
+
+def run_well(sources, cache_dir=CACHE_DIR, max_bytes=1 << 30, **params):
+    """WellRun of one well, see build_well_dag for params"""
+    start = time.perf_counter()
+    dag = build_well_dag(sources, cache=DiskCache(cache_dir, max_bytes), **params)
+    result = dag.run(['rockprops'])['rockprops']
+    return WellRun(result, dag.stats, time.perf_counter() - start, None)
+
+
+def run_wells(wells, workers=1, cache_dir=CACHE_DIR, max_bytes=1 << 30, **params):
+    """Run the DAG of several wells, in parallel processes sharing the cache
+    Input:
+        wells: dict of well name -> list of source files
+        workers: number of processes, all CPUs if None
+        params: see build_well_dag, the same for every well
+    Return:
+        OrderedDict of well name -> WellRun, a well that fails has its error instead of
+        a result and does not stop the others
+    """
+    kwargs = dict(params, cache_dir=cache_dir, max_bytes=max_bytes)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    runs = OrderedDict()
+    try:
+        if executor is None:
+            results = ((well_name, lambda sources=sources: run_well(sources, **kwargs))
+                       for well_name, sources in wells.items())
+        else:
+            results = [(well_name, executor.submit(run_well, sources, **kwargs).result)
+                       for well_name, sources in wells.items()]
+
+        for well_name, result in results:
+            try:
+                runs[well_name] = result()
+            except Exception as error:
+                logger.exception('Failed to run well %s.', well_name)
+                runs[well_name] = WellRun(None, OrderedDict(), None, str(error))
+            else:
+                computed = [name for name, stats in runs[well_name].stats.items()
+                            if stats.status == 'computed']
+                logger.info('Well %s: %.2f s, computed %s.', well_name, runs[well_name].seconds,
+                            ', '.join(computed) or 'nothing')
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return runs
+
+
+if __name__ == '__main__':
+    # stages are pickled by module name, run them from rockprops.dag rather than __main__
+    from rockprops.dag import run_wells
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(message)s')
+    wells = {'Middleton Unit B 47-38 No. 8SH': [
+        r'input_template/Middleton Unit B 47-38 No. 8SH__From EDR.las',
+        r'input_template/LAS Middleton Unit B 47-38 No. 8SH_From MWD.las',
+    ]}
+    # first run computes every stage, the second only the stages downstream of gr_cutoff
+    for gr_cutoff in (65, 65, 70):
+        runs = run_wells(wells, area=6, mud_weight=8.95, gr_cutoff=gr_cutoff)
+    print(runs['Middleton Unit B 47-38 No. 8SH'].result.rockprops[:5])
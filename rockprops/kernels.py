@@ -0,0 +1,156 @@
+import numpy as np
+
+from utils.units import get_scale
+from .coefficients import get_coefficients
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+"""
+Compiled kernels for the element-wise correlations of rockprops.py
+Each correlation is evaluated in one fused loop, without the temporary arrays NumPy needs.
+numba is optional: when it is not installed, rockprops.py keeps using its NumPy code,
+which stays the reference for these kernels (see check_parity).
+"""
+
+HAS_NUMBA = numba is not None
+# backend used by rockprops.py when no backend is given
+BACKEND = 'numba' if HAS_NUMBA else 'numpy'
+
+BACKENDS = ('numpy', 'numba')
+
+# unit conversions of the correlations, see utils.units
+KPA_TO_PSI = get_scale('kPa', 'psi')
+PSI_TO_MPA = get_scale('psi', 'MPa')
+KPA_TO_MPA = get_scale('kPa', 'MPa')
+
+
+def _ccs_loop(ucs, gr, presdiff, gr_cutoff, k_shale, m_shale, k_sand, m_sand, ucs_scale,
+              pres_scale, ccs):
+    for i in range(ucs.shape[0]):
+        # differential pressure to psi
+        p = presdiff[i] * pres_scale
+        if gr[i] > gr_cutoff:
+            ccs[i] = ucs[i] * ucs_scale * (1 + k_shale * p ** m_shale)
+        else:
+            ccs[i] = ucs[i] * ucs_scale * (1 + k_sand * p ** m_sand)
+
+
+def _youngmodulus_loop(ccs, pc, a, b, ccs_scale, pc_scale, E):
+    for i in range(ccs.shape[0]):
+        # ccs and pc to MPa
+        E[i] = ccs[i] * ccs_scale * a * (pc[i] * pc_scale) ** b
+
+
+def _porosity_loop(ucs, gr, gr_cutoff, k1, k2, k3, k4, ucs_scale, porosity):
+    for i in range(ucs.shape[0]):
+        # ucs to MPa, then to the unit of methods 1 and 2
+        u = ucs[i] * ucs_scale * 101.325 / 14.7
+        if gr[i] > gr_cutoff:
+            porosity[i] = k1 * u ** k2 / 100
+        else:
+            porosity[i] = k3 * u ** k4 / 100
+
+
+def _porosity_gr_loop(ucs, gr, c, gr_exponent, ucs_exponent, ucs_scale, porosity):
+    for i in range(ucs.shape[0]):
+        # ucs to MPa
+        porosity[i] = c / (gr[i] ** gr_exponent * (ucs[i] * ucs_scale) ** ucs_exponent)
+
+
+if HAS_NUMBA:
+    _ccs_loop = numba.njit(cache=True)(_ccs_loop)
+    _youngmodulus_loop = numba.njit(cache=True)(_youngmodulus_loop)
+    _porosity_loop = numba.njit(cache=True)(_porosity_loop)
+    _porosity_gr_loop = numba.njit(cache=True)(_porosity_gr_loop)
+
+
+def _as_arrays(*arrays):
+    """Broadcast inputs to contiguous float arrays the loops can index"""
+    return [np.ascontiguousarray(array, dtype=np.float64) for array in np.broadcast_arrays(*arrays)]
+
+
+def calculate_ccs(ucs, gr, presdiff, gr_cutoff=65, ucs_scale=1., pres_scale=KPA_TO_PSI,
+                  coefficients=None):
+    """Compiled rockprops.calculate_ccs
+    ucs_scale, pres_scale: factors of ucs to psi and presdiff to psi (see utils.units)
+    coefficients: constants of the correlation, the default ones if None (see coefficients.py)"""
+    c = coefficients or get_coefficients('ccs')
+    ucs, gr, presdiff = _as_arrays(ucs, gr, presdiff)
+    ccs = np.empty(ucs.shape)
+    _ccs_loop(ucs.ravel(), gr.ravel(), presdiff.ravel(), gr_cutoff, c['k_shale'], c['m_shale'],
+              c['k_sand'], c['m_sand'], ucs_scale, pres_scale, ccs.ravel())
+    return ccs
+
+
+def calculate_youngmodulus(ccs, pc, ccs_scale=PSI_TO_MPA, pc_scale=KPA_TO_MPA,
+                           coefficients=None):
+    """Compiled rockprops.calculate_youngmodulus
+    ccs_scale, pc_scale: factors of ccs and pc to MPa"""
+    c = coefficients or get_coefficients('youngmodulus')
+    ccs, pc = _as_arrays(ccs, pc)
+    E = np.empty(ccs.shape)
+    _youngmodulus_loop(ccs.ravel(), pc.ravel(), c['a'], c['b'], ccs_scale, pc_scale, E.ravel())
+    return E
+
+
+def calculate_porosity(ucs, gr, method=3, gr_cutoff=65, ucs_scale=PSI_TO_MPA, coefficients=None):
+    """Compiled rockprops.calculate_porosity
+    ucs_scale: factor of ucs to MPa"""
+    if method not in (1, 2, 3):
+        raise ValueError('Unknown method.')
+    c = coefficients or get_coefficients('porosity_%d' % method)
+    ucs, gr = _as_arrays(ucs, gr)
+    porosity = np.empty(ucs.shape)
+    if method == 3:
+        _porosity_gr_loop(ucs.ravel(), gr.ravel(), c['c'], c['gr_exponent'], c['ucs_exponent'],
+                          ucs_scale, porosity.ravel())
+    else:
+        _porosity_loop(ucs.ravel(), gr.ravel(), gr_cutoff, c['k1'], c['k2'], c['k3'], c['k4'],
+                       ucs_scale, porosity.ravel())
+    return porosity
+
+
+def check_parity(n_samples=100000, seed=0, rtol=1e-12):
+    """Compare the compiled kernels against the NumPy reference of rockprops.py
+    Return dict of correlation -> max relative difference
+    Raise AssertionError if a difference is above rtol"""
+    if not HAS_NUMBA:
+        raise ImportError('numba is not installed, only the NumPy backend is available.')
+
+    from . import rockprops
+
+    rng = np.random.RandomState(seed)
+    ucs = rng.uniform(1000, 40000, n_samples)
+    # GR values right at the cutoff check the shale/sand branch
+    gr = np.r_[rng.uniform(10, 200, n_samples - 2), 65, 65.000001]
+    presdiff = rng.uniform(100, 8000, n_samples)
+    pc = rng.uniform(1000, 50000, n_samples)
+
+    cases = [
+        ('ccs', lambda backend: rockprops.calculate_ccs(ucs, gr, presdiff, backend=backend)),
+        ('ccs gr_cutoff=60', lambda backend: rockprops.calculate_ccs(ucs, gr, presdiff, gr_cutoff=60,
+                                                                     backend=backend)),
+        ('youngmodulus', lambda backend: rockprops.calculate_youngmodulus(ucs, pc, backend=backend)),
+    ]
+    for method in (1, 2, 3):
+        cases.append(('porosity method=%d' % method,
+                      lambda backend, method=method: rockprops.calculate_porosity(
+                          ucs, gr, method=method, backend=backend)))
+
+    differences = {}
+    for name, func in cases:
+        reference, compiled = func('numpy'), func('numba')
+        differences[name] = np.max(np.abs(compiled - reference) / np.abs(reference))
+        assert differences[name] <= rtol, \
+            '%s differs from the NumPy reference by %g.' % (name, differences[name])
+
+    return differences
+
+
+if __name__ == '__main__':
+    print('Backend: %s' % BACKEND)
+    for name, difference in check_parity().items():
+        print('%s: max relative difference %g' % (name, difference))
@@ -0,0 +1,314 @@
+import math
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from utils.columnar import COLUMNAR_EXTS, write_columnar
+from utils.units import get_scale
+from .coefficients import get_coefficients
+
+"""
+Single-pass engine for the rock properties chain MSE -> UCS -> CCS -> E -> porosity -> permeability
+Gives the same results as calculate_mse, calculate_ucs, ... in rockprops.py, but samples are
+processed chunk by chunk with in-place ufuncs into a preallocated structured output, so the
+temporaries never grow past one chunk.
+"""
+
+PSI_TO_MPA = get_scale('psi', 'MPa')
+
+# all properties the pipeline can compute, in calculation order
+PROPERTIES = ('mse', 'ucs', 'ccs', 'E', 'porosity', 'permeability')
+
+# properties each property is calculated from
+PROPERTY_DEPENDENCIES = {
+    'mse': (),
+    'ucs': ('mse',),
+    'ccs': ('ucs',),
+    'E': ('ccs',),
+    'porosity': ('ucs',),
+    'permeability': ('porosity',),
+}
+
+# unit of each property, see rockprops.py
+PROPERTY_UNITS = {
+    'mse': 'psi',
+    'ucs': 'psi',
+    'ccs': 'psi',
+    'E': 'GPa',
+    'porosity': 'fraction',
+    'permeability': 'nD',
+}
+
+# logs each property needs, besides the properties it depends on
+PROPERTY_LOGS = {
+    'mse': ('wob', 'rpm', 'torque', 'rop'),
+    'ucs': (),
+    'ccs': ('gr', 'diff_pres'),
+    'E': ('pc',),
+    'porosity': ('gr',),
+    'permeability': (),
+}
+
+# unit of each log the pipeline expects by default, see rockprops.py
+LOGS_UNITS = {
+    'wob': 'kDaN',
+    'rpm': 'rev/min',
+    'torque': 'in.lbf',
+    'rop': 'ft/hr',
+    'gr': 'API',
+    'diff_pres': 'kPa',
+    'pc': 'kPa',
+    'area': 'in^2',
+}
+
+# unit each log is converted to in the correlations
+CORRELATION_UNITS = {
+    'wob': 'lbf',
+    'rpm': 'rev/min',
+    'torque': 'in.lbf',
+    'rop': 'in/min',
+    'gr': 'API',
+    'diff_pres': 'psi',
+    'pc': 'MPa',
+    'area': 'in^2',
+}
+
+# default name of each log in the merged logs (see utils.EDR_LOGS_NAMES, MWD_LOGS_NAMES)
+LOGS_NAMES = {
+    'wob': 'WOB',
+    'rpm': 'RPM',
+    'torque': 'TOR',
+    'rop': 'ROP',
+    'gr': 'GR',
+    'diff_pres': 'DIFP',
+    'pc': 'PC',
+}
+
+
+def _get_required(properties):
+    """All properties needed to calculate properties, in calculation order"""
+    required = set()
+    stack = list(properties)
+    while stack:
+        prop = stack.pop()
+        if prop not in PROPERTY_DEPENDENCIES:
+            raise ValueError('Unknown property: %s.' % prop)
+        if prop not in required:
+            required.add(prop)
+            stack.extend(PROPERTY_DEPENDENCIES[prop])
+    return [prop for prop in PROPERTIES if prop in required]
+
+
+class RockPropsPipeline():
+    """Calculate rock properties from the merged logs in one pass
+
+    pipeline = RockPropsPipeline(area=6, properties=('ucs', 'ccs', 'porosity'))
+    rockprops = pipeline.run(logs_dict)
+    rockprops['ucs']
+
+    Input units follow rockprops.py:
+        wob: kDaN, area: in^2, rpm: rev/min, torque: in.lbf, rop: ft/hr,
+        gr: API, diff_pres: kPa, pc: kPa
+    Logs in other units are given by units, e.g. units={'wob': 'klbf', 'area': 'cm^2'}.
+    Conversions fold into the constants of the correlations, they cost no extra pass.
+    Constants of the correlations are those of formation, default if None (see coefficients.py).
+    """
+
+    def __init__(self, area, properties=PROPERTIES, pump_efficiency=0.60, gr_cutoff=65,
+                 porosity_method=3, permeability_method=1, logs_names=None, chunk_size=1 << 16,
+                 units=None, formation=None):
+        if porosity_method not in (1, 2, 3):
+            raise ValueError('Unknown method.')
+        if permeability_method != 1:
+            raise ValueError('Unknown method.')
+
+        self.area = area
+        self.properties = tuple(properties)
+        self.pump_efficiency = pump_efficiency
+        self.gr_cutoff = gr_cutoff
+        self.porosity_method = porosity_method
+        self.permeability_method = permeability_method
+        self.logs_names = dict(LOGS_NAMES, **(logs_names or {}))
+        self.chunk_size = chunk_size
+        self.units = dict(LOGS_UNITS, **(units or {}))
+        # factor of each log from its unit to the unit of the correlations
+        self.scales = {log: get_scale(self.units[log], to_unit)
+                       for log, to_unit in CORRELATION_UNITS.items()}
+        self.formation = formation
+        self.coefficients = {
+            'ccs': get_coefficients('ccs', formation),
+            'E': get_coefficients('youngmodulus', formation),
+            'porosity': get_coefficients('porosity_%d' % porosity_method, formation),
+            'permeability': get_coefficients('permeability_%d' % permeability_method, formation),
+        }
+
+        self.required = _get_required(self.properties)
+        self.required_logs = sorted(set(log for prop in self.required for log in PROPERTY_LOGS[prop]))
+        self.dtype = np.dtype([(prop, np.float64) for prop in self.properties])
+
+    def _get_logs(self, logs, columns):
+        """Map each required log to its array"""
+        if isinstance(logs, np.ndarray) and logs.ndim == 2:
+            if columns is None:
+                raise ValueError('columns are required to read logs from a 2D array.')
+            columns = list(columns)
+            logs = {column: logs[:, col_idx] for col_idx, column in enumerate(columns)}
+
+        required_logs = {}
+        for log in self.required_logs:
+            log_name = self.logs_names[log]
+            if log_name not in logs:
+                raise ValueError('Log %s (%s) is required for %s.'
+                                 % (log_name, log, ', '.join(self.properties)))
+            required_logs[log] = np.asarray(logs[log_name], dtype=np.float64)
+        return required_logs
+
+    def run(self, logs, columns=None, out=None):
+        """Calculate all properties
+        Input:
+            logs: dict of log name -> values, or 2D array of the merged logs
+            columns: names of the columns of logs if it is a 2D array
+            out: structured array to write into, allocated if None
+        Return:
+            structured array with one field per property
+        """
+        logs = self._get_logs(logs, columns)
+        n_samples = len(next(iter(logs.values()))) if logs else 0
+        if out is None:
+            out = np.empty(n_samples, dtype=self.dtype)
+
+        # scratch buffers reused for every chunk
+        chunk_size = min(self.chunk_size, max(n_samples, 1))
+        buffers = {prop: np.empty(chunk_size) for prop in self.required}
+        tmp = np.empty(chunk_size)
+        shale = np.empty(chunk_size, dtype=bool)
+
+        for start in range(0, n_samples, chunk_size):
+            stop = min(start + chunk_size, n_samples)
+            size = stop - start
+            chunk_logs = {log: values[start:stop] for log, values in logs.items()}
+            chunk_buffers = {prop: buffer[:size] for prop, buffer in buffers.items()}
+
+            self._run_chunk(chunk_logs, chunk_buffers, tmp[:size], shale[:size])
+
+            for prop in self.properties:
+                out[prop][start:stop] = chunk_buffers[prop]
+
+        return out
+
+    def _run_chunk(self, logs, props, tmp, shale):
+        """Calculate all required properties of one chunk in place"""
+        coefficients = self.coefficients
+        if 'gr' in logs:
+            np.greater(logs['gr'], self.gr_cutoff, out=shale)
+
+        if 'mse' in props:
+            # see calculate_mse
+            # mse = wob / area + 2 * pi * rpm * torque / (area * rop)
+            # rop to in/min, wob to lbf
+            area = self.area * self.scales['area']
+            mse = props['mse']
+            np.multiply(logs['rop'], self.scales['rop'] * area, out=tmp)
+            np.multiply(logs['rpm'], 2 * math.pi * self.scales['rpm'] * self.scales['torque'],
+                        out=mse)
+            mse *= logs['torque']
+            mse /= tmp
+            np.multiply(logs['wob'], self.scales['wob'] / area, out=tmp)
+            mse += tmp
+
+        if 'ucs' in props:
+            # see calculate_ucs
+            np.multiply(props['mse'], self.pump_efficiency, out=props['ucs'])
+
+        if 'ccs' in props:
+            # see calculate_ccs
+            # ccs = ucs * (1 + k * presdiff ** m), k and m depend on shale
+            # differential pressure to psi
+            c = coefficients['ccs']
+            ccs = props['ccs']
+            np.multiply(logs['diff_pres'], self.scales['diff_pres'], out=tmp)
+            np.power(tmp, np.where(shale, c['m_shale'], c['m_sand']), out=tmp)
+            tmp *= np.where(shale, c['k_shale'], c['k_sand'])
+            tmp += 1
+            np.multiply(props['ucs'], tmp, out=ccs)
+
+        if 'E' in props:
+            # see calculate_youngmodulus
+            # E = ccs * a * pc ** b with ccs and pc in MPa
+            a, b = coefficients['E']['a'], coefficients['E']['b']
+            E = props['E']
+            np.multiply(logs['pc'], self.scales['pc'], out=tmp)
+            np.power(tmp, b, out=tmp)
+            np.multiply(props['ccs'], PSI_TO_MPA * a, out=E)
+            E *= tmp
+
+        if 'porosity' in props:
+            # see calculate_porosity
+            c = coefficients['porosity']
+            porosity = props['porosity']
+            if self.porosity_method == 3:
+                # porosity = c / (gr ** 0.25 * ucs ** 0.47), ucs in MPa
+                np.multiply(props['ucs'], PSI_TO_MPA, out=tmp)
+                np.power(tmp, c['ucs_exponent'], out=tmp)
+                np.power(logs['gr'], c['gr_exponent'], out=porosity)
+                porosity *= tmp
+                np.divide(c['c'], porosity, out=porosity)
+            else:
+                # porosity = k * ucs ** m / 100, k and m depend on shale
+                k1, k2, k3, k4 = c['k1'], c['k2'], c['k3'], c['k4']
+                np.multiply(props['ucs'], PSI_TO_MPA * 101.325 / 14.7, out=tmp)
+                np.power(tmp, np.where(shale, k2, k4), out=porosity)
+                porosity *= np.where(shale, k1 / 100, k3 / 100)
+
+        if 'permeability' in props:
+            # see calculate_permeability
+            permeability = props['permeability']
+            np.multiply(props['porosity'], 100, out=permeability)
+            np.power(permeability, coefficients['permeability']['m'], out=permeability)
+            permeability *= coefficients['permeability']['c']
+
+
+def save_rockprops(file_loc, rockprops, depth=None, depth_name='TVD', depth_unit='ft',
+                   compression='zstd'):
+    """Save the properties calculated by RockPropsPipeline.run
+    Parquet and Feather files keep the unit of each property in the column metadata,
+    CSV files name their columns as 'name,unit'.
+    Input:
+        depth: depth of each sample, saved as first column if given
+        compression: compression of Parquet and Feather files
+    """
+    table = OrderedDict()
+    units = {depth_name: depth_unit}
+    if depth is not None:
+        table[depth_name] = depth
+    for prop in rockprops.dtype.names:
+        table[prop] = rockprops[prop]
+        # bands of uncertainty.py are named 'property percentile'
+        units[prop] = PROPERTY_UNITS.get(prop.partition(' ')[0], '')
+
+    if os.path.splitext(file_loc)[1].lower() in COLUMNAR_EXTS.values():
+        write_columnar(file_loc, table, units, compression=compression)
+    else:
+        pd.DataFrame(OrderedDict(('%s,%s' % (name, units[name]), values)
+                                 for name, values in table.items())).to_csv(file_loc, index=False)
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+    n_samples = 10
+    logs_dict = OrderedDict([
+        ('WOB', rng.uniform(5, 25, n_samples)),
+        ('RPM', rng.uniform(40, 120, n_samples)),
+        ('TOR', rng.uniform(2, 20, n_samples)),
+        ('ROP', rng.uniform(50, 400, n_samples)),
+        ('GR', rng.uniform(20, 150, n_samples)),
+        ('DIFP', rng.uniform(500, 5000, n_samples)),
+        ('PC', rng.uniform(5000, 40000, n_samples)),
+    ])
+
+    pipeline = RockPropsPipeline(area=6)
+    rockprops = pipeline.run(logs_dict)
+    print(rockprops['ucs'])
+    print(rockprops['porosity'])
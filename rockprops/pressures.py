@@ -1,47 +1,254 @@
+from collections import namedtuple
 
+import numpy as np
 
-def hydsta_pres(mudweight, depth, inclination, inclination_threshold=90):
+from utils.units import get_scale, unit_of
+from .rockprops import _get_scale
+
+"""
+Pressure profiles along the well
+TVD is computed from the survey (MD, inclination, azimuth) by minimum curvature, and the
+hydrostatic pressure integrates the mud weight over TVD with a cumulative sum, so the mud
+weight can change with depth. Samples are processed chunk by chunk, the running TVD and
+pressure are carried from one chunk to the next, and temporaries never grow past one chunk.
+"""
+
+# psi per ft of column per ppg of mud weight
+HYDROSTATIC_GRADIENT = 0.052
+
+PressureProfile = namedtuple('PressureProfile', ['tvd', 'hydrostatic', 'confining'])
+
+
+def hydsta_pres(mudweight, depth, inclination, inclination_threshold=90, units=None):
     """Calculate hydrostatic pressure based on mudweight
+    See pressure_profile for TVD from the survey and a mud weight changing with depth.
 
     Input unit:
         mudweight: ppg
         depth: ft
         inclination: degree
+        units: dict of input -> unit (see utils.units), e.g. {'depth': 'm'},
+            LogArray inputs carry their own unit
     Output unit:
-        hydrostatic pressure: kPa
+        hydrostatic pressure: psi (0.052 psi/ft per ppg)
     """
-
-    Ph = 0.052 * mudweight * depth
+    units = units or {}
+    scale = HYDROSTATIC_GRADIENT * \
+        get_scale(units.get('mudweight') or unit_of(mudweight, 'ppg'), 'ppg') * \
+        get_scale(units.get('depth') or unit_of(depth, 'ft'), 'ft')
+    Ph = scale * mudweight * np.asarray(depth, dtype=np.float64)
 
     # below kick-off has same pressure
-    kick_off = inclination > inclination_threshold
-    Ph[kick_off] = Ph[~kick_off][-1]
+    inclination_threshold /= get_scale(units.get('inclination') or unit_of(inclination, 'deg'),
+                                       'deg')
+    kick_off = np.asarray(inclination) > inclination_threshold
+    # nothing to hold if the whole well is below or above the kick-off
+    if kick_off.any() and not kick_off.all():
+        Ph[kick_off] = Ph[~kick_off][-1]
 
-    return Ph #Kpa
+    return Ph  # psi
 
 
-def conf_pres(hydsta_pres, diff_pres):
+def conf_pres(hydsta_pres, diff_pres, units=None, out_unit='kPa'):
     """Calculate confined pressure based on hydrostatic pressure
     and differential pressure
+    See pressure_profile for both pressures from the survey in one call.
 
     Input unit:
-        hydsta_pres: Kpa
-        diff_pres: Kpa
-        """
-    return hydsta_pres + diff_pres
+        hydsta_pres: psi, as returned by hydsta_pres
+        diff_pres: kPa
+        units: dict of input -> unit (see utils.units), e.g. {'hydsta_pres': 'kPa'},
+            LogArray inputs carry their own unit
+    Output unit:
+        confined pressure: out_unit
+    """
+    confining = np.multiply(hydsta_pres, _get_scale('hydsta_pres', hydsta_pres, units, 'psi',
+                                                    out_unit))
+    confining += np.multiply(diff_pres, _get_scale('diff_pres', diff_pres, units, 'kPa',
+                                                   out_unit))
+    return confining
+
+
+def get_mud_weight(md, schedule):
+    """Mud weight at each depth
+    Input:
+        schedule: one mud weight for the whole well, one mud weight per sample,
+            or (top MD, mud weight) pairs sorted by MD: each mud weight applies from its
+            top to the next top, the first one also above its top
+    """
+    schedule = np.asarray(schedule, dtype=np.float64)
+    if schedule.ndim == 0 or (schedule.ndim == 1 and len(schedule) == len(md)):
+        return schedule
+    if schedule.ndim != 2 or schedule.shape[1] != 2:
+        raise ValueError('Mud weight schedule must be (top MD, mud weight) pairs.')
+    tops, weights = schedule[:, 0], schedule[:, 1]
+    if np.any(np.diff(tops) < 0):
+        raise ValueError('Mud weight schedule must be sorted by MD.')
+    idx = np.searchsorted(tops, md, side='right') - 1
+    np.maximum(idx, 0, out=idx)
+    return weights[idx]
+
+
+def _dogleg_factor(inc1, inc2, azi1, azi2, out):
+    """Ratio factor of minimum curvature, 2 / dogleg * tan(dogleg / 2), angles in rad"""
+    # dogleg from the haversine form, accurate for the small doglegs of a survey
+    half_inc = np.subtract(inc2, inc1)
+    half_inc *= 0.5
+    np.sin(half_inc, out=half_inc)
+    np.square(half_inc, out=out)
+    if azi1 is not None:
+        half_azi = np.subtract(azi2, azi1)
+        half_azi *= 0.5
+        np.sin(half_azi, out=half_azi)
+        np.square(half_azi, out=half_azi)
+        half_azi *= np.sin(inc1)
+        half_azi *= np.sin(inc2)
+        out += half_azi
+    np.clip(out, 0, 1, out=out)
+    np.sqrt(out, out=out)
+    np.arcsin(out, out=out)
+    # out is dogleg / 2, the factor tends to 1 + dogleg ** 2 / 12 for straight sections
+    straight = out < 1e-6
+    np.divide(np.tan(out), out, out=out, where=~straight)
+    out[straight] = 1.
+    return out
+
+
+def minimum_curvature(md, inclination, azimuth=None, tvd_start=None, units=None,
+                      chunk_size=1 << 20, out=None):
+    """TVD of each survey station by minimum curvature
+    Input:
+        md: measured depth, TVD is in the unit of md
+        inclination: degree, from vertical
+        azimuth: degree, None for a well without turn
+        tvd_start: TVD of the first station, md[0] if None (vertical above the first station)
+        units: dict of input -> unit (see utils.units), e.g. {'inclination': 'rad'}
+    Return:
+        tvd
+    """
+    angle_scale = _get_scale('inclination', inclination, units, 'deg', 'rad')
+    inclination = np.asarray(inclination, dtype=np.float64)
+    if azimuth is not None:
+        azimuth_scale = _get_scale('azimuth', azimuth, units, 'deg', 'rad')
+        azimuth = np.asarray(azimuth, dtype=np.float64)
+    md = np.asarray(md, dtype=np.float64)
+    n_samples = len(md)
+    tvd = np.empty(n_samples) if out is None else out
+    if not n_samples:
+        return tvd
+
+    tvd[0] = md[0] if tvd_start is None else tvd_start
+    chunk_size = min(chunk_size, n_samples)
+    factor = np.empty(chunk_size)
+    for start in range(1, n_samples, chunk_size):
+        stop = min(start + chunk_size, n_samples)
+        # station i is the end of the section from station i - 1
+        inc1 = inclination[start - 1:stop - 1] * angle_scale
+        inc2 = inclination[start:stop] * angle_scale
+        azi1 = azi2 = None
+        if azimuth is not None:
+            azi1 = azimuth[start - 1:stop - 1] * azimuth_scale
+            azi2 = azimuth[start:stop] * azimuth_scale
+        section_factor = _dogleg_factor(inc1, inc2, azi1, azi2, factor[:stop - start])
+
+        # dTVD = dMD / 2 * (cos inc1 + cos inc2) * factor
+        dtvd = tvd[start:stop]
+        np.subtract(md[start:stop], md[start - 1:stop - 1], out=dtvd)
+        dtvd *= 0.5
+        dtvd *= section_factor
+        np.cos(inc1, out=inc1)
+        np.cos(inc2, out=inc2)
+        inc1 += inc2
+        dtvd *= inc1
+        np.cumsum(dtvd, out=dtvd)
+        dtvd += tvd[start - 1]
+
+    return tvd
+
+
+def hydrostatic_pressure(tvd, mud_weight, surface_pressure=0., units=None, out_unit='kPa',
+                         chunk_size=1 << 20, out=None):
+    """Hydrostatic pressure of a mud column whose weight can change with depth
+    pressure = surface pressure + sum of 0.052 * mud weight * dTVD, the column above the
+    first sample has the mud weight of the first sample.
+    Input:
+        tvd: ft
+        mud_weight: ppg, one value or one value per sample (see get_mud_weight)
+        surface_pressure: in out_unit
+        units: dict of input -> unit (see utils.units), e.g. {'tvd': 'm', 'mud_weight': 'sg'}
+    Return:
+        hydrostatic pressure in out_unit
+    """
+    # conversions fold into the gradient
+    gradient = HYDROSTATIC_GRADIENT * \
+        _get_scale('mud_weight', mud_weight, units, 'ppg', 'ppg') * \
+        _get_scale('tvd', tvd, units, 'ft', 'ft') * get_scale('psi', out_unit)
+    tvd = np.asarray(tvd, dtype=np.float64)
+    n_samples = len(tvd)
+    pressure = np.empty(n_samples) if out is None else out
+    if not n_samples:
+        return pressure
+    mud_weight = np.broadcast_to(np.asarray(mud_weight, dtype=np.float64), tvd.shape)
+
+    pressure[0] = surface_pressure + gradient * mud_weight[0] * tvd[0]
+    for start in range(1, n_samples, chunk_size):
+        stop = min(start + chunk_size, n_samples)
+        # mud weight of a sample applies to the section above it
+        section = pressure[start:stop]
+        np.subtract(tvd[start:stop], tvd[start - 1:stop - 1], out=section)
+        section *= mud_weight[start:stop]
+        section *= gradient
+        np.cumsum(section, out=section)
+        section += pressure[start - 1]
+
+    return pressure
+
+
+def pressure_profile(md, inclination, mud_weight, azimuth=None, diff_pres=None, tvd_start=None,
+                     surface_pressure=0., units=None, out_unit='kPa', chunk_size=1 << 20):
+    """TVD, hydrostatic and confining pressure of a well in one pass
+    Input:
+        md: ft
+        inclination, azimuth: degree, see minimum_curvature
+        mud_weight: ppg, one value, one value per sample, or (top MD, mud weight) pairs
+            (see get_mud_weight)
+        diff_pres: differential pressure, kPa, confining pressure is None if not given
+        surface_pressure: in out_unit
+        units: dict of input -> unit (see utils.units), LogArray inputs carry their own unit
+        out_unit: unit of the pressures, kPa as expected by RockPropsPipeline for pc
+    Return:
+        PressureProfile(tvd, hydrostatic, confining), tvd in the unit of md
+    """
+    units = units or {}
+    tvd = minimum_curvature(md, inclination, azimuth, tvd_start, units, chunk_size)
+    mud_weight = get_mud_weight(md, mud_weight) if np.ndim(mud_weight) else mud_weight
+    tvd_units = dict(units, tvd=units.get('md') or unit_of(md, 'ft'))
+    hydrostatic = hydrostatic_pressure(tvd, mud_weight, surface_pressure, tvd_units, out_unit,
+                                       chunk_size)
+
+    confining = None
+    if diff_pres is not None:
+        # see conf_pres
+        confining = np.multiply(diff_pres, _get_scale('diff_pres', diff_pres, units, 'kPa',
+                                                      out_unit))
+        confining += hydrostatic
+    return PressureProfile(tvd, hydrostatic, confining)
 
 
 if __name__ == '__main__':
-    import numpy as np
     mudweight = 8
     depth = np.arange(6)
 
-    inclination = np.ones(depth.shape).astype(dtype=np.int)
+    inclination = np.ones(depth.shape).astype(dtype=int)
     inclination[-3:] = 92
     p = hydsta_pres(mudweight, depth, inclination)
     print(inclination)
     print(depth)
     print(p)
 
-
-
+    # build up from vertical to horizontal between 1000 and 2000 ft, mud weight up at 1500 ft
+    md = np.arange(0, 3000, 100.)
+    inclination = np.clip((md - 1000) * 90 / 1000, 0, 90)
+    profile = pressure_profile(md, inclination, [(0, 8.6), (1500, 9.2)], out_unit='psi')
+    print(profile.tvd)
+    print(profile.hydrostatic)
@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from utils.logscleanup import EDR_LOGS_NAMES, merge_logs
+from utils.tail import get_table_layout, find_layout_columns, read_new_lines, parse_lines, \
+    save_offset
+from .pipeline import RockPropsPipeline, PROPERTIES, PROPERTY_LOGS, PROPERTY_UNITS, LOGS_NAMES, \
+    _get_required
+
+"""
+Rock properties of a well while it is drilled
+The EDR file (and other logs such as the MWD gamma ray) keep growing on the rig. Each update
+reads only the rows appended since the byte offsets of the previous update, filters and
+merges them, and appends the properties of the new depths to the output csv. The offsets
+and the rows waiting for other logs are saved after each update, so a restart resumes
+where it stopped and an update costs as much as the new rows, whatever the file size.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def get_available_properties(logs_names, pipeline_logs_names=None):
+    """Properties that can be calculated from the logs"""
+    pipeline_logs_names = dict(LOGS_NAMES, **(pipeline_logs_names or {}))
+    return tuple(prop for prop in PROPERTIES
+                 if all(pipeline_logs_names[log] in logs_names
+                        for required in _get_required([prop]) for log in PROPERTY_LOGS[required]))
+
+
+class RealtimeRockProps():
+    """Follow growing well files and append the rock properties of new depths
+
+    realtime = RealtimeRockProps([(edr_file, EDR_LOGS_NAMES), (mwd_file, MWD_LOGS_NAMES)],
+                                 'rockprops.csv', area=6)
+    realtime.run(poll_seconds=5)
+
+    The first source drives the output depths, rows of the other sources are joined on
+    primary_key with merge_logs. Depths are assumed to increase as the well is drilled: a
+    row is processed once every other source has logged that depth.
+    """
+
+    def __init__(self, sources, out_loc, area, properties=None, state_loc=None,
+                 primary_key='TVD', how='exact', tolerance=0.5, **pipeline_params):
+        """
+        Input:
+            sources: list of (file location, logs names), logs names as in
+                get_filtered_log_reading_dict (EDR_LOGS_NAMES, MWD_LOGS_NAMES)
+            out_loc: csv the properties are appended to
+            properties: properties to calculate, all those the logs allow if None
+            state_loc: where offsets and pending rows are saved, next to out_loc if None
+            how, tolerance: see merge_logs ('exact' or 'nearest')
+            pipeline_params: parameters of RockPropsPipeline (gr_cutoff, porosity_method, ...),
+                units of the file headers are used for the logs not given in units
+        """
+        if how not in ('exact', 'nearest'):
+            raise ValueError('Only exact and nearest merges can be done incrementally.')
+        self.source_locs = [source_loc for source_loc, _ in sources]
+        self.out_loc = out_loc
+        self.state_loc = state_loc or out_loc + '.state.json'
+        self.primary_key = primary_key
+        self.how = how
+        self.tolerance = tolerance
+
+        # columns and units of each source, found once from its header
+        self.layouts, self.col_idxes, self.logs_names, self.units = [], [], [], OrderedDict()
+        for source_loc, logs_names in sources:
+            layout = get_table_layout(source_loc)
+            attr_mapping_idx, attr_mapping_unit = find_layout_columns(source_loc, layout, logs_names)
+            if primary_key not in attr_mapping_idx:
+                raise ValueError('The primary key %s is missing in %s.' % (primary_key, source_loc))
+            self.layouts.append(layout)
+            self.col_idxes.append(list(attr_mapping_idx.values()))
+            self.logs_names.append(list(attr_mapping_idx))
+            for log_name, unit in attr_mapping_unit.items():
+                self.units.setdefault(log_name, unit)
+
+        if properties is None:
+            properties = get_available_properties(self.units, pipeline_params.get('logs_names'))
+        # units of the headers, as dag.well_mse does, units given in pipeline_params win
+        logs_names = dict(LOGS_NAMES, **(pipeline_params.get('logs_names') or {}))
+        units = OrderedDict((log, self.units[log_name]) for log, log_name in logs_names.items()
+                            if self.units.get(log_name))
+        units.update(pipeline_params.pop('units', None) or {})
+        self.pipeline = RockPropsPipeline(area, properties, units=units, **pipeline_params)
+
+        self.load_state()
+
+    def load_state(self):
+        """Offsets and pending rows of the previous run, start of the files if none"""
+        self.offsets = [layout.data_offset for layout in self.layouts]
+        # primary rows waiting for the other sources, rows of the other sources to join
+        self.buffers = [np.empty((0, len(logs_names))) for logs_names in self.logs_names]
+        self.last_depth = -np.inf
+
+        if not os.path.isfile(self.state_loc):
+            return
+        with open(self.state_loc) as file:
+            state = json.load(file)
+        if state.get('sources') != [os.path.abspath(source_loc) for source_loc in self.source_locs]:
+            raise ValueError('State %s was saved for other sources.' % self.state_loc)
+        self.offsets = state['offset']
+        self.buffers = [np.array(rows, dtype=np.float64).reshape(-1, len(logs_names))
+                        for rows, logs_names in zip(state['buffers'], self.logs_names)]
+        self.last_depth = state['last_depth'] if state['last_depth'] is not None else -np.inf
+
+    def save_state(self):
+        save_offset(self.state_loc, self.offsets,
+                    sources=[os.path.abspath(source_loc) for source_loc in self.source_locs],
+                    buffers=[np.where(np.isnan(buffer), None, buffer).tolist()
+                             for buffer in self.buffers],
+                    last_depth=None if np.isinf(self.last_depth) else self.last_depth)
+
+    def _read_new_rows(self, source_idx):
+        """Filtered rows appended to a source since its offset"""
+        lines, self.offsets[source_idx] = read_new_lines(self.source_locs[source_idx],
+                                                         self.offsets[source_idx])
+        values = parse_lines(lines, self.layouts[source_idx], self.col_idxes[source_idx])
+        # same filter as get_filtered_log_reading_dict: rows where all logs are positive
+        return values[(values > 0).all(axis=1)]
+
+    def _as_dict(self, source_idx, values):
+        return OrderedDict((log_name, values[:, col_idx])
+                           for col_idx, log_name in enumerate(self.logs_names[source_idx]))
+
+    def update(self):
+        """Read the new rows of every source and append the properties of the new depths
+        Return:
+            DataFrame of the appended rows (empty if no new depth is complete)
+        """
+        for source_idx in range(len(self.source_locs)):
+            new_rows = self._read_new_rows(source_idx)
+            if len(new_rows):
+                self.buffers[source_idx] = np.concatenate((self.buffers[source_idx], new_rows))
+
+        primary = self.buffers[0]
+        depth_idx = self.logs_names[0].index(self.primary_key)
+        if len(self.buffers) == 1:
+            ready = np.ones(len(primary), dtype=bool)
+        else:
+            # a depth is complete once every other source has logged past it
+            logged_depths = [buffer[:, logs_names.index(self.primary_key)].max() if len(buffer)
+                             else -np.inf
+                             for buffer, logs_names in zip(self.buffers[1:], self.logs_names[1:])]
+            ready = primary[:, depth_idx] <= min(logged_depths)
+        rows, self.buffers[0] = primary[ready], primary[~ready]
+
+        if len(self.buffers) == 1 or not len(rows):
+            logs_dict = self._as_dict(0, rows)
+        else:
+            logs_dict, _ = merge_logs([self._as_dict(source_idx, buffer if source_idx else rows)
+                                       for source_idx, buffer in enumerate(self.buffers)],
+                                      primary_key=self.primary_key, how=self.how,
+                                      tolerance=self.tolerance)
+            # depths joined by an earlier update are not output again
+            keep = logs_dict[self.primary_key] > self.last_depth
+            logs_dict = OrderedDict((log_name, values[keep]) for log_name, values in logs_dict.items())
+
+            # rows of the other sources far above the next depths can't be joined anymore
+            last_ready = rows[:, depth_idx].max()
+            margin = self.tolerance if self.how == 'nearest' else 0
+            for source_idx, logs_names in enumerate(self.logs_names[1:], 1):
+                buffer = self.buffers[source_idx]
+                self.buffers[source_idx] = buffer[
+                    buffer[:, logs_names.index(self.primary_key)] >= last_ready - margin]
+
+        depth = logs_dict[self.primary_key]
+        table = OrderedDict([('%s,%s' % (self.primary_key, self.units[self.primary_key]), depth)])
+        if len(depth):
+            self.last_depth = max(self.last_depth, depth.max())
+            rockprops = self.pipeline.run(logs_dict)
+            for prop in self.pipeline.properties:
+                table['%s,%s' % (prop, PROPERTY_UNITS[prop])] = rockprops[prop]
+        else:
+            for prop in self.pipeline.properties:
+                table['%s,%s' % (prop, PROPERTY_UNITS[prop])] = np.zeros(0)
+        table = pd.DataFrame(table)
+
+        # output is written before the state, a crash in between repeats rows, never loses them
+        if len(table):
+            table.to_csv(self.out_loc, mode='a', header=not os.path.isfile(self.out_loc),
+                         index=False)
+        self.save_state()
+
+        return table
+
+    def run(self, poll_seconds=1., timeout=None):
+        """Update every poll_seconds until no new row arrives for timeout seconds
+        (forever if None)"""
+        last_rows_time = time.monotonic()
+        while True:
+            start = time.perf_counter()
+            table = self.update()
+            if len(table):
+                last_rows_time = time.monotonic()
+                logger.info('Appended %d depths down to %g in %.3f s.', len(table),
+                            table.iloc[-1, 0], time.perf_counter() - start)
+            elif timeout is not None and time.monotonic() - last_rows_time > timeout:
+                return
+            time.sleep(poll_seconds)
+
+
+if __name__ == '__main__':
+    from utils.logscleanup import MWD_LOGS_NAMES
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    edr_file = r'../input_template/Middleton Unit B 47-38 No. 8SH__From EDR.las'
+    mwd_file = r'../input_template/LAS Middleton Unit B 47-38 No. 8SH_From MWD.las'
+    realtime = RealtimeRockProps([(edr_file, EDR_LOGS_NAMES), (mwd_file, MWD_LOGS_NAMES)],
+                                 '../output/rockprops_realtime.csv', area=6)
+    realtime.run(poll_seconds=5, timeout=60)
@@ -1,6 +1,27 @@
 import numpy as np
 import math
 
+from utils.units import get_scale, unit_of
+from . import kernels
+from .coefficients import get_coefficients
+
+
+def _use_kernels(backend):
+    """True if the compiled kernels are used instead of the NumPy code below"""
+    backend = kernels.BACKEND if backend is None else backend
+    if backend not in kernels.BACKENDS:
+        raise ValueError('Unknown backend: %s.' % backend)
+    if backend == 'numba' and not kernels.HAS_NUMBA:
+        raise ImportError('numba is not installed, use backend=\'numpy\'.')
+    return backend == 'numba'
+
+
+def _get_scale(name, values, units, input_unit, to_unit):
+    """Factor from the unit of an input to the unit of the correlation
+    The unit is taken from units, then from a LogArray, else input_unit (documented unit)"""
+    unit = (units or {}).get(name) or unit_of(values, input_unit)
+    return get_scale(unit, to_unit)
+
 
 def calculate_ucs(mse, method='pump efficiency', pump_efficiency=0.60):
     """"Calculate unconfined compressive strength from MSE
@@ -20,10 +41,14 @@ def calculate_ucs(mse, method='pump efficiency', pump_efficiency=0.60):
     return ucs  #unit: psi
 
 
-def calculate_ccs(ucs, gr, presdiff, gr_cutoff=65):
+def calculate_ccs(ucs, gr, presdiff, gr_cutoff=65, backend=None, units=None, formation=None):
     """Calculate confined compressive strength in psi from UCS based on
     https://www-onepetro-org.ezproxy.lib.uh.edu/download/conference-paper/SPE-27034-MS?id=conference-paper%2FSPE-27034-MS
 
+    backend: 'numpy' or 'numba' (see kernels.py), kernels.BACKEND if None
+    units: dict of input -> unit (see utils.units), e.g. {'presdiff': 'psi'}
+    formation: constants calibrated for this formation (see coefficients.py), default if None
+
     Input units:
         ucs: psi
         diff_pres: differential pressure, kPa
@@ -31,26 +56,38 @@ def calculate_ccs(ucs, gr, presdiff, gr_cutoff=65):
     Output unit:
         ccs: psi
     """
+    ucs_scale = _get_scale('ucs', ucs, units, 'psi', 'psi')
+    pres_scale = _get_scale('presdiff', presdiff, units, 'kPa', 'psi')
+    c = get_coefficients('ccs', formation)
+    if _use_kernels(backend):
+        return kernels.calculate_ccs(ucs, gr, presdiff, gr_cutoff=gr_cutoff,
+                                     ucs_scale=ucs_scale, pres_scale=pres_scale, coefficients=c)
 
     ccs = np.zeros(shape=ucs.shape)
+    if ucs_scale != 1:
+        ucs = ucs * ucs_scale
 
-    # convert differential pressure from kPa to psi to comply with the correlation
-    presdiff = presdiff * 1000 * 14.7 / 101325
+    # convert differential pressure to psi to comply with the correlation
+    presdiff = presdiff * pres_scale
 
     # filter out shale fraction
     shale_mask = gr > gr_cutoff
 
-    ccs[shale_mask] = ucs[shale_mask] * (1 + 0.00432 * presdiff[shale_mask] ** 0.782)
-    ccs[~shale_mask] = ucs[~shale_mask] * (1 + 0.0133 * presdiff[~shale_mask] ** 0.577)
+    ccs[shale_mask] = ucs[shale_mask] * (1 + c['k_shale'] * presdiff[shale_mask] ** c['m_shale'])
+    ccs[~shale_mask] = ucs[~shale_mask] * (1 + c['k_sand'] * presdiff[~shale_mask] ** c['m_sand'])
 
     return ccs      #unit: psi
 
 
-def calculate_youngmodulus(ccs, pc):
+def calculate_youngmodulus(ccs, pc, backend=None, units=None, formation=None):
     """Calculate Youngmodulus E in Gpa from curve fitting based on lab measurements
         as a function of confined pressure
     Source: http://www.rocsoltech.com/wp-content/uploads/2018/08/Rocsol-DWOB-and-D-ROCK-Presentation.pdf
 
+    backend: 'numpy' or 'numba' (see kernels.py), kernels.BACKEND if None
+    units: dict of input -> unit (see utils.units), e.g. {'pc': 'psi'}
+    formation: constants calibrated for this formation (see coefficients.py), default if None
+
     Input units:
         ccs: psi
         pc: kPa
@@ -58,22 +95,30 @@ def calculate_youngmodulus(ccs, pc):
     Output unit:
         E: Gpa
     """
+    ccs_scale = _get_scale('ccs', ccs, units, 'psi', 'MPa')
+    pc_scale = _get_scale('pc', pc, units, 'kPa', 'MPa')
+    c = get_coefficients('youngmodulus', formation)
+    if _use_kernels(backend):
+        return kernels.calculate_youngmodulus(ccs, pc, ccs_scale=ccs_scale, pc_scale=pc_scale,
+                                              coefficients=c)
 
     # convert units so they comply to the curve fitting function
     # ccs: Mpa
     # pc: Mpa
 
-    ccs = ccs * 0.101325 / 14.7
-    pc = pc / 1000
+    ccs = ccs * ccs_scale
+    pc = pc * pc_scale
     #constant from curve fitting based on exponential functional form
-    a, b = 4.5396, 0.1926
+    # fitted to labdata/youngmodulus.xlsx, see calibration.py
+    a, b = c['a'], c['b']
 
     E = ccs * a * pc ** b
 
     return E    #unit: GPa
 
 
-def calculate_porosity(ucs, gr, method=3, gr_cutoff=65):
+def calculate_porosity(ucs, gr, method=3, gr_cutoff=65, backend=None, units=None,
+                       formation=None):
     """"Calculate porosity from ucs based on whether or not the formation is sand or shale
 
     method=1: based on AADE-17-NTCE-134 and http://www.rocsoltech.com/wp-content/uploads/2018/09/Evaluating-Multiple-Methods-to-Determine-Porosity-from-Drilling-Data-AC-SPE-185115-MS-1.pdf
@@ -81,13 +126,24 @@ def calculate_porosity(ucs, gr, method=3, gr_cutoff=65):
     method=3: curve fitting based on method 2 by curve fitting GR as well (so we dont have to worry about GR cutoff
         but I didn't find the unit for GR in this eq. I assume it is field unit which is API
 
+    backend: 'numpy' or 'numba' (see kernels.py), kernels.BACKEND if None
+    units: dict of input -> unit (see utils.units), e.g. {'ucs': 'MPa'}
+    formation: constants calibrated for this formation (see coefficients.py), default if None
+
     Input unit:
         ucs: psi
     Output unit:
         porosity: fraction"""
+    ucs_scale = _get_scale('ucs', ucs, units, 'psi', 'MPa')
+    if method not in (1, 2, 3):
+        raise ValueError('Unknown method.')
+    c = get_coefficients('porosity_%d' % method, formation)
+    if _use_kernels(backend):
+        return kernels.calculate_porosity(ucs, gr, method=method, gr_cutoff=gr_cutoff,
+                                          ucs_scale=ucs_scale, coefficients=c)
 
-    # convert ucs from psi to Mpa
-    ucs = ucs * .101325 / 14.7
+    # convert ucs to Mpa
+    ucs = ucs * ucs_scale
 
     porosity = np.zeros(shape=ucs.shape)
 
@@ -99,9 +155,9 @@ def calculate_porosity(ucs, gr, method=3, gr_cutoff=65):
 
         # constant
         # for shale
-        k1, k2 = 92.529, -0.63
+        k1, k2 = c['k1'], c['k2']
         # for non-shale
-        k3, k4 = 424.8, -0.825
+        k3, k4 = c['k3'], c['k4']
 
     elif method == 2:
         # convert ucs from psi to MPa
@@ -109,14 +165,11 @@ def calculate_porosity(ucs, gr, method=3, gr_cutoff=65):
 
         # constant
         # for shale
-        k1, k2 = 88.331, -0.636
+        k1, k2 = c['k1'], c['k2']
         # for non-shale
-        k3, k4 = 256.25, -0.788
+        k3, k4 = c['k3'], c['k4']
     elif method == 3:
-        return 1.75 / (gr ** 0.25 * ucs ** 0.47)
-
-    else:
-        raise ValueError('Unknown method.')
+        return c['c'] / (gr ** c['gr_exponent'] * ucs ** c['ucs_exponent'])
 
     porosity[shale_mask] = (k1 * ucs[shale_mask] ** k2)
     porosity[~shale_mask] = (k3 * ucs[~shale_mask] ** k4)
@@ -124,19 +177,23 @@ def calculate_porosity(ucs, gr, method=3, gr_cutoff=65):
     return porosity/100
 
 
-def calculate_permeability(porosity, method=1):
+def calculate_permeability(porosity, method=1, formation=None):
     """Calculate permeability from porosity
     This is tied to method 1 from porosity calculation and is more relevant to Eagle Ford shale (AADE-17-NTCE-134)
+    formation: constants calibrated for this formation (see coefficients.py), default if None
     Return
         permeability: nD
     """
     if method == 1:
-        permeability = 6.93 * (porosity * 100) ** 2.5313
+        c = get_coefficients('permeability_1', formation)
+        permeability = c['c'] * (porosity * 100) ** c['m']
+    else:
+        raise ValueError('Unknown method.')
 
     return permeability
 
 
-def calculate_mse(wob, area, rpm, torque, rop):
+def calculate_mse(wob, area, rpm, torque, rop, units=None):
     """"
     Calculate MSE according to https://www.osti.gov/servlets/purl/1060223, Eq. 5 page 10
         at every depth
@@ -147,30 +204,40 @@ def calculate_mse(wob, area, rpm, torque, rop):
         rpm: evolution per minute
         torque: in.lbf
         rop: ft/hr
+    Inputs in other units are given by units, dict of input -> unit (see utils.units),
+    or carry their unit as LogArray, e.g. units={'wob': 'klbf', 'rop': 'm/hr'}
 
     Return:
     - MSE: in psi
     """
 
-    # convert ROP from ft/hr to in/min
-    # convert WOB from kDaN to lbf
+    # convert ROP to in/min
+    # convert WOB to lbf
     # needed for unit consistency
-    rop = rop * 12 / 60
-    wob = wob * 1000 * 2.2480894387096
-    mse = wob / area + 2 * math.pi * rpm * torque / (area * rop)
+    rop = rop * _get_scale('rop', rop, units, 'ft/hr', 'in/min')
+    wob = wob * _get_scale('wob', wob, units, 'kDaN', 'lbf')
+    area = area * _get_scale('area', area, units, 'in^2', 'in^2')
+    # rpm and torque conversions fold into the constant
+    rotary_scale = 2 * math.pi * _get_scale('rpm', rpm, units, 'rev/min', 'rev/min') * \
+        _get_scale('torque', torque, units, 'in.lbf', 'in.lbf')
+    mse = wob / area + rotary_scale * rpm * torque / (area * rop)
 
     return mse
 
 
 if __name__ == '__main__':
 
-    from utils import get_filtered_log_reading_dict, merge_logs
+    from utils import merge_logs, WellStore, EDR_LOGS_NAMES, MWD_LOGS_NAMES
     from rockprops.pressures import *
 
+    # LAS files are only parsed the first time, later runs open the stored arrays
+    store = WellStore()
     las_file_1 = r'../input_template/Middleton Unit B 47-38 No. 8SH__From EDR.las'
-    logs_reading_dict1, logs_values1 = get_filtered_log_reading_dict(las_file_1)
+    logs_reading_dict1 = store.get(las_file_1, logs_names=EDR_LOGS_NAMES)
+    logs_values1 = np.column_stack(list(logs_reading_dict1.values()))
     las_file_2 = r'../input_template/LAS Middleton Unit B 47-38 No. 8SH_From MWD.las'
-    logs_reading_dict2, logs_values2 = get_filtered_log_reading_dict(las_file_2)
+    logs_reading_dict2 = store.get(las_file_2, logs_names=MWD_LOGS_NAMES)
+    logs_values2 = np.column_stack(list(logs_reading_dict2.values()))
     all_logs_reading_dicts = [logs_reading_dict1, logs_reading_dict2]
     all_logs_values = [logs_values1, logs_values2]
 
@@ -186,8 +253,8 @@ if __name__ == '__main__':
 
     # calculate pressure
     mudweight = 8.95 #ppg
-    Phyd = hydsta_pres(mudweight, depth) #KPa
-    Pc = conf_pres(Phyd, mudweight)
+    Phyd = hydsta_pres(mudweight, depth, np.zeros(depth.shape)) #psi, vertical well
+    Pc = conf_pres(Phyd, diff_pres) #kPa
 
     # calculate different rock properties
     mse = calculate_mse(wob, area, rpm, torque, rop)
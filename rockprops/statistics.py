@@ -0,0 +1,218 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+"""
+Statistics of rock properties over depth intervals (stages, formation tops) and rolling depth windows
+Every statistic is computed on the depth-sorted arrays with cumulative sums, reduceat or one sort,
+so the cost does not grow with a Python loop per interval or per sample.
+NaN readings are ignored.
+"""
+
+PERCENTILES = (10, 50, 90)
+
+
+def tops_to_intervals(tops, bottom=np.inf):
+    """Intervals between consecutive formation tops, the last one ends at bottom
+    Return
+    - tops
+    - bottoms
+    """
+    tops = np.asarray(tops, dtype=np.float64)
+    return tops, np.r_[tops[1:], bottom]
+
+
+def _sort_by_depth(depth, values):
+    depth = np.asarray(depth, dtype=np.float64)
+    if np.all(depth[1:] >= depth[:-1]):
+        return depth, values
+    order = np.argsort(depth, kind='stable')
+    return depth[order], OrderedDict((name, value[order]) for name, value in values.items())
+
+
+def _as_values_dict(values):
+    """Single array, dict of arrays or structured array (see pipeline.py) -> dict of arrays"""
+    if isinstance(values, dict):
+        return OrderedDict((name, np.asarray(value, dtype=np.float64))
+                           for name, value in values.items()), False
+    values = np.asarray(values)
+    if values.dtype.names:
+        return OrderedDict((name, values[name].astype(np.float64))
+                           for name in values.dtype.names), False
+    return OrderedDict([(None, values.astype(np.float64))]), True
+
+
+def _interval_reduce(ufunc, values, starts, stops, empty):
+    """ufunc.reduceat over values[start:stop] of each interval, empty value for empty intervals"""
+    if not len(starts):
+        return np.zeros(0)
+    # pad so stop can be the end of values, odd results are the gaps between intervals
+    padded = np.r_[values, empty]
+    indices = np.empty(2 * len(starts), dtype=np.intp)
+    indices[0::2] = starts
+    indices[1::2] = stops
+    result = ufunc.reduceat(padded, indices)[0::2]
+    result[stops <= starts] = empty
+    return result
+
+
+def _interval_percentiles(values, starts, stops, percentiles):
+    """Linear-interpolated percentiles of values[start:stop] of each interval, NaN ignored
+    Members of all intervals are sorted at once, grouped by interval"""
+    counts = np.maximum(stops - starts, 0)
+    n_intervals = len(starts)
+    result = np.full((len(percentiles), n_intervals), np.nan)
+    if not counts.sum():
+        return result
+
+    # index of every member of every interval, intervals may overlap
+    interval_ids = np.repeat(np.arange(n_intervals), counts)
+    group_starts = np.r_[0, np.cumsum(counts)[:-1]]
+    members = np.arange(counts.sum()) - group_starts[interval_ids] + starts[interval_ids]
+    member_values = values[members]
+
+    # sort by interval, then NaN last, then value, in one lexsort (last key sorts first)
+    nan = np.isnan(member_values)
+    sorted_values = member_values[np.lexsort((np.where(nan, np.inf, member_values), nan,
+                                              interval_ids))]
+
+    valid_counts = counts - np.bincount(interval_ids, weights=nan,
+                                        minlength=n_intervals).astype(np.intp)
+    has_values = valid_counts > 0
+    for percentile_idx, percentile in enumerate(percentiles):
+        position = (valid_counts[has_values] - 1) * percentile / 100.
+        lower = np.floor(position).astype(np.intp)
+        upper = np.minimum(lower + 1, valid_counts[has_values] - 1)
+        fraction = position - lower
+        offsets = group_starts[has_values]
+        result[percentile_idx, has_values] = sorted_values[offsets + lower] * (1 - fraction) + \
+            sorted_values[offsets + upper] * fraction
+
+    return result
+
+
+def interval_stats(depth, values, tops, bottoms, percentiles=PERCENTILES, names=None):
+    """Count, mean, min, max and percentiles of values over each depth interval
+    A sample belongs to an interval if top <= depth < bottom
+
+    Input:
+        depth: depth of each sample
+        values: array, dict of name -> array, or structured array of rock properties
+        tops, bottoms: depth limits of each interval (stages, formations)
+        percentiles: percentiles to compute, in [0, 100]
+        names: name of each interval, used as index of the tables
+    Return:
+        DataFrame with one row per interval, or OrderedDict of name -> DataFrame
+        if values holds several properties
+    """
+    values, single = _as_values_dict(values)
+    depth, values = _sort_by_depth(depth, values)
+    tops = np.asarray(tops, dtype=np.float64)
+    bottoms = np.asarray(bottoms, dtype=np.float64)
+
+    starts = np.searchsorted(depth, tops, side='left')
+    stops = np.maximum(np.searchsorted(depth, bottoms, side='left'), starts)
+
+    tables = OrderedDict()
+    for name, value in values.items():
+        nan = np.isnan(value)
+        # sums and counts of valid readings from cumulative sums
+        cum_sum = np.r_[0., np.cumsum(np.where(nan, 0., value))]
+        cum_count = np.r_[0, np.cumsum(~nan)]
+        count = cum_count[stops] - cum_count[starts]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (cum_sum[stops] - cum_sum[starts]) / count
+
+        table = OrderedDict([
+            ('top', tops),
+            ('bottom', bottoms),
+            ('count', count),
+            ('mean', mean),
+            ('min', _interval_reduce(np.fmin, value, starts, stops, np.nan)),
+            ('max', _interval_reduce(np.fmax, value, starts, stops, np.nan)),
+        ])
+        for percentile, result in zip(percentiles, _interval_percentiles(value, starts, stops,
+                                                                         percentiles)):
+            table['p%g' % percentile] = result
+
+        tables[name] = pd.DataFrame(table, index=names)
+
+    return tables[None] if single else tables
+
+
+def rolling_stats(depth, values, window, stats=('mean', 'median'), chunk_size=1 << 16):
+    """Rolling statistics over a depth window centred on each sample
+    Windows that go past the first or last depth give NaN
+
+    Input:
+        depth: depth of each sample
+        values: array, dict of name -> array, or structured array of rock properties
+        window: window length, same unit as depth (ft)
+        stats: 'mean' and/or 'median'
+            mean uses the depth limits of each window (any sampling)
+            median uses the number of samples in window at the median depth step, so it
+            assumes regular sampling, as in LAS files
+        chunk_size: samples per chunk for the median, to bound memory
+    Return:
+        DataFrame with one column per statistic (and per property) and a depth column
+    """
+    for stat in stats:
+        if stat not in ('mean', 'median'):
+            raise ValueError('Unknown statistic: %s.' % stat)
+
+    values, single = _as_values_dict(values)
+    depth, values = _sort_by_depth(depth, values)
+    n_samples = len(depth)
+    half = window / 2.
+
+    # samples whose window fits inside the logged depths
+    full = (depth - half >= depth[0]) & (depth + half <= depth[-1]) if n_samples \
+        else np.zeros(0, dtype=bool)
+    starts = np.searchsorted(depth, depth - half, side='left')
+    stops = np.searchsorted(depth, depth + half, side='right')
+
+    if 'median' in stats and n_samples > 1:
+        step = np.median(np.diff(depth))
+        window_samples = 2 * int(round(half / step)) + 1 if step > 0 else 1
+    else:
+        window_samples = 1
+
+    table = OrderedDict([('depth', depth)])
+    for name, value in values.items():
+        prefix = '' if single else name + ' '
+        if 'mean' in stats:
+            nan = np.isnan(value)
+            cum_sum = np.r_[0., np.cumsum(np.where(nan, 0., value))]
+            cum_count = np.r_[0, np.cumsum(~nan)]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = (cum_sum[stops] - cum_sum[starts]) / (cum_count[stops] - cum_count[starts])
+            mean[~full] = np.nan
+            table[prefix + 'mean'] = mean
+
+        if 'median' in stats:
+            median = np.full(n_samples, np.nan)
+            pad = window_samples // 2
+            if n_samples >= window_samples:
+                # strided view of all windows, medians computed a chunk of windows at a time
+                windows = sliding_window_view(value, window_samples)
+                for start in range(0, len(windows), chunk_size):
+                    chunk = windows[start:start + chunk_size]
+                    median[pad + start:pad + start + len(chunk)] = np.nanmedian(chunk, axis=1) \
+                        if np.isnan(chunk).any() else np.median(chunk, axis=1)
+            median[~full] = np.nan
+            table[prefix + 'median'] = median
+
+    return pd.DataFrame(table)
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+    depth = np.arange(5000., 15000., 0.5)
+    ucs = rng.lognormal(9, 0.3, len(depth))
+
+    # stages of 200 ft
+    tops = np.arange(5000., 15000., 200.)
+    print(interval_stats(depth, ucs, tops, tops + 200).head())
+    print(rolling_stats(depth, ucs, window=50).iloc[45:55])
@@ -0,0 +1,282 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from .coefficients import get_coefficients
+from .pipeline import RockPropsPipeline, PROPERTIES, PSI_TO_MPA
+from .statistics import PERCENTILES
+
+"""
+Monte Carlo uncertainty of the rock properties
+The constants of the correlations (pump efficiency, GR cutoff, fit constants) are drawn
+n_realizations times, and every property is evaluated for all realizations at once as a
+(realizations x depth) array, a chunk of depth at a time so memory stays bounded. Only the
+percentiles over the realizations are kept, e.g. P10/P50/P90 bands along the well.
+The same draws are used for every well, so bands of different wells are comparable.
+"""
+
+# nominal value of the constants that are not in the coefficients file
+NOMINAL_PARAMETERS = OrderedDict([
+    ('pump_efficiency', 0.60),
+    ('gr_cutoff', 65.),
+])
+
+# constant -> (model, constant) in the coefficients file (see coefficients.py)
+PARAMETER_COEFFICIENTS = OrderedDict([
+    # ccs = ucs * (1 + k * presdiff ** m)
+    ('ccs_k_shale', ('ccs', 'k_shale')),
+    ('ccs_m_shale', ('ccs', 'm_shale')),
+    ('ccs_k_sand', ('ccs', 'k_sand')),
+    ('ccs_m_sand', ('ccs', 'm_sand')),
+    # E = a * ccs * pc ** b
+    ('E_a', ('youngmodulus', 'a')),
+    ('E_b', ('youngmodulus', 'b')),
+    # porosity method 3: c / (gr ** 0.25 * ucs ** 0.47), the exponents are not drawn
+    ('porosity_c', ('porosity_3', 'c')),
+    # permeability = c * (100 * porosity) ** m
+    ('permeability_c', ('permeability_1', 'c')),
+    ('permeability_m', ('permeability_1', 'm')),
+])
+
+# constants that are uncertain by default, the others keep their nominal value
+UNCERTAIN_PARAMETERS = ('pump_efficiency', 'gr_cutoff', 'E_a', 'E_b', 'porosity_c',
+                        'porosity_k1', 'porosity_k2', 'porosity_k3', 'porosity_k4')
+
+def get_nominal_parameters(porosity_method=3, formation=None):
+    """Nominal value of every constant, porosity k1..k4 of methods 1 and 2
+    Fit constants are those of formation, default if None (see coefficients.py)"""
+    parameters = OrderedDict(NOMINAL_PARAMETERS)
+    for name, (model, constant) in PARAMETER_COEFFICIENTS.items():
+        parameters[name] = get_coefficients(model, formation)[constant]
+    if porosity_method in (1, 2):
+        # porosity = k1 * ucs ** k2 (shale), k3 * ucs ** k4 (sand)
+        for constant, value in get_coefficients('porosity_%d' % porosity_method, formation).items():
+            parameters['porosity_%s' % constant] = value
+    return parameters
+
+
+def get_default_distributions(porosity_method=3, relative_std=0.05, formation=None):
+    """Distribution of each constant
+    - pump efficiency: triangular 0.50, 0.60, 0.70
+    - GR cutoff: uniform 60 to 70 API
+    - fit constants of E and porosity: normal, relative_std of the nominal value
+    - other constants: fixed
+    """
+    distributions = OrderedDict()
+    for name, value in get_nominal_parameters(porosity_method, formation).items():
+        if name == 'pump_efficiency':
+            distributions[name] = ('triangular', 0.50, value, 0.70)
+        elif name == 'gr_cutoff':
+            distributions[name] = ('uniform', value - 5, value + 5)
+        elif name in UNCERTAIN_PARAMETERS:
+            distributions[name] = ('normal', value, abs(value) * relative_std)
+        else:
+            distributions[name] = ('fixed', value)
+    return distributions
+
+
+def draw_parameters(n_realizations, distributions, seed=None):
+    """Draw every constant n_realizations times
+    Input:
+        distributions: dict of name -> ('fixed', value), ('normal', mean, std),
+            ('lognormal', median, sigma), ('uniform', low, high),
+            ('triangular', low, mode, high), or a number for a fixed value
+    Return:
+        OrderedDict of name -> array of n_realizations values
+    """
+    rng = np.random.RandomState(seed)
+    parameters = OrderedDict()
+    for name, distribution in distributions.items():
+        if np.isscalar(distribution):
+            distribution = ('fixed', distribution)
+        kind, args = distribution[0], distribution[1:]
+        if kind == 'fixed':
+            values = np.full(n_realizations, float(args[0]))
+        elif kind == 'normal':
+            values = rng.normal(args[0], args[1], n_realizations)
+        elif kind == 'lognormal':
+            values = args[0] * np.exp(rng.normal(0, args[1], n_realizations))
+        elif kind == 'uniform':
+            values = rng.uniform(args[0], args[1], n_realizations)
+        elif kind == 'triangular':
+            values = rng.triangular(args[0], args[1], args[2], n_realizations)
+        else:
+            raise ValueError('Unknown distribution: %s.' % kind)
+        parameters[name] = values
+    return parameters
+
+
+def _get_percentiles(values, percentiles):
+    """Percentiles over the realizations (rows) of values
+    values: (realizations x depth) array, overwritten, or (realizations, depth) terms
+        whose product is the property: percentiles of the realization term are enough"""
+    if isinstance(values, tuple):
+        realization_term, depth_term = values
+        percentiles = np.asarray(percentiles, dtype=np.float64)
+        lower = np.percentile(realization_term, percentiles)[:, np.newaxis]
+        # a negative depth term reverses the order of the realizations
+        upper = np.percentile(realization_term, 100 - percentiles)[:, np.newaxis]
+        return np.where(depth_term >= 0, lower * depth_term, upper * depth_term)
+    return np.percentile(values, percentiles, axis=0, overwrite_input=True)
+
+
+class MonteCarloRockProps():
+    """Percentile bands of rock properties over random draws of the correlation constants
+
+    mc = MonteCarloRockProps(area=6, n_realizations=2000, seed=0)
+    bands = mc.run(logs_dict)
+    bands['ucs p10'], bands['ucs p50'], bands['ucs p90']
+
+    Logs, their names and units are as for RockPropsPipeline.
+    """
+
+    def __init__(self, area, properties=PROPERTIES, n_realizations=1000, distributions=None,
+                 percentiles=PERCENTILES, porosity_method=3, permeability_method=1,
+                 logs_names=None, units=None, seed=None, chunk_elements=1 << 21, formation=None):
+        """
+        Input:
+            distributions: dict of constant -> distribution (see draw_parameters), merged
+                into get_default_distributions
+            chunk_elements: realizations x depth samples evaluated at once
+            formation: nominal constants calibrated for this formation (see coefficients.py)
+        """
+        self.pipeline = RockPropsPipeline(area, properties, porosity_method=porosity_method,
+                                          permeability_method=permeability_method,
+                                          logs_names=logs_names, units=units, formation=formation)
+        self.properties = self.pipeline.properties
+        self.required = self.pipeline.required
+        self.porosity_method = porosity_method
+        self.n_realizations = n_realizations
+        self.percentiles = tuple(percentiles)
+        self.chunk_size = max(1, chunk_elements // n_realizations)
+
+        self.distributions = get_default_distributions(porosity_method, formation=formation)
+        for name, distribution in (distributions or {}).items():
+            if name not in self.distributions:
+                raise ValueError('Unknown constant: %s.' % name)
+            self.distributions[name] = distribution
+        # realizations are the rows of (realizations x depth) arrays
+        self.parameters = OrderedDict(
+            (name, values[:, np.newaxis])
+            for name, values in draw_parameters(n_realizations, self.distributions, seed).items())
+
+        self.dtype = np.dtype([('%s p%g' % (prop, percentile), np.float64)
+                               for prop in self.properties for percentile in self.percentiles])
+
+    def run(self, logs, columns=None, out=None):
+        """Percentiles of every property over the realizations
+        Input:
+            logs, columns: see RockPropsPipeline.run
+            out: structured array to write into, allocated if None
+        Return:
+            structured array with one field per property and percentile, e.g. 'ucs p90'
+        """
+        logs = self.pipeline._get_logs(logs, columns)
+        n_samples = len(next(iter(logs.values()))) if logs else 0
+        if out is None:
+            out = np.empty(n_samples, dtype=self.dtype)
+
+        for start in range(0, n_samples, self.chunk_size):
+            stop = min(start + self.chunk_size, n_samples)
+            chunk_logs = {log: values[start:stop] for log, values in logs.items()}
+            with np.errstate(divide='ignore', invalid='ignore'):
+                props = self._run_chunk(chunk_logs)
+            for prop in self.properties:
+                bands = _get_percentiles(props[prop], self.percentiles)
+                for percentile, band in zip(self.percentiles, bands):
+                    out['%s p%g' % (prop, percentile)][start:stop] = band
+
+        return out
+
+    def run_wells(self, wells):
+        """Bands of several wells with the same draws
+        Input:
+            wells: dict of well name -> logs
+        Return:
+            OrderedDict of well name -> structured array (see run)
+        """
+        return OrderedDict((well_name, self.run(logs)) for well_name, logs in wells.items())
+
+    def _run_chunk(self, logs):
+        """Every required property of one chunk, as a (realizations x depth) array or
+        as a (realizations, depth) pair of terms whose product is the property"""
+        params, scales = self.parameters, self.pipeline.scales
+        size = len(next(iter(logs.values())))
+        props = {}
+
+        # MSE has no uncertain constant, it is computed once for all realizations
+        mse = np.empty(size)
+        self.pipeline._run_chunk(logs, {'mse': mse}, np.empty(size), np.empty(size, dtype=bool))
+        props['mse'] = (np.ones(1), mse)
+        props['ucs'] = (params['pump_efficiency'][:, 0], mse)
+        if 'ccs' in self.required or self.porosity_method != 3:
+            ucs = params['pump_efficiency'] * mse
+        if 'gr' in logs:
+            shale = logs['gr'] > params['gr_cutoff']
+
+        if 'ccs' in self.required:
+            # k * p ** m as k * exp(m log p), log p is shared by all realizations
+            log_pres = np.log(logs['diff_pres'] * scales['diff_pres'])
+            factor = np.where(shale, params['ccs_m_shale'], params['ccs_m_sand'])
+            factor *= log_pres
+            np.exp(factor, out=factor)
+            factor *= np.where(shale, params['ccs_k_shale'], params['ccs_k_sand'])
+            factor += 1
+            factor *= ucs
+            props['ccs'] = factor
+
+        if 'E' in self.required:
+            E = np.exp(params['E_b'] * np.log(logs['pc'] * scales['pc']))
+            E *= params['E_a'] * PSI_TO_MPA
+            E *= props['ccs']
+            props['E'] = E
+
+        if 'porosity' in self.required:
+            if self.porosity_method == 3:
+                # ucs = pump efficiency * mse, so the correlation splits into a term of the
+                # realizations times a term of the depth
+                gr_exponent, ucs_exponent = (self.pipeline.coefficients['porosity'][constant]
+                                             for constant in ('gr_exponent', 'ucs_exponent'))
+                realization_term = params['porosity_c'] / params['pump_efficiency'] ** ucs_exponent
+                depth_term = logs['gr'] ** gr_exponent * (mse * PSI_TO_MPA) ** ucs_exponent
+                np.divide(1, depth_term, out=depth_term)
+                props['porosity'] = (realization_term[:, 0], depth_term)
+                if 'permeability' in self.required:
+                    porosity = realization_term * depth_term
+            else:
+                log_ucs = np.log(ucs * (PSI_TO_MPA * 101.325 / 14.7))
+                porosity = np.where(shale, params['porosity_k2'], params['porosity_k4'])
+                porosity *= log_ucs
+                np.exp(porosity, out=porosity)
+                porosity *= np.where(shale, params['porosity_k1'] / 100, params['porosity_k3'] / 100)
+                props['porosity'] = porosity
+
+        if 'permeability' in self.required:
+            permeability = np.log(porosity * 100)
+            permeability *= params['permeability_m']
+            np.exp(permeability, out=permeability)
+            permeability *= params['permeability_c']
+            props['permeability'] = permeability
+
+        return props
+
+
+if __name__ == '__main__':
+    import time
+
+    rng = np.random.RandomState(0)
+    n_samples = 20000
+    logs_dict = OrderedDict([
+        ('WOB', rng.uniform(5, 25, n_samples)),
+        ('RPM', rng.uniform(40, 120, n_samples)),
+        ('TOR', rng.uniform(2, 20, n_samples)),
+        ('ROP', rng.uniform(50, 400, n_samples)),
+        ('GR', rng.uniform(20, 150, n_samples)),
+        ('DIFP', rng.uniform(500, 5000, n_samples)),
+        ('PC', rng.uniform(5000, 40000, n_samples)),
+    ])
+
+    start = time.perf_counter()
+    bands = MonteCarloRockProps(area=6, n_realizations=2000, seed=0).run(logs_dict)
+    print('%.2f s' % (time.perf_counter() - start))
+    print(bands[['ucs p10', 'ucs p50', 'ucs p90']][:5])
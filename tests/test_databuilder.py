@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from machine_learning.databuilder import DataBuilder, SPLITS
+from utils.logstore import WellStore
+
+"""
+Splits of DataBuilder
+"""
+
+
+def write_wells(cleaned_dir, sizes):
+    rng = np.random.RandomState(0)
+    for well_idx, size in enumerate(sizes):
+        pd.DataFrame({'Hole Depth,ft': np.arange(1., size + 1),
+                      'Rate Of Penetration,ft/hr': rng.uniform(1, 100, size),
+                      'Gamma,API': rng.uniform(10, 200, size)}
+                     ).to_csv(cleaned_dir / ('well_%d.csv' % well_idx), index=False)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('sizes', [[153, 14804, 4809], [20, 5000, 300, 40, 1200, 80]])
+def test_split_by_well_fractions(tmp_path, sizes, seed):
+    cleaned_dir = tmp_path / 'cleaned'
+    cleaned_dir.mkdir()
+    write_wells(cleaned_dir, sizes)
+    builder = DataBuilder(['Rate Of Penetration'], ['Gamma'], cleaned_dir=str(cleaned_dir),
+                          store=WellStore(str(tmp_path / 'store')))
+
+    splits = builder.split_by_well((0.7, 0.1, 0.2), seed=seed)
+    samples = {split: sum(segment.stop - segment.start for segment in splits[split])
+               for split in SPLITS}
+    assert sum(samples.values()) == sum(sizes)
+    assert all(splits[split] for split in SPLITS)
+    assert samples['train'] == max(samples.values())
+    assert samples['train'] >= max(sizes)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('numba')
+
+from rockprops.rockprops import calculate_ccs, calculate_youngmodulus, calculate_porosity
+
+"""
+Parity of the numba kernels (kernels.py) with the NumPy reference of rockprops.py
+"""
+
+RTOL = 1e-12
+
+
+@pytest.fixture(scope='module')
+def logs():
+    rng = np.random.RandomState(0)
+    n_samples = 10000
+    return {
+        'ucs': rng.uniform(1000, 40000, n_samples),
+        # GR values right at the cutoff check the shale/sand branch
+        'gr': np.r_[rng.uniform(10, 200, n_samples - 2), 65, 65.000001],
+        'presdiff': rng.uniform(100, 8000, n_samples),
+        'pc': rng.uniform(1000, 50000, n_samples),
+    }
+
+
+def assert_parity(func, **kwargs):
+    reference, compiled = func(backend='numpy', **kwargs), func(backend='numba', **kwargs)
+    np.testing.assert_allclose(compiled, reference, rtol=RTOL, atol=0)
+
+
+@pytest.mark.parametrize('gr_cutoff', [65, 60])
+@pytest.mark.parametrize('units', [None, {'ucs': 'MPa', 'presdiff': 'psi'}])
+def test_ccs(logs, gr_cutoff, units):
+    assert_parity(calculate_ccs, ucs=logs['ucs'], gr=logs['gr'], presdiff=logs['presdiff'],
+                  gr_cutoff=gr_cutoff, units=units)
+
+
+@pytest.mark.parametrize('units', [None, {'ccs': 'MPa', 'pc': 'psi'}])
+def test_youngmodulus(logs, units):
+    assert_parity(calculate_youngmodulus, ccs=logs['ucs'], pc=logs['pc'], units=units)
+
+
+@pytest.mark.parametrize('method', [1, 2, 3])
+@pytest.mark.parametrize('units', [None, {'ucs': 'MPa'}])
+def test_porosity(logs, method, units):
+    assert_parity(calculate_porosity, ucs=logs['ucs'], gr=logs['gr'], method=method, units=units)
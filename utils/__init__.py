@@ -1,2 +1,4 @@
 from .logscleanup import *
+from .logstore import WellStore, get_well_name, read_well_file
 from .readfile import read
+from .units import LogArray, convert, get_conversion
@@ -0,0 +1,205 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.feather
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+"""
+Binary columnar files (Parquet, Feather/Arrow IPC) for cleaned wells and rock properties
+Logs are stored as float64 columns named by log name, with their unit in the column
+metadata. Readers load only the columns they ask for, and Parquet files are written in
+row groups with min/max statistics, so a depth range only reads the row groups it overlaps.
+pyarrow is optional: it is only needed to read or write these files.
+"""
+
+HAS_PYARROW = pyarrow is not None
+
+COLUMNAR_FORMATS = ('parquet', 'feather')
+COLUMNAR_EXTS = {'parquet': '.parquet', 'feather': '.feather'}
+
+# key of the unit in the metadata of each column
+UNIT_KEY = b'unit'
+
+
+def _require_pyarrow():
+    if not HAS_PYARROW:
+        raise ImportError('pyarrow is required to read and write Parquet and Feather files.')
+
+
+def get_file_format(file_loc):
+    """'parquet' or 'feather' from the file extension"""
+    file_ext = os.path.splitext(file_loc)[1].lower()
+    for file_format, format_ext in COLUMNAR_EXTS.items():
+        if file_ext == format_ext:
+            return file_format
+    raise ValueError('Unknown columnar file extension: %s.' % file_ext)
+
+
+def _split_unit(column):
+    """Cleaned files name their columns as 'log name,unit'"""
+    log_name, _, unit = str(column).partition(',')
+    return log_name, unit
+
+
+def to_table(data, units=None):
+    """Arrow table of logs
+    Input:
+        data: DataFrame (numeric columns only), dict of log name -> values,
+            or structured array (RockPropsPipeline)
+        units: dict of log name -> unit, columns named 'log name,unit' give their own unit
+    """
+    _require_pyarrow()
+    units = units or {}
+    if isinstance(data, np.ndarray) and data.dtype.names:
+        data = OrderedDict((name, data[name]) for name in data.dtype.names)
+    elif isinstance(data, pd.DataFrame):
+        # index written by DataFrame.to_csv is not a log
+        data = data._get_numeric_data()
+        data = OrderedDict((column, data[column].values) for column in data.columns
+                           if not str(column).startswith('Unnamed:'))
+
+    fields, arrays = [], []
+    for column, values in data.items():
+        log_name, unit = _split_unit(column)
+        unit = units.get(column, units.get(log_name, unit))
+        fields.append(pyarrow.field(log_name, pyarrow.float64(),
+                                    metadata={UNIT_KEY: unit.encode()}))
+        arrays.append(pyarrow.array(np.asarray(values, dtype=np.float64)))
+    return pyarrow.Table.from_arrays(arrays, schema=pyarrow.schema(fields))
+
+
+class ColumnarWriter():
+    """Write a Parquet or Feather file chunk by chunk
+
+    with ColumnarWriter('well.parquet') as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    """
+
+    def __init__(self, file_loc, units=None, file_format=None, compression='zstd',
+                 compression_level=None, row_group_size=1 << 16):
+        _require_pyarrow()
+        self.file_loc = file_loc
+        self.units = units
+        self.file_format = file_format or get_file_format(file_loc)
+        if self.file_format not in COLUMNAR_FORMATS:
+            raise ValueError('Unknown columnar format: %s.' % self.file_format)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.row_group_size = row_group_size
+        self.writer = None
+
+    def _open(self, schema):
+        if self.file_format == 'parquet':
+            return pyarrow.parquet.ParquetWriter(self.file_loc, schema,
+                                                 compression=self.compression or 'none',
+                                                 compression_level=self.compression_level)
+        compression = None if self.compression in (None, 'none', 'uncompressed') else \
+            pyarrow.Codec(self.compression, self.compression_level)
+        # Feather v2 is the Arrow IPC file format
+        return pyarrow.ipc.new_file(self.file_loc, schema,
+                                    options=pyarrow.ipc.IpcWriteOptions(compression=compression))
+
+    def write(self, data):
+        table = to_table(data, self.units)
+        if self.writer is None:
+            self.schema = table.schema
+            self.writer = self._open(self.schema)
+        elif table.schema.names != self.schema.names:
+            raise ValueError('Columns changed from %s to %s.'
+                             % (self.schema.names, table.schema.names))
+        if self.file_format == 'parquet':
+            self.writer.write_table(table, row_group_size=self.row_group_size)
+        else:
+            self.writer.write_table(table, max_chunksize=self.row_group_size)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_columnar(file_loc, data, units=None, file_format=None, compression='zstd',
+                   compression_level=None, row_group_size=1 << 16):
+    """Write logs to a Parquet or Feather file, format from the extension if None
+    Input:
+        data, units: see to_table
+        compression: 'zstd', 'lz4', 'snappy' (Parquet only), 'gzip' (Parquet only) or None
+    """
+    with ColumnarWriter(file_loc, units, file_format, compression, compression_level,
+                        row_group_size) as writer:
+        writer.write(data)
+
+
+def read_schema(file_loc):
+    _require_pyarrow()
+    if get_file_format(file_loc) == 'parquet':
+        return pyarrow.parquet.read_schema(file_loc)
+    with pyarrow.memory_map(file_loc) as source:
+        return pyarrow.ipc.open_file(source).schema
+
+
+def read_units(file_loc):
+    """OrderedDict of log name -> unit of a columnar file"""
+    return OrderedDict((field.name, (field.metadata or {}).get(UNIT_KEY, b'').decode())
+                       for field in read_schema(file_loc))
+
+
+def read_columnar(file_loc, columns=None, depth_range=None, depth_column=None):
+    """Read logs of a Parquet or Feather file into a DataFrame
+    Input:
+        columns: logs to read, as log names or 'log name,unit', all if None
+        depth_range: (top, bottom) to only keep top <= depth <= bottom
+        depth_column: log holding the depth, first column if None
+    """
+    schema = read_schema(file_loc)
+    if columns is not None:
+        columns = [_split_unit(column)[0] for column in columns]
+    depth_column = depth_column or schema.names[0]
+
+    if get_file_format(file_loc) == 'parquet':
+        filters = None
+        if depth_range is not None:
+            # row groups whose depth statistics are out of range are skipped
+            filters = [(depth_column, '>=', depth_range[0]), (depth_column, '<=', depth_range[1])]
+        table = pyarrow.parquet.read_table(file_loc, columns=columns, filters=filters)
+    else:
+        read_columns = columns
+        if depth_range is not None and columns is not None and depth_column not in columns:
+            read_columns = columns + [depth_column]
+        # memory-mapped, only the columns read are decompressed
+        table = pyarrow.feather.read_table(file_loc, columns=read_columns, memory_map=True)
+        if depth_range is not None:
+            depth = table.column(depth_column)
+            table = table.filter(pyarrow.compute.and_(
+                pyarrow.compute.greater_equal(depth, depth_range[0]),
+                pyarrow.compute.less_equal(depth, depth_range[1])))
+        if columns is not None:
+            table = table.select(columns)
+
+    return table.to_pandas()
+
+
+if __name__ == '__main__':
+    from input.configuration import INPUT_DIR
+
+    df = pd.read_csv(os.path.join(INPUT_DIR, 'cleaned_up', '25509696.csv'))
+    write_columnar('25509696.parquet', df)
+    print(read_units('25509696.parquet'))
+    print(read_columnar('25509696.parquet', ['Hole Depth', 'Gamma'], depth_range=(5000, 5010)))
+    os.remove('25509696.parquet')
@@ -1,60 +1,68 @@
+import logging
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 # from configuration import ROOT_DIR
 from input.LOG_UNITS import LOG_NAMES_UNITS_DICT
 from input.configuration import INPUT_DIR
+from .columnar import COLUMNAR_EXTS, ColumnarWriter, write_columnar
 
 """
 Clean up negative values and NaN entries for csv or excel files in input/raw directory
+Cleaned files are saved in the format of the raw file, or as Parquet/Feather (see columnar.py)
 """
 
 RAW_INPUT_DIR = os.sep.join((INPUT_DIR, 'raw'))
 OUTPUT_DIR = os.sep.join((INPUT_DIR, 'cleaned_up'))
 OUTPUT_EXT = ''
 
+logger = logging.getLogger(__name__)
 
-def clean_up_df(orig_df, strict_remove=True, APIcheck=True):
-    """
-    Return cleaned df using numeric values only
-    - Columns not defined in LOG_NAMES_UNITS_DICT are removed
-    - Columns contain string entries are removed
 
+def get_logs_mapping(orig_logs, strict_remove=True, APIcheck=True):
+    """Decide which columns are kept and how they are renamed
+    - Columns not defined in LOG_NAMES_UNITS_DICT are removed with strict_remove=True
+    - Columns defined in LOG_NAMES_UNITS_DICT are renamed as 'log name,unit'
+    Return
+    - list of columns to remove
+    - dict of columns to rename
     """
-
-    orig_logs = set(orig_df.columns)
+    orig_logs = set(orig_logs)
     API_logs = set(LOG_NAMES_UNITS_DICT)
     defined_logs = orig_logs & API_logs
 
     if len(defined_logs) == len(API_logs):
-        print('Your inputs follow API for this project.')
+        logger.info('Your inputs follow API for this project.')
 
     check_logs = defined_logs if strict_remove else orig_logs
 
+    removed_logs = []
     new_logs = dict()
     for new_log in set.union(check_logs, orig_logs):
-        # print('doing stuff with ', new_log)
         if new_log in API_logs:     # if in API
-            # print('%s is in API' % new_log)
             new_logs[new_log] = new_log + ',' + LOG_NAMES_UNITS_DICT[new_log]
         else:                       # if not in API
             if APIcheck:
-                print('WARNING: %s not in API. ' % new_log)
+                logger.warning('%s not in API.', new_log)
             if strict_remove:
-                print('It will be removed with strict_remove=True. To keep this column,'
-                      'set strict_remove=False.')
+                logger.warning('%s will be removed with strict_remove=True. To keep this column, '
+                               'set strict_remove=False.', new_log)
                 # remove log not defined by API
-                orig_df = orig_df.drop(columns=new_log)
-                # print('after remove', orig_df.columns)
+                removed_logs.append(new_log)
             else:
                 # keep the original log
                 new_logs[new_log] = new_log
 
-    # rename under new_logs
-    orig_df = orig_df.rename(columns=new_logs)
+    return removed_logs, new_logs
 
 
+def filter_rows(df):
+    """Keep rows without NaN entries whose numeric entries are all positive"""
     # strip-off NaN entries
-    new_df = orig_df.dropna()
+    new_df = df.dropna()
 
     # only use numeric entries
     numeric_df = new_df._get_numeric_data().values
@@ -63,58 +71,221 @@ def clean_up_df(orig_df, strict_remove=True, APIcheck=True):
     # only rows that satisfy True in all columns are selected
     rows_location = masked_rows.all(axis=1)
 
-    # cleaned df based on rows_location
-    df_cleaned = orig_df[rows_location]
+    return new_df[rows_location]
 
-    if len(df_cleaned) == 0:
-        print('WARNING: all entries are neglected. Check this file.'
-              'It is potentially that there are no row that contains all entries.')
 
-    return df_cleaned
+def logs_as_float(df, new_logs):
+    """Numeric logs as float64, so a log reads the same whether a file (or a chunk of it)
+    only holds integer-looking entries or not, e.g. 10.0 and not 10 in a csv"""
+    for log in new_logs.values():
+        if log in df.columns and pd.api.types.is_numeric_dtype(df[log]) \
+                and df[log].dtype != np.float64:
+            df[log] = df[log].astype(np.float64)
+    return df
 
 
-def clean_up(savefile=True, strict_remove=True, isfollowingAPI=True):
+def clean_up_df(orig_df, strict_remove=True, APIcheck=True):
+    """
+    Return cleaned df using numeric values only
+    - Columns not defined in LOG_NAMES_UNITS_DICT are removed
+    - Columns contain string entries are removed
 
-    # grab all well names in raw dir
-    for file_name in os.listdir(RAW_INPUT_DIR):
+    """
+    removed_logs, new_logs = get_logs_mapping(orig_df.columns, strict_remove, APIcheck)
+
+    # remove logs not defined by API and rename under new_logs
+    orig_df = logs_as_float(orig_df.drop(columns=removed_logs).rename(columns=new_logs), new_logs)
+
+    # cleaned df based on NaN and positive values
+    df_cleaned = filter_rows(orig_df)
+
+    if len(df_cleaned) == 0:
+        logger.warning('All entries are neglected. Check this file. '
+                       'It is potentially that there are no row that contains all entries.')
+
+    return df_cleaned
 
-        # grab well name and file extension
-        well_name, file_ext = os.path.splitext(file_name)
-        file_ext = file_ext[1:] # ignore . before extension
 
+def clean_up_csv_chunked(file_loc, cleaned_file_loc, strict_remove=True, APIcheck=True,
+                         chunksize=100000, output_format=None, compression='zstd'):
+    """Clean up a csv file chunk by chunk and append each chunk to cleaned_file_loc
+    Peak memory is bounded by chunksize, whatever the size of the file. The output
+    matches clean_up_df followed by to_csv, as long as each column holds the same
+    type of entries over the whole file.
+    Input:
+        output_format: 'parquet' or 'feather' to write a columnar file, csv if None
+        compression: compression of columnar files
+    Return
+    - number of rows in
+    - number of rows out
+    """
+    # columns are decided once from the header
+    orig_logs = pd.read_csv(file_loc, nrows=0).columns
+    removed_logs, new_logs = get_logs_mapping(orig_logs, strict_remove, APIcheck)
+
+    rows_in, rows_out = 0, 0
+    writer = ColumnarWriter(cleaned_file_loc, file_format=output_format, compression=compression) \
+        if output_format in COLUMNAR_EXTS else None
+    try:
+        # index keeps counting across chunks, as for a file read at once
+        for chunk_idx, chunk in enumerate(pd.read_csv(file_loc, chunksize=chunksize)):
+            # dtypes are inferred per chunk, a chunk of integer-looking entries must still
+            # be written as floats
+            chunk = logs_as_float(chunk.drop(columns=removed_logs).rename(columns=new_logs),
+                                  new_logs)
+            chunk_cleaned = filter_rows(chunk)
+            if writer is not None:
+                writer.write(chunk_cleaned)
+            else:
+                chunk_cleaned.to_csv(cleaned_file_loc, mode='w' if chunk_idx == 0 else 'a',
+                                     header=chunk_idx == 0)
+            rows_in += len(chunk)
+            rows_out += len(chunk_cleaned)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if rows_out == 0:
+        logger.warning('All entries are neglected. Check this file. '
+                       'It is potentially that there are no row that contains all entries.')
+
+    return rows_in, rows_out
+
+
+def get_cleaned_file_name(file_name, output_format=None):
+    """Name of the cleaned file saved into OUTPUT_DIR
+    output_format: 'parquet' or 'feather', extension of the raw file if None"""
+    well_name, file_ext = os.path.splitext(file_name)
+    if output_format is not None:
+        if output_format not in COLUMNAR_EXTS:
+            raise ValueError('Unknown output format: %s.' % output_format)
+        file_ext = COLUMNAR_EXTS[output_format]
+    return well_name + OUTPUT_EXT + file_ext
+
+
+def clean_up_file(file_name, savefile=True, strict_remove=True, chunksize=None,
+                  raw_dir=RAW_INPUT_DIR, output_dir=OUTPUT_DIR, output_format=None,
+                  compression='zstd'):
+    """Clean up one file of raw_dir and save it into output_dir
+    Input:
+        chunksize: csv files are cleaned chunk by chunk of chunksize rows if given
+        output_format: 'parquet' or 'feather' to save a columnar file (numeric columns),
+            same format as the raw file if None
+        compression: compression of columnar files, see columnar.write_columnar
+    Return summary of the file: rows in, rows out and time spent"""
+    start = time.time()
+
+    # grab file extension
+    file_ext = os.path.splitext(file_name)[1][1:]  # ignore . before extension
+    file_loc = os.path.join(raw_dir, file_name)
+    cleaned_file_loc = os.path.join(output_dir, get_cleaned_file_name(file_name, output_format))
+
+    logger.info('Cleaning %s.', file_name)
+    if file_ext == 'csv' and chunksize and savefile:
+        rows_in, rows_out = clean_up_csv_chunked(file_loc, cleaned_file_loc,
+                                                 strict_remove=strict_remove, chunksize=chunksize,
+                                                 output_format=output_format,
+                                                 compression=compression)
+    else:
         # reader based on extension
         if file_ext == 'csv':
             file_reader = pd.read_csv
         elif file_ext == 'xlsx':
             file_reader = pd.read_excel
-        else: # if not either one of them, they are not data files
-            continue
+        else:
+            raise ValueError('Unknown file extension: %s.' % file_ext)
 
-        print('Cleaning %s.' % file_name)
-        df = file_reader(os.path.join(RAW_INPUT_DIR, file_name))
+        df = file_reader(file_loc)
 
         # clean up file
         df_cleaned = clean_up_df(df, strict_remove=strict_remove)
-        print('Finished cleaning up.')
+        rows_in, rows_out = len(df), len(df_cleaned)
 
         if savefile:
-            # save the cleaned file
-            cleaned_file_name = '.'.join((well_name+OUTPUT_EXT, file_ext))
-            # save file into OUTPUT_DIR
-            if file_ext == 'csv':
-                df_cleaned.to_csv(os.path.join(OUTPUT_DIR, cleaned_file_name))
+            # save file into output_dir
+            if output_format is not None:
+                write_columnar(cleaned_file_loc, df_cleaned, file_format=output_format,
+                               compression=compression)
+            elif file_ext == 'csv':
+                df_cleaned.to_csv(cleaned_file_loc)
             elif file_ext == 'xlsx':
-                df_cleaned.to_excel(os.path.join(OUTPUT_DIR, cleaned_file_name))
-
-            print('Finish saving.')
-
-        print(df_cleaned.head())
-
-        print('#'*100)
+                df_cleaned.to_excel(cleaned_file_loc)
+
+    seconds = time.time() - start
+    logger.info('Finished %s: %d rows in, %d rows out, %.2f s.',
+                file_name, rows_in, rows_out, seconds)
+
+    return {'file': file_name, 'status': 'cleaned', 'rows_in': rows_in,
+            'rows_out': rows_out, 'seconds': seconds}
+
+
+def is_up_to_date(file_name, raw_dir=RAW_INPUT_DIR, output_dir=OUTPUT_DIR, output_format=None):
+    """True if the cleaned file exists and is newer than the raw file"""
+    cleaned_file_loc = os.path.join(output_dir, get_cleaned_file_name(file_name, output_format))
+    return os.path.isfile(cleaned_file_loc) and \
+        os.path.getmtime(cleaned_file_loc) >= os.path.getmtime(os.path.join(raw_dir, file_name))
+
+
+def clean_up(savefile=True, strict_remove=True, isfollowingAPI=True, workers=1,
+             skip_up_to_date=False, chunksize=None, raw_dir=RAW_INPUT_DIR, output_dir=OUTPUT_DIR,
+             output_format=None, compression='zstd'):
+    """Clean up all csv and xlsx files in raw_dir
+    Input:
+        workers: number of processes cleaning files at the same time,
+            all CPUs if None
+        skip_up_to_date: skip files whose cleaned file is newer than the raw file
+        chunksize: stream csv files in chunks of chunksize rows to bound memory
+        output_format, compression: see clean_up_file
+    Return:
+        summary DataFrame with rows in/out and time spent per file
+    """
+    # grab all data files in raw dir, if not csv or xlsx they are not data files
+    file_names = sorted(file_name for file_name in os.listdir(raw_dir)
+                        if os.path.splitext(file_name)[1] in ('.csv', '.xlsx'))
+
+    summary = []
+    if skip_up_to_date and savefile:
+        for file_name in file_names:
+            if is_up_to_date(file_name, raw_dir, output_dir, output_format):
+                logger.info('Skipping %s, cleaned file is up to date.', file_name)
+                summary.append({'file': file_name, 'status': 'skipped', 'rows_in': None,
+                                'rows_out': None, 'seconds': 0.})
+        skipped = set(file_summary['file'] for file_summary in summary)
+        file_names = [file_name for file_name in file_names if file_name not in skipped]
+
+    kwargs = dict(savefile=savefile, strict_remove=strict_remove, chunksize=chunksize,
+                  raw_dir=raw_dir, output_dir=output_dir, output_format=output_format,
+                  compression=compression)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        if executor is None:
+            results = ((file_name, lambda file_name=file_name: clean_up_file(file_name, **kwargs))
+                       for file_name in file_names)
+        else:
+            results = [(file_name, executor.submit(clean_up_file, file_name, **kwargs).result)
+                       for file_name in file_names]
+
+        # a file that fails is reported in the summary instead of stopping the batch
+        for file_name, result in results:
+            try:
+                summary.append(result())
+            except Exception:
+                logger.exception('Failed to clean up %s.', file_name)
+                summary.append({'file': file_name, 'status': 'failed', 'rows_in': None,
+                                'rows_out': None, 'seconds': None})
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    summary = pd.DataFrame(summary, columns=['file', 'status', 'rows_in', 'rows_out', 'seconds'])
+    logger.info('Clean up summary:\n%s', summary.to_string(index=False))
+
+    return summary
 
 
 if __name__ == '__main__':
-    clean_up(savefile=True, strict_remove=True)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(message)s')
+    clean_up(savefile=True, strict_remove=True, workers=None, skip_up_to_date=True)
 
     # import pandas as pd
     # import numpy as np
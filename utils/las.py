@@ -0,0 +1,292 @@
+import json
+import os
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from input.LOG_UNITS import LOG_NAMES_UNITS_DICT, LOG_MNEMONICS_DICT
+
+"""
+Utilities to read and write LAS files
+- header sections (~V, ~W, ~C, ~P) are parsed into a curve catalog
+- the numeric section (~A) is parsed in one bulk pass
+"""
+
+# NULL value assumed when the LAS header does not define one
+LAS_NULL_VALUE = -999.25
+
+# catalog is saved next to the LAS file with this extension
+CATALOG_EXT = '.catalog.json'
+# bump when the catalog layout changes so old caches are ignored
+CATALOG_VERSION = 1
+
+# one header line: MNEM.UNIT   DATA : DESCRIPTION
+HeaderItem = namedtuple('HeaderItem', ['mnemonic', 'unit', 'value', 'description'])
+# one curve of the ~A section
+CurveInfo = namedtuple('CurveInfo', ['mnemonic', 'unit', 'col_idx', 'description'])
+# everything needed to read the ~A section without scanning the header again
+LasCatalog = namedtuple('LasCatalog', ['row_idx_start', 'null_value', 'sections', 'curves'])
+
+
+def _parse_header_line(row):
+    """Split a header line MNEM.UNIT DATA : DESCRIPTION into a HeaderItem"""
+    mnemonic, _, rest = row.partition('.')
+    # unit runs from the dot to the first space
+    unit, _, rest = rest.partition(' ')
+    value, _, description = rest.rpartition(':')
+    return HeaderItem(mnemonic.strip(), unit.strip(), value.strip(), description.strip())
+
+
+def read_las_header(las_file_loc):
+    """Scan the LAS header until the ~A section is found
+    Return LasCatalog
+    - row_idx_start: row index where the log readings start
+    - null_value: NULL value defined in ~W section
+    - sections: {'V', 'W', 'P'} -> OrderedDict of mnemonic to HeaderItem
+    - curves: list of CurveInfo in column order (from ~C section)
+    """
+    sections = OrderedDict((section, OrderedDict()) for section in 'VWP')
+    curves = []
+    section = None
+    with open(las_file_loc) as file:
+        for row_idx, row in enumerate(file):
+            row = row.strip()
+            if not row or row.startswith('#'):
+                continue
+            if row.startswith('~'):
+                section = row[1].upper()
+                if section == 'A':
+                    # log readings start right after the ~A line
+                    null_item = sections['W'].get('NULL')
+                    null_value = float(null_item.value) if null_item and null_item.value \
+                        else LAS_NULL_VALUE
+                    return LasCatalog(row_idx + 1, null_value, sections, curves)
+                continue
+
+            if section in sections:
+                item = _parse_header_line(row)
+                sections[section][item.mnemonic.upper()] = item
+            elif section == 'C':
+                item = _parse_header_line(row)
+                curves.append(CurveInfo(item.mnemonic, item.unit, len(curves), item.description))
+            # other sections (~O) are not needed to read the logs
+
+    raise ValueError('LAS file %s does not contain an ~A section.' % las_file_loc)
+
+
+def _catalog_to_json(catalog, file_stat):
+    return {
+        'version': CATALOG_VERSION,
+        'size': file_stat.st_size,
+        'mtime': file_stat.st_mtime,
+        'row_idx_start': catalog.row_idx_start,
+        'null_value': catalog.null_value,
+        'sections': {section: [list(item) for item in items.values()]
+                     for section, items in catalog.sections.items()},
+        'curves': [list(curve) for curve in catalog.curves],
+    }
+
+
+def _catalog_from_json(cached):
+    sections = OrderedDict()
+    for section, items in cached['sections'].items():
+        sections[section] = OrderedDict((item[0].upper(), HeaderItem(*item)) for item in items)
+    curves = [CurveInfo(*curve) for curve in cached['curves']]
+    return LasCatalog(cached['row_idx_start'], cached['null_value'], sections, curves)
+
+
+def get_las_catalog(las_file_loc, use_cache=True):
+    """Return LasCatalog of a LAS file
+    The catalog is cached next to the file and keyed by file size and mtime,
+    so re-opening a known file skips the header scan"""
+    if not use_cache:
+        return read_las_header(las_file_loc)
+
+    file_stat = os.stat(las_file_loc)
+    catalog_loc = las_file_loc + CATALOG_EXT
+    try:
+        with open(catalog_loc) as file:
+            cached = json.load(file)
+        if (cached['version'], cached['size'], cached['mtime']) == \
+                (CATALOG_VERSION, file_stat.st_size, file_stat.st_mtime):
+            return _catalog_from_json(cached)
+    except (OSError, ValueError, KeyError):
+        # no cache yet or unreadable cache, scan the header again
+        pass
+
+    catalog = read_las_header(las_file_loc)
+    try:
+        with open(catalog_loc, 'w') as file:
+            json.dump(_catalog_to_json(catalog, file_stat), file, indent=1)
+    except OSError:
+        # read-only location, the catalog is still usable
+        pass
+
+    return catalog
+
+
+def find_data_section(las_file_loc):
+    """Return
+    - row index where the log readings start
+    - list of curve mnemonics in column order
+    - NULL value
+    """
+    catalog = get_las_catalog(las_file_loc)
+    return catalog.row_idx_start, [curve.mnemonic for curve in catalog.curves], catalog.null_value
+
+
+def get_curve_col_idx(mnemonics, curve_names):
+    """Column index of each curve name (first match) in mnemonics"""
+    upper_mnemonics = [mnemonic.upper() for mnemonic in mnemonics]
+    col_idxes = []
+    for curve_name in curve_names:
+        try:
+            col_idxes.append(upper_mnemonics.index(curve_name.upper()))
+        except ValueError:
+            raise ValueError('Curve %s is not in LAS curves: %s.'
+                             % (curve_name, ', '.join(mnemonics)))
+    return col_idxes
+
+
+def find_curve(curves, log_name):
+    """Find the curve of log_name, given as a mnemonic or as a canonical name
+    defined in LOG_NAMES_UNITS_DICT
+    Return CurveInfo, or None if the log is not in the curves"""
+    upper_name = log_name.upper()
+
+    # exact mnemonic
+    for curve in curves:
+        if curve.mnemonic.upper() == upper_name:
+            return curve
+
+    # canonical name, matched by known mnemonics then by description
+    canonical_names = {name.upper(): name for name in LOG_NAMES_UNITS_DICT}
+    if upper_name not in canonical_names:
+        return None
+    log_name = canonical_names[upper_name]
+    mnemonics = [mnemonic.upper() for mnemonic in LOG_MNEMONICS_DICT.get(log_name, [])]
+    candidates = [curve for curve in curves if curve.mnemonic.upper() in mnemonics]
+    if not candidates:
+        candidates = [curve for curve in curves if upper_name in curve.description.upper()]
+    if not candidates:
+        return None
+
+    # same log recorded in several units (ROP ft/hr and m/hr), prefer the project unit
+    for curve in candidates:
+        if curve.unit.lower() == LOG_NAMES_UNITS_DICT[log_name].lower():
+            return curve
+    return candidates[0]
+
+
+def select_curves(curves, logs_names=None):
+    """Select curves by mnemonic or canonical name
+    Input:
+        logs_names:
+            - None: every log of LOG_NAMES_UNITS_DICT found in the curves
+            - list of mnemonics or canonical names
+            - dict of new name -> mnemonic or canonical name to rename the logs
+    Return:
+        OrderedDict of log name -> CurveInfo
+    """
+    if logs_names is None:
+        selected = OrderedDict()
+        for log_name in LOG_NAMES_UNITS_DICT:
+            curve = find_curve(curves, log_name)
+            if curve is not None:
+                selected[log_name] = curve
+        return selected
+
+    if not isinstance(logs_names, dict):
+        logs_names = OrderedDict((log_name, log_name) for log_name in logs_names)
+
+    selected = OrderedDict()
+    for new_name, log_name in logs_names.items():
+        curve = find_curve(curves, log_name)
+        if curve is None:
+            raise ValueError('Log %s is not in LAS curves: %s.'
+                             % (log_name, ', '.join(curve.mnemonic for curve in curves)))
+        selected[new_name] = curve
+    return selected
+
+
+def read_las_values(las_file_loc, col_idxes=None, row_idx_start=None, null_value=None):
+    """Parse the ~A section of a LAS file into a float array in one pass
+    NULL readings are returned as NaN
+
+    Input:
+        col_idxes: column indexes to keep, in the order they are returned.
+            All columns are kept if None
+        row_idx_start, null_value: found from the header if None
+    Return:
+        logs_values: 2D array (depth steps x curves)
+    """
+    if row_idx_start is None or null_value is None:
+        _row_idx_start, _, _null_value = find_data_section(las_file_loc)
+        row_idx_start = _row_idx_start if row_idx_start is None else row_idx_start
+        null_value = _null_value if null_value is None else null_value
+
+    # C parser converts all rows at once and only keeps the requested columns
+    logs_values = np.loadtxt(las_file_loc, dtype=np.float64, skiprows=row_idx_start,
+                             usecols=col_idxes, ndmin=2)
+
+    logs_values[logs_values == null_value] = np.nan
+
+    return logs_values
+
+
+def write_las(las_file_loc, logs_reading_dict, units=None, well_name='', null_value=LAS_NULL_VALUE):
+    """Write logs as a LAS 2.0 file, one line per depth step
+    Input:
+        logs_reading_dict: OrderedDict of log name -> values, the first log is the depth
+        units: OrderedDict of log name -> unit
+    NaN readings are written as null_value
+    """
+    units = units or {}
+    log_names = list(logs_reading_dict)
+    if not log_names:
+        raise ValueError('No log to write.')
+    depth = np.asarray(logs_reading_dict[log_names[0]], dtype=np.float64)
+
+    # mnemonics have no spaces or dots, the log name is kept as description
+    mnemonics = [log_name.split(',')[0].replace(' ', '_').replace('.', '_').upper()
+                 for log_name in log_names]
+
+    def header_line(mnemonic, unit, value, description):
+        return '%-5s.%-10s %25s : %s\n' % (mnemonic, unit, value, description)
+
+    with open(las_file_loc, 'w') as file:
+        file.write('~VERSION INFORMATION\n')
+        file.write(header_line('VERS', '', '2.0', 'CWLS LOG ASCII STANDARD - VERSION 2.0'))
+        file.write(header_line('WRAP', '', 'NO', 'ONE LINE PER DEPTH STEP'))
+        file.write('~WELL INFORMATION BLOCK\n')
+        depth_unit = units.get(log_names[0], '')
+        file.write(header_line('STRT', depth_unit, '%g' % depth[0] if len(depth) else '', 'Start Depth'))
+        file.write(header_line('STOP', depth_unit, '%g' % depth[-1] if len(depth) else '', 'Stop Depth'))
+        file.write(header_line('STEP', depth_unit, '0', 'Step Value'))
+        file.write(header_line('NULL', '', '%g' % null_value, 'NULL Value'))
+        file.write(header_line('WELL', '', well_name, 'Well'))
+        file.write('~CURVE INFORMATION\n')
+        for mnemonic, log_name in zip(mnemonics, log_names):
+            file.write(header_line(mnemonic, units.get(log_name, ''), '', log_name))
+        file.write('~A ' + ' '.join(mnemonics) + '\n')
+
+        # write the readings in chunks to bound the memory of the formatted text
+        chunk_size = 1 << 16
+        for start in range(0, len(depth), chunk_size):
+            chunk = np.column_stack([np.asarray(logs_reading_dict[log_name][start:start + chunk_size],
+                                                dtype=np.float64) for log_name in log_names])
+            chunk[np.isnan(chunk)] = null_value
+            np.savetxt(file, chunk, fmt='%.10g', delimiter=' ')
+
+
+if __name__ == '__main__':
+    las_file = r'../input_template/Middleton Unit B 47-38 No. 8SH__From EDR.las'
+
+    catalog = get_las_catalog(las_file)
+    print(catalog.sections['W']['WELL'])
+    for curve in catalog.curves:
+        print(curve)
+
+    curves = select_curves(catalog.curves, ['Hole Depth', 'Rate Of Penetration', 'DIFP'])
+    print(read_las_values(las_file, [curve.col_idx for curve in curves.values()],
+                          catalog.row_idx_start, catalog.null_value))
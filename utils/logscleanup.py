@@ -1,73 +1,67 @@
 
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
 import numpy as np
 
+from input.LOG_UNITS import LOG_NAMES_UNITS_DICT
+from .las import get_las_catalog, select_curves, find_curve, read_las_values
+
 """
 Utilities to extract and clean up LAS files
 """
 
+# short log names used for rock properties -> mnemonic or canonical name in LAS files
+EDR_LOGS_NAMES = OrderedDict([('TVD', 'Hole Depth'), ('ROP', 'Rate Of Penetration'), ('RPM', 'RPM'),
+                              ('TOR', 'TOR'), ('WOB', 'WOB'), ('DIFP', 'DIFP')])
+MWD_LOGS_NAMES = OrderedDict([('TVD', 'Hole Depth'), ('GR', 'Gamma')])
 
-def get_specific_attr_mapping(las_file_loc):
-    """Mapping of attr name to attr idx and attr units
-    This is specific to each LAS file, thus changing it if needed
-    Specify the logs that you need to extract only, and their units"""
-
-    def _get_mapping(logs_names, logs_names_col_idx, logs_units):
-        attr_mapping_idx = OrderedDict()
-        attr_mapping_unit = OrderedDict()
-        for log_name, log_col_idx, log_unit in zip(logs_names, logs_names_col_idx, logs_units):
-            attr_mapping_idx[log_name] = log_col_idx
-            attr_mapping_unit[log_name] = log_unit
-
-        return attr_mapping_idx, attr_mapping_unit
-
-    # Assuming the LAS file is on the same directory
-    if las_file_loc == r'../input_template/Middleton Unit B 47-38 No. 8SH__From EDR.las':
-        # row where the log reading starts
-        # specific to each LAS file
-        row_idx_start = 47
-        # col where the required log are and their units
-        # specific to each LAS file
-        logs_names = ['TVD', 'ROP', 'RPM', 'TOR', 'WOB', 'DIFP']
-        logs_names_col_idx = [0, 2, 3, 4, 5, 9]
-        logs_units = ['ft', 'ft/hr', 'rev/min', 'in/lb', 'kDaN', 'kPa']
-
-    elif las_file_loc == r'../input_template/LAS Middleton Unit B 47-38 No. 8SH_From MWD.las':
-        row_idx_start = 203
-        logs_names = ['TVD', 'GR']
-        logs_names_col_idx = [0, 1]
-        logs_units = ['ft', 'API']
+# number of samples of a log and how many of them were kept by merge_logs
+MergeCount = namedtuple('MergeCount', ['samples', 'kept'])
 
-    else:
-        raise ValueError('LAS file location: %s has not been specified.'
-                         % las_file_loc)
 
-    attr_mapping_idx, attr_mapping_unit = _get_mapping(logs_names, logs_names_col_idx, logs_units)
+def get_specific_attr_mapping(las_file_loc, logs_names=None):
+    """Mapping of attr name to attr idx and attr units
+    Logs are found from the curve catalog of the LAS file header
+    Input:
+        logs_names: logs that you need to extract only, see las.select_curves
+            - None: every log of LOG_NAMES_UNITS_DICT found in the file
+            - list of mnemonics or canonical names
+            - dict of new name -> mnemonic or canonical name
+    """
+    catalog = get_las_catalog(las_file_loc)
+    curves = select_curves(catalog.curves, logs_names)
+
+    attr_mapping_idx = OrderedDict()
+    attr_mapping_unit = OrderedDict()
+    for log_name, curve in curves.items():
+        attr_mapping_idx[log_name] = curve.col_idx
+        attr_mapping_unit[log_name] = curve.unit
+        if not curve.unit:
+            # units left blank in the header fall back to the units assumed by the project
+            for canonical_name, canonical_unit in LOG_NAMES_UNITS_DICT.items():
+                if find_curve(catalog.curves, canonical_name) == curve:
+                    attr_mapping_unit[log_name] = canonical_unit
 
-    return row_idx_start, attr_mapping_idx, attr_mapping_unit
+    return catalog.row_idx_start, attr_mapping_idx, attr_mapping_unit
 
 
-def get_log_reading_dict(las_file_loc, filternull=True):
+def get_log_reading_dict(las_file_loc, filternull=True, logs_names=None):
     """"
     Return
     - OrderedDict to record each log
     - numeric values of all logs altogether
     """
-    row_idx_start, attr_mapping_idx, attr_mapping_unit = get_specific_attr_mapping(las_file_loc)
+    row_idx_start, attr_mapping_idx, attr_mapping_unit = \
+        get_specific_attr_mapping(las_file_loc, logs_names)
 
-    # get log numeric values
+    # get log numeric values in one pass, NULL readings are NaN
     # doesn't ignore off values (<0)
-    logs_values = []
-    with open(las_file_loc) as file:
-        for row_idx, row in enumerate(file):
-            if row_idx >= row_idx_start:
-                row = row.split()
-                logs_values.append([float(row[col_idx]) for col_idx in attr_mapping_idx.values()])
-    logs_values = np.array(logs_values)
+    catalog = get_las_catalog(las_file_loc)
+    logs_values = read_las_values(las_file_loc, col_idxes=list(attr_mapping_idx.values()),
+                                  row_idx_start=row_idx_start, null_value=catalog.null_value)
 
     if filternull:
-        # filter non-neg element
+        # filter non-neg element (NaN compares False)
         mask = logs_values > 0
         # only rows that contain all pos values are selected
         logs_values = logs_values[mask.all(axis=1)]
@@ -80,12 +74,12 @@ def get_log_reading_dict(las_file_loc, filternull=True):
     return logs_reading_dict, logs_values
 
 
-def get_filtered_log_reading_dict(las_file_loc):
+def get_filtered_log_reading_dict(las_file_loc, logs_names=None):
     """"Ignore off values in logs_values (only take non-neg)
     Return
     - OrderedDict that filter out non-neg values
      """
-    logs_reading_dict, logs_values = get_log_reading_dict(las_file_loc)
+    logs_reading_dict, logs_values = get_log_reading_dict(las_file_loc, logs_names=logs_names)
 
     # filter non-neg element
     mask = logs_values > 0
@@ -103,94 +97,194 @@ def get_filtered_log_reading_dict(las_file_loc):
     return logs_reading_dict, logs_values
 
 
-def merge_logs(all_logs_reading_dicts, all_logs_values, primary_key='TVD'):
-    """"Given any logs in dictionary format, find the common rows that contain primary key
-    in all logs
+def _unique_sorted(sorted_depth):
+    """Drop repeated depths of a sorted depth array"""
+    if not len(sorted_depth):
+        return sorted_depth
+    return sorted_depth[np.r_[True, sorted_depth[1:] != sorted_depth[:-1]]]
+
+
+def _sorted_depth(depth):
+    """Return depth sorted ascending and the sort order (None if already sorted)"""
+    if np.all(depth[1:] >= depth[:-1]):
+        return depth, None
+    order = np.argsort(depth, kind='stable')
+    return depth[order], order
+
+
+def _join_depths(primary_rows, sorted_depths, orders, logs_order, tolerance=None):
+    """Keep the depths of primary_rows found in every log, in the order of logs_order
+    tolerance=None: depths must match exactly
+    tolerance: the nearest depth of each log must be within tolerance
+    Return
+    - kept primary rows
+    - rows of each log matching the kept primary rows
+    """
+    # keep depths found in every log, remembering where each depth sits in each log
+    all_rows, all_keeps = [None] * len(sorted_depths), []
+    for log_idx in logs_order:
+        sorted_depth = sorted_depths[log_idx]
+        if not len(sorted_depth):
+            rows = np.zeros(len(primary_rows), dtype=np.intp)
+            keep = np.zeros(len(primary_rows), dtype=bool)
+        elif tolerance is None:
+            rows = np.searchsorted(sorted_depth, primary_rows, side='left')
+            np.minimum(rows, len(sorted_depth) - 1, out=rows)
+            keep = sorted_depth[rows] == primary_rows
+        else:
+            # closest of the neighbours on each side
+            right = np.searchsorted(sorted_depth, primary_rows, side='left')
+            left = np.maximum(right - 1, 0)
+            np.minimum(right, len(sorted_depth) - 1, out=right)
+            left_dist = np.abs(primary_rows - sorted_depth[left])
+            right_dist = np.abs(sorted_depth[right] - primary_rows)
+            rows = np.where(left_dist < right_dist, left, right)
+            keep = np.minimum(left_dist, right_dist) <= tolerance
+        primary_rows = primary_rows[keep]
+        all_rows[log_idx] = rows
+        all_keeps.append(keep)
+
+    # walk back the joins to get the rows of the final depths in each log
+    survivors = np.arange(len(primary_rows))
+    for log_idx, keep in zip(logs_order[::-1], all_keeps[::-1]):
+        survivors = np.flatnonzero(keep)[survivors]
+        rows = all_rows[log_idx][survivors]
+        order = orders[log_idx]
+        all_rows[log_idx] = rows if order is None else order[rows]
+
+    return primary_rows, all_rows
+
+
+def merge_logs(all_logs_reading_dicts, all_logs_values=None, primary_key='TVD',
+               how='exact', tolerance=0.5, step=None, return_counts=False):
+    """"Given any logs in dictionary format, align all logs on the primary key
+    Depths are joined with searchsorted over each sorted primary key, and all logs are
+    written into a single preallocated output.
+
+    how='exact': keep the depths found in all logs. If a depth is repeated in a log,
+        its first reading is used
+    how='nearest': keep the depths of the first log where every other log has a
+        reading within tolerance, and snap each log to its nearest reading
+    how='interpolate': resample all logs on a common grid of the given step (median
+        step of the first log if None) with linear interpolation, over the depth range
+        covered by every log
+
+    Input:
+        all_logs_values: numeric values of each log, columns in the same order as the
+            dictionary keys. Columns are taken from the dictionaries if None
+        return_counts: also return the number of samples of each log and how many
+            of them were kept
     Return:
         - logs_reading_dict: combined log readings per log
-        - logs_values: numeric values of the logs
+        - logs_values: numeric values of the logs, primary key is the last column
+        - counts (if return_counts): list of MergeCount(samples, kept), one per log
     """
-
-    primary_key_list = []
-    non_primary_key_list = []
+    # columns of each log, in dictionary order
+    all_logs_cols = []
     for log_reading_idx, log_reading in enumerate(all_logs_reading_dicts):
         # check for primary key
         if primary_key not in log_reading.keys():
             raise ValueError('The primary key %s is missing in log %d.'
                              % (primary_key, log_reading_idx+1))
+        if all_logs_values is None:
+            all_logs_cols.append(list(log_reading.items()))
         else:
-            # find index of primary key in each dictionary
-            non_primary_key_idxes = []
-            for col_idx, col in enumerate(log_reading.keys()):
-                if col == primary_key:
-                    primary_key_list.append((col, col_idx))
-                else:
-                    non_primary_key_idxes.append((col, col_idx))
-            non_primary_key_list.append(non_primary_key_idxes)
-
-    # recursively find the common depth from all logs_reading_dict based on primary_key
-    # append all readings in all logs to a list according to primary key
-    log_values_primary_key = [logs_reading_dicts[primary_key]
-                              for logs_reading_dicts in all_logs_reading_dicts]
-
-    def _find_common_rows(S):
-        # recursive call to find common element
-        def _find(S, result, n):
-            if n == 0:
-                return result
-            result = np.intersect1d(S[n-1], result)
-            return _find(S, result, n-1)
-        return _find(S, result=S[len(S)-1], n=len(S))
-
-    primary_rows = _find_common_rows(log_values_primary_key)
-
-    # filter out rows correspond to primary rows
-    for logs_idx, (primary_key, primary_key_idx) in enumerate(primary_key_list):
-        mask = np.isin(all_logs_values[logs_idx][:, primary_key_idx], primary_rows)
-        all_logs_values[logs_idx] = all_logs_values[logs_idx][mask, :]
-
-    # stack all logs values according to non primary keys
-    def _stack_cols(S, non_primary_key_list):
-        def _stack(S, non_primary_key_list, start, stop):
-
-            col_name_start = list(zip(*non_primary_key_list[start]))[0]
-            col_name_stop = list(zip(*non_primary_key_list[stop]))[0]
-            col_idx_start = list(zip(*non_primary_key_list[start]))[1]
-            col_idx_stop = list(zip(*non_primary_key_list[stop]))[1]
-            if start == stop:
-                for log_name, log_idx in zip(col_name_start, col_idx_start):
-                    new_dict[log_name] = S[start][:, log_idx]
-                new_stack = S[start][:, col_idx_start]
-                return new_stack
-            elif start == stop - 1:
-                for i, _logs_names, _logs_idx in \
-                        ((start, col_name_start, col_idx_start), (stop, col_name_stop, col_idx_stop)):
-                    for log_name, log_idx in zip(_logs_names, _logs_idx):
-                        new_dict[log_name] = S[i][:, log_idx]
-                new_stack = np.hstack((S[start][:, col_idx_start], S[stop][:, col_idx_stop]))
-                return new_stack
-            middle = (start + stop) // 2
-            left = _stack(S, non_primary_key_list, start, middle)
-            right = _stack(S, non_primary_key_list, middle+1, stop)
-            return np.hstack((left, right))
-        new_dict = OrderedDict()
-        return new_dict, _stack(S, non_primary_key_list, start=0, stop=len(S)-1)
-
-    all_logs_reading_dicts, all_logs_values = _stack_cols(all_logs_values, non_primary_key_list)
-
-    # append primary rows to the new stacked cols and dict
-    all_logs_values = np.hstack((all_logs_values, primary_rows.reshape(-1, 1)))
-    all_logs_reading_dicts[primary_key] = primary_rows
-
-    return all_logs_reading_dicts, all_logs_values
+            logs_values = all_logs_values[log_reading_idx]
+            all_logs_cols.append([(col, logs_values[:, col_idx])
+                                  for col_idx, col in enumerate(log_reading.keys())])
+
+    # sort primary key of each log once
+    sorted_depths, orders = zip(*[_sorted_depth(np.asarray(log_reading[primary_key]))
+                                  for log_reading in all_logs_reading_dicts])
+
+    if how == 'exact':
+        # common depths can't outnumber the shortest log, start from its unique depths
+        # and join the other logs from the shortest to the longest
+        logs_order = np.argsort([len(depth) for depth in sorted_depths], kind='stable')
+        primary_rows = _unique_sorted(sorted_depths[logs_order[0]])
+        primary_rows, all_rows = _join_depths(primary_rows, sorted_depths, orders, logs_order)
+    elif how == 'nearest':
+        logs_order = np.arange(len(sorted_depths))
+        primary_rows = _unique_sorted(sorted_depths[0])
+        primary_rows, all_rows = _join_depths(primary_rows, sorted_depths, orders, logs_order,
+                                              tolerance=tolerance)
+    elif how == 'interpolate':
+        if step is not None and not step > 0:
+            raise ValueError('step must be positive.')
+        all_rows = None
+        if any(not len(depth) for depth in sorted_depths):
+            primary_rows = np.zeros(0)
+        else:
+            if step is None:
+                first_depths = _unique_sorted(sorted_depths[0])
+                if len(first_depths) < 2:
+                    raise ValueError('The first log has less than two depths, '
+                                     'give the step of the interpolation.')
+                step = np.median(np.diff(first_depths))
+            if not step > 0:
+                raise ValueError('step must be positive.')
+            top = max(depth[0] for depth in sorted_depths)
+            bottom = min(depth[-1] for depth in sorted_depths)
+            n_steps = int(np.floor((bottom - top) / step + 1e-9)) + 1 if bottom >= top else 0
+            primary_rows = top + step * np.arange(n_steps)
+    else:
+        raise ValueError('Unknown alignment: %s.' % how)
+
+    # one output allocation, column-major so each log column is written contiguously
+    n_cols = sum(len(log_cols) - 1 for log_cols in all_logs_cols) + 1
+    all_logs_values = np.empty((len(primary_rows), n_cols), order='F')
+    all_logs_reading_dicts_merged = OrderedDict()
+    counts = []
+
+    col_out = 0
+    for log_idx, log_cols in enumerate(all_logs_cols):
+        sorted_depth, order = sorted_depths[log_idx], orders[log_idx]
+        rows = None if all_rows is None else all_rows[log_idx]
+        if return_counts:
+            if how == 'exact':
+                counts.append(MergeCount(len(sorted_depth), len(rows)))
+            elif how == 'nearest':
+                # several depths can snap to the same reading
+                counts.append(MergeCount(len(sorted_depth), len(np.unique(rows))))
+            else:
+                # readings inside the common depth range
+                kept = np.searchsorted(sorted_depth, primary_rows[-1], side='right') - \
+                    np.searchsorted(sorted_depth, primary_rows[0], side='left') \
+                    if len(primary_rows) else 0
+                counts.append(MergeCount(len(sorted_depth), int(kept)))
+
+        for col, values in log_cols:
+            if col == primary_key:
+                continue
+            values = np.asarray(values)
+            if rows is not None:
+                np.take(values, rows, out=all_logs_values[:, col_out], mode='clip')
+            elif len(primary_rows):
+                all_logs_values[:, col_out] = np.interp(primary_rows, sorted_depth,
+                                                        values if order is None else values[order])
+            all_logs_reading_dicts_merged[col] = all_logs_values[:, col_out]
+            col_out += 1
+
+    # append primary rows to the end
+    all_logs_values[:, col_out] = primary_rows
+    all_logs_reading_dicts_merged[primary_key] = all_logs_values[:, col_out]
+
+    if return_counts:
+        return all_logs_reading_dicts_merged, all_logs_values, counts
+    return all_logs_reading_dicts_merged, all_logs_values
 
 
 if __name__ == '__main__':
+    from utils.logstore import WellStore
 
+    # LAS files are only parsed the first time, later runs open the stored arrays
+    store = WellStore()
     las_file_1 = r'../input_template/Middleton Unit B 47-38 No. 8SH__From EDR.las'
-    logs_reading_dict1, logs_values1 = get_filtered_log_reading_dict(las_file_1)
+    logs_reading_dict1 = store.get(las_file_1, logs_names=EDR_LOGS_NAMES)
+    logs_values1 = np.column_stack(list(logs_reading_dict1.values()))
     las_file_2 = r'../input_template/LAS Middleton Unit B 47-38 No. 8SH_From MWD.las'
-    logs_reading_dict2, logs_values2 = get_filtered_log_reading_dict(las_file_2)
+    logs_reading_dict2 = store.get(las_file_2, logs_names=MWD_LOGS_NAMES)
+    logs_values2 = np.column_stack(list(logs_reading_dict2.values()))
     all_logs_reading_dicts = [logs_reading_dict1, logs_reading_dict2]
     all_logs_values = [logs_values1, logs_values2]
 
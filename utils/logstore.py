@@ -0,0 +1,296 @@
+import hashlib
+import json
+import os
+import shutil
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from input.configuration import STORE_DIR
+from input.LOG_UNITS import LOG_NAMES_UNITS_DICT
+from .las import get_las_catalog
+from .columnar import COLUMNAR_EXTS, read_columnar, read_units
+from .logscleanup import get_specific_attr_mapping, get_log_reading_dict
+
+"""
+Columnar store of parsed well logs
+Each well is saved in its own directory as one .npy file per curve, plus meta.json with
+units, null value and the hash of the source file. Curves are opened memory-mapped, so
+a large well can be sliced by depth without being read into RAM.
+"""
+
+STORE_META = 'meta.json'
+# bump when the store layout changes so old wells are rebuilt
+STORE_VERSION = 1
+
+
+def get_file_hash(file_loc, chunk_size=1 << 20):
+    """Hash of the file content, read in chunks"""
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(file_loc, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_well_name(source_loc):
+    """Store name of a source file: file name and a hash of its absolute path, so wells
+    with the same file name in different directories (W1/EDR.las, W2/EDR.las) don't mix"""
+    path_hash = hashlib.blake2b(os.path.abspath(source_loc).encode(), digest_size=4).hexdigest()
+    return '%s_%s' % (os.path.basename(source_loc), path_hash)
+
+
+def read_well_file(source_loc, logs_names=None, filternull=True):
+    """Parse a LAS, CSV, XLSX, Parquet or Feather well file
+    Input:
+        logs_names: logs to extract from LAS files, see las.select_curves
+        filternull: only keep rows where all logs are positive
+    Return:
+        - OrderedDict of log name -> values
+        - OrderedDict of log name -> unit
+        - NULL value of the source
+    """
+    file_ext = os.path.splitext(source_loc)[1].lower()
+
+    if file_ext == '.las':
+        _, _, attr_mapping_unit = get_specific_attr_mapping(source_loc, logs_names)
+        logs_reading_dict, _ = get_log_reading_dict(source_loc, filternull=filternull,
+                                                    logs_names=logs_names)
+        return logs_reading_dict, attr_mapping_unit, get_las_catalog(source_loc).null_value
+
+    if file_ext in COLUMNAR_EXTS.values():
+        # units are in the column metadata, columns are named as in cleaned csv files
+        df = read_columnar(source_loc)
+        df.columns = ['%s,%s' % (log_name, unit) if unit else log_name
+                      for log_name, unit in read_units(source_loc).items()]
+    elif file_ext == '.csv':
+        df = pd.read_csv(source_loc)
+    elif file_ext == '.xlsx':
+        df = pd.read_excel(source_loc)
+    else:
+        raise ValueError('Unknown well file extension: %s.' % file_ext)
+
+    # index column written by DataFrame.to_csv/to_excel is not a log
+    df = df.drop(columns=[col for col in df.columns if str(col).startswith('Unnamed:')])
+    df = df._get_numeric_data()
+    if logs_names is not None:
+        df = df.loc[:, list(logs_names)]
+    if filternull:
+        df = df[(df > 0).all(axis=1)]
+
+    logs_reading_dict = OrderedDict()
+    attr_mapping_unit = OrderedDict()
+    for col in df.columns:
+        logs_reading_dict[col] = df[col].values.astype(np.float64)
+        # cleaned files name their columns as 'log name,unit'
+        log_name, _, unit = col.partition(',')
+        attr_mapping_unit[col] = unit if unit else LOG_NAMES_UNITS_DICT.get(log_name, '')
+
+    return logs_reading_dict, attr_mapping_unit, None
+
+
+class WellStore():
+    """Save and load parsed wells as per-curve arrays
+
+    store = WellStore()
+    logs_reading_dict = store.get('well.las', logs_names=['Hole Depth', 'Gamma'])
+    shallow = store.load(get_well_name('well.las'), depth_range=(5000, 6000))
+    """
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+
+    def well_dir(self, well_name):
+        return os.path.join(self.store_dir, well_name)
+
+    def wells(self):
+        """Names of all wells in the store"""
+        if not os.path.isdir(self.store_dir):
+            return []
+        return sorted(well_name for well_name in os.listdir(self.store_dir)
+                      if os.path.isfile(os.path.join(self.well_dir(well_name), STORE_META)))
+
+    def read_meta(self, well_name):
+        """Return meta of a stored well, None if the well is not in the store"""
+        try:
+            with open(os.path.join(self.well_dir(well_name), STORE_META)) as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get('version') == STORE_VERSION else None
+
+    def _write_meta(self, well_dir, meta):
+        with open(os.path.join(well_dir, STORE_META), 'w') as file:
+            json.dump(meta, file, indent=1)
+
+    def save(self, well_name, logs_reading_dict, units=None, null_value=None,
+             source_loc=None, reader_params=None, depth_key=None):
+        """Save each log of a well as a .npy file
+        Input:
+            units: OrderedDict of log name -> unit
+            source_loc: file the logs were parsed from, its hash is kept to detect stale wells
+            reader_params: parameters used to parse the source, a change also makes the well stale
+            depth_key: log used to slice by depth, first log if None
+        """
+        units = units or {}
+        log_names = list(logs_reading_dict)
+        depth_key = depth_key or log_names[0]
+        depth = np.asarray(logs_reading_dict[depth_key])
+
+        meta = OrderedDict([
+            ('version', STORE_VERSION),
+            ('well_name', well_name),
+            ('n_samples', len(depth)),
+            ('depth_key', depth_key),
+            ('depth_sorted', bool(np.all(depth[1:] >= depth[:-1]))),
+            ('null_value', null_value),
+            ('curves', []),
+            ('reader_params', reader_params),
+            ('source', None),
+        ])
+        if source_loc is not None:
+            source_stat = os.stat(source_loc)
+            meta['source'] = OrderedDict([
+                ('path', os.path.abspath(source_loc)),
+                ('size', source_stat.st_size),
+                ('mtime', source_stat.st_mtime),
+                ('hash', get_file_hash(source_loc)),
+            ])
+
+        # write into a temporary directory so a failed save never leaves a half-written well
+        well_dir = self.well_dir(well_name)
+        tmp_dir = well_dir + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for log_idx, log_name in enumerate(log_names):
+            curve_file = 'curve_%03d.npy' % log_idx
+            np.save(os.path.join(tmp_dir, curve_file), np.asarray(logs_reading_dict[log_name]))
+            meta['curves'].append(OrderedDict([('name', log_name), ('file', curve_file),
+                                               ('unit', units.get(log_name, ''))]))
+        self._write_meta(tmp_dir, meta)
+
+        shutil.rmtree(well_dir, ignore_errors=True)
+        os.replace(tmp_dir, well_dir)
+
+        return meta
+
+    def add_curve(self, well_name, log_name, values, unit=''):
+        """Add or replace one curve of a stored well"""
+        meta = self.read_meta(well_name)
+        if meta is None:
+            raise ValueError('Well %s is not in the store.' % well_name)
+        if len(values) != meta['n_samples']:
+            raise ValueError('Curve %s has %d samples, well %s has %d.'
+                             % (log_name, len(values), well_name, meta['n_samples']))
+
+        well_dir = self.well_dir(well_name)
+        curves = OrderedDict((curve['name'], curve) for curve in meta['curves'])
+        if log_name in curves:
+            curve_file = curves[log_name]['file']
+        else:
+            curve_file = 'curve_%03d.npy' % len(curves)
+        np.save(os.path.join(well_dir, curve_file), np.asarray(values))
+        curves[log_name] = OrderedDict([('name', log_name), ('file', curve_file), ('unit', unit)])
+        meta['curves'] = list(curves.values())
+        self._write_meta(well_dir, meta)
+
+    def is_stale(self, well_name, source_loc, reader_params=None):
+        """True if the well is not stored, was stored from another file or its source file
+        has changed"""
+        meta = self.read_meta(well_name)
+        if meta is None or meta['source'] is None or meta['reader_params'] != reader_params:
+            return True
+        if meta['source']['path'] != os.path.abspath(source_loc):
+            return True
+
+        source = meta['source']
+        source_stat = os.stat(source_loc)
+        if (source['size'], source['mtime']) == (source_stat.st_size, source_stat.st_mtime):
+            return False
+        if source['size'] != source_stat.st_size or source['hash'] != get_file_hash(source_loc):
+            return True
+
+        # touched but unchanged, remember the new mtime to skip hashing next time
+        source['mtime'] = source_stat.st_mtime
+        self._write_meta(self.well_dir(well_name), meta)
+        return False
+
+    def load(self, well_name, logs_names=None, depth_range=None, mmap=True):
+        """Return OrderedDict of log name -> values of a stored well
+        Input:
+            logs_names: logs to load, all logs if None
+            depth_range: (top, bottom) to only keep top <= depth <= bottom
+            mmap: open arrays memory-mapped (read-only) instead of reading them into RAM
+        """
+        meta = self.read_meta(well_name)
+        if meta is None:
+            raise ValueError('Well %s is not in the store.' % well_name)
+
+        well_dir = self.well_dir(well_name)
+        mmap_mode = 'r' if mmap else None
+        curve_files = OrderedDict((curve['name'], os.path.join(well_dir, curve['file']))
+                                  for curve in meta['curves'])
+        logs_names = list(curve_files) if logs_names is None else logs_names
+
+        rows = slice(None)
+        if depth_range is not None:
+            top, bottom = depth_range
+            depth = np.load(curve_files[meta['depth_key']], mmap_mode=mmap_mode)
+            if meta['depth_sorted']:
+                # only the pages around the two boundaries are read
+                rows = slice(np.searchsorted(depth, top, side='left'),
+                             np.searchsorted(depth, bottom, side='right'))
+            else:
+                rows = np.flatnonzero((depth >= top) & (depth <= bottom))
+
+        logs_reading_dict = OrderedDict()
+        for log_name in logs_names:
+            if log_name not in curve_files:
+                raise ValueError('Log %s is not stored for well %s.' % (log_name, well_name))
+            logs_reading_dict[log_name] = np.load(curve_files[log_name], mmap_mode=mmap_mode)[rows]
+
+        return logs_reading_dict
+
+    def units(self, well_name):
+        """OrderedDict of log name -> unit of a stored well"""
+        meta = self.read_meta(well_name)
+        if meta is None:
+            raise ValueError('Well %s is not in the store.' % well_name)
+        return OrderedDict((curve['name'], curve['unit']) for curve in meta['curves'])
+
+    def get(self, source_loc, well_name=None, logs_names=None, filternull=True,
+            depth_range=None, mmap=True):
+        """Load a well from the store, parsing the source file first if it is new or stale
+        Input:
+            well_name: name in the store, see get_well_name if None. A well stored under
+                this name from another file is replaced
+            logs_names, filternull: see read_well_file
+        """
+        if well_name is None:
+            well_name = get_well_name(source_loc)
+        reader_params = {'logs_names': None if logs_names is None else
+                         (list(logs_names.items()) if isinstance(logs_names, dict) else list(logs_names)),
+                         'filternull': filternull}
+        # json round trip so the params compare equal to the ones read back from meta.json
+        reader_params = json.loads(json.dumps(reader_params))
+
+        if self.is_stale(well_name, source_loc, reader_params):
+            logs_reading_dict, units, null_value = read_well_file(source_loc, logs_names, filternull)
+            self.save(well_name, logs_reading_dict, units, null_value, source_loc, reader_params)
+
+        return self.load(well_name, depth_range=depth_range, mmap=mmap)
+
+
+if __name__ == '__main__':
+    from utils.logscleanup import EDR_LOGS_NAMES
+
+    las_file = r'../input_template/Middleton Unit B 47-38 No. 8SH__From EDR.las'
+
+    store = WellStore()
+    # first call parses the LAS file, later calls open the stored arrays
+    logs_reading_dict = store.get(las_file, logs_names=EDR_LOGS_NAMES)
+    print(store.wells(), store.units(get_well_name(las_file)))
+
+    logs_reading_dict = store.get(las_file, logs_names=EDR_LOGS_NAMES, depth_range=(5000, 5010))
+    print(logs_reading_dict)
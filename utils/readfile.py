@@ -1,34 +1,125 @@
+import os
+import pickle
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
+from openpyxl import load_workbook
+
+"""
+Read the project input workbook (input_template/input_template.xlsx)
+The workbook is opened once in read-only mode and all sheets are streamed row by row.
+The parsed sheets are cached next to the workbook in a binary file keyed by file size
+and mtime, so later runs do not open Excel at all.
+"""
+
+# parsed sheets are saved next to the workbook with this extension
+WORKBOOK_CACHE_EXT = '.sheets.pkl'
+# bump when the cache layout changes so old caches are ignored
+WORKBOOK_CACHE_VERSION = 1
+
+
+def _cell_value(value):
+    """Cell value as pd.read_excel gives it: empty cells are NaN, integral floats are int"""
+    if value is None:
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _get_columns(header):
+    """Column names as pd.read_excel gives them: 'Unnamed: i' for empty headers,
+    '.1', '.2'... appended to duplicated headers"""
+    columns, counts = [], {}
+    for col_idx, name in enumerate(header):
+        name = 'Unnamed: %d' % col_idx if name is None else name
+        if name in counts:
+            counts[name] += 1
+            name = '%s.%d' % (name, counts[name])
+        else:
+            counts[name] = 0
+        columns.append(name)
+    return columns
+
+
+def _read_sheet(worksheet):
+    """DataFrame of a read-only worksheet, first row is the header"""
+    rows = worksheet.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return pd.DataFrame()
+    values = [[_cell_value(value) for value in row] for row in rows]
+    # read-only sheets may report formatted but empty rows at the end
+    while values and all(value is np.nan for value in values[-1]):
+        values.pop()
+    return pd.DataFrame(values, columns=_get_columns(header))
 
 
-def read(input_loc):
+def read_workbook(input_loc):
+    """OrderedDict of sheet name -> DataFrame, the workbook is opened once"""
+    workbook = load_workbook(input_loc, read_only=True, data_only=True)
+    try:
+        return OrderedDict((worksheet.title, _read_sheet(worksheet))
+                           for worksheet in workbook.worksheets)
+    finally:
+        workbook.close()
+
+
+def get_workbook(input_loc, use_cache=True):
+    """Return all sheets of a workbook, see read_workbook
+    The sheets are cached next to the workbook and keyed by file size and mtime"""
+    if not use_cache:
+        return read_workbook(input_loc)
+
+    file_stat = os.stat(input_loc)
+    cache_loc = input_loc + WORKBOOK_CACHE_EXT
+    key = (WORKBOOK_CACHE_VERSION, file_stat.st_size, file_stat.st_mtime)
+    try:
+        with open(cache_loc, 'rb') as file:
+            cached = pickle.load(file)
+        if cached['key'] == key:
+            return cached['sheets']
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError):
+        # no cache yet or unreadable cache, read the workbook again
+        pass
+
+    sheets = read_workbook(input_loc)
+    try:
+        with open(cache_loc, 'wb') as file:
+            pickle.dump({'key': key, 'sheets': sheets}, file, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        # read-only location, the sheets are still usable
+        pass
+
+    return sheets
+
+
+def read(input_loc, use_cache=True):
     """Return input from input template
     Input:
         input_df: follow format from input_template/input_template.xlsx
+        use_cache: read the sheets cached by an earlier run if the workbook is unchanged
     Output:
         Bit area: in
         Mud weight: ppm
         Logs values: """
+    sheets = get_workbook(input_loc, use_cache)
 
     # bit area
-    df = pd.read_excel(input_loc, sheet_name='drilling bit')
-    bit_area = df.loc[1, 'Bit area']
+    bit_area = sheets['drilling bit'].loc[1, 'Bit area']
 
     # drilling mud
-    df = pd.read_excel(input_loc, sheet_name='drilling mud')
-    mud_weight = df.loc[1, 'Mud weight']
+    mud_weight = sheets['drilling mud'].loc[1, 'Mud weight']
 
     # logs values
-    df = pd.read_excel(input_loc, sheet_name='logs')
-    logs_values = df.iloc[1:, 1:]
+    logs_values = sheets['logs'].iloc[1:, 1:]
 
     return bit_area, mud_weight, logs_values
 
 
 if __name__ == '__main__':
-    import pandas as pd
     input_loc = r'../input/input.xlsx'
 
     bit_area, mud_weight, logs_values = read(input_loc)
     print(logs_values)
-
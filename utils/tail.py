@@ -0,0 +1,190 @@
+import io
+import json
+import logging
+import os
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from input.LOG_UNITS import LOG_NAMES_UNITS_DICT, LOG_MNEMONICS_DICT
+from .las import get_las_catalog
+from .logscleanup import get_specific_attr_mapping
+
+"""
+Follow a well file (CSV or LAS) while it is being written, e.g. by the rig data logger
+Only complete lines are read: a partly written last line is left for the next read.
+The byte offset after the last read line is returned with every read, so a follower can
+persist it and resume where it stopped.
+"""
+
+logger = logging.getLogger(__name__)
+
+# columns of the file and where its data starts
+TableLayout = namedtuple('TableLayout', ['columns', 'units', 'data_offset', 'delimiter',
+                                         'null_value', 'file_type'])
+
+
+def get_table_layout(file_loc):
+    """Return TableLayout of a CSV or LAS file
+    - columns: column names (LAS mnemonics) in file order
+    - units: unit of each column, '' if unknown
+    - data_offset: byte offset of the first data line
+    - delimiter: None for whitespace (LAS)
+    - null_value: NULL value of LAS files, None for CSV
+    """
+    file_ext = os.path.splitext(file_loc)[1].lower()
+    if file_ext == '.las':
+        catalog = get_las_catalog(file_loc, use_cache=False)
+        with open(file_loc, 'rb') as file:
+            for _ in range(catalog.row_idx_start):
+                file.readline()
+            data_offset = file.tell()
+        return TableLayout([curve.mnemonic for curve in catalog.curves],
+                           [curve.unit for curve in catalog.curves], data_offset, None,
+                           catalog.null_value, 'las')
+
+    if file_ext == '.csv':
+        with open(file_loc, 'rb') as file:
+            header = file.readline()
+            if not header.endswith(b'\n'):
+                raise ValueError('Header of %s is not complete yet.' % file_loc)
+            data_offset = file.tell()
+        columns = list(pd.read_csv(io.BytesIO(header), nrows=0).columns)
+        # cleaned files name their columns as 'log name,unit'
+        units = [column.partition(',')[2] for column in columns]
+        return TableLayout(columns, units, data_offset, ',', None, 'csv')
+
+    raise ValueError('Unknown well file extension: %s.' % file_ext)
+
+
+def get_depth_col_idx(layout):
+    """Depth is the first column, after the index column DataFrame.to_csv writes"""
+    for col_idx, column in enumerate(layout.columns):
+        if column and not column.startswith('Unnamed:'):
+            return col_idx
+    raise ValueError('No depth column in %s.' % ', '.join(layout.columns))
+
+
+def _find_csv_column(columns, log_name):
+    """Column of a log given as column name, canonical name or mnemonic,
+    cleaned files name their columns as 'log name,unit'"""
+    names = [log_name] + [canonical_name for canonical_name, mnemonics in LOG_MNEMONICS_DICT.items()
+                          if log_name.upper() in (mnemonic.upper() for mnemonic in mnemonics)]
+    for name in names:
+        for col_idx, column in enumerate(columns):
+            if column == name or column.partition(',')[0] == name:
+                return col_idx
+    return None
+
+
+def find_layout_columns(file_loc, layout, logs_names):
+    """Column index and unit of each log of a followed file
+    Input:
+        logs_names: list or dict of new name -> mnemonic or canonical name, see las.select_curves
+    Return:
+        OrderedDict of log name -> column index
+        OrderedDict of log name -> unit
+    """
+    if layout.file_type == 'las':
+        _, attr_mapping_idx, attr_mapping_unit = get_specific_attr_mapping(file_loc, logs_names)
+        return attr_mapping_idx, attr_mapping_unit
+
+    if not isinstance(logs_names, dict):
+        logs_names = OrderedDict((log_name, log_name) for log_name in logs_names)
+    attr_mapping_idx, attr_mapping_unit = OrderedDict(), OrderedDict()
+    for new_name, log_name in logs_names.items():
+        col_idx = _find_csv_column(layout.columns, log_name)
+        if col_idx is None:
+            raise ValueError('Log %s is not in %s columns: %s.'
+                             % (log_name, file_loc, ', '.join(layout.columns)))
+        attr_mapping_idx[new_name] = col_idx
+        column_name, _, unit = layout.columns[col_idx].partition(',')
+        attr_mapping_unit[new_name] = unit or LOG_NAMES_UNITS_DICT.get(column_name, '')
+    return attr_mapping_idx, attr_mapping_unit
+
+
+def read_new_lines(file_loc, offset=0):
+    """Complete lines appended after offset
+    Return
+    - bytes of the complete lines
+    - offset after the last complete line
+    """
+    with open(file_loc, 'rb') as file:
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        if size < offset:
+            raise ValueError('%s is shorter (%d bytes) than the offset %d, it was rewritten.'
+                             % (file_loc, size, offset))
+        file.seek(offset)
+        data = file.read(size - offset)
+    end = data.rfind(b'\n') + 1
+    return data[:end], offset + end
+
+
+def parse_lines(lines, layout, col_idxes=None):
+    """Parse data lines into a float array (rows x columns), NULL readings as NaN
+    Input:
+        col_idxes: columns to parse, in this order, all if None. Only numeric columns can
+            be parsed, e.g. not the date and time columns of EDR exports
+    """
+    n_columns = len(layout.columns) if col_idxes is None else len(col_idxes)
+    if not lines.strip():
+        return np.empty((0, n_columns))
+    values = np.loadtxt(io.BytesIO(lines), dtype=np.float64, delimiter=layout.delimiter,
+                        usecols=col_idxes, ndmin=2)
+    if layout.null_value is not None:
+        values[values == layout.null_value] = np.nan
+    return values
+
+
+def follow(file_loc, offset=None, poll_seconds=1., timeout=None, layout=None, col_idxes=None):
+    """Yield (values, offset) each time rows are appended to a CSV or LAS file
+    Input:
+        offset: byte offset to resume from, start of the data if None
+        poll_seconds: time between two checks of the file size
+        timeout: stop after timeout seconds without new rows, follow forever if None
+        layout: TableLayout of the file, read from the file if None
+        col_idxes: columns of values, see parse_lines
+    """
+    layout = layout or get_table_layout(file_loc)
+    offset = layout.data_offset if offset is None else offset
+
+    last_rows_time = time.monotonic()
+    while True:
+        lines, offset = read_new_lines(file_loc, offset)
+        if lines:
+            last_rows_time = time.monotonic()
+            yield parse_lines(lines, layout, col_idxes), offset
+        elif timeout is not None and time.monotonic() - last_rows_time > timeout:
+            logger.info('No new rows in %s for %g s, stop following.', file_loc, timeout)
+            return
+        else:
+            time.sleep(poll_seconds)
+
+
+def read_offset(offset_loc):
+    """Offset saved by save_offset, None if there is none"""
+    try:
+        with open(offset_loc) as file:
+            return json.load(file)['offset']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_offset(offset_loc, offset, **info):
+    """Save the offset of a follower atomically, with info (e.g. source file size)"""
+    tmp_loc = offset_loc + '.tmp'
+    with open(tmp_loc, 'w') as file:
+        json.dump(dict(info, offset=offset), file)
+    os.replace(tmp_loc, offset_loc)
+
+
+if __name__ == '__main__':
+    las_file = r'../input_template/Middleton Unit B 47-38 No. 8SH__From EDR.las'
+
+    layout = get_table_layout(las_file)
+    print(layout.columns, layout.data_offset)
+    for values, offset in follow(las_file, timeout=0):
+        print(values.shape, offset)
@@ -0,0 +1,277 @@
+import math
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+"""
+Units of the logs and conversions between them
+Each unit is a scale and an offset to the reference unit of its dimension, so a conversion
+is one multiply (and one add for temperatures) applied to a whole array, in place if asked.
+Conversion factors are computed once per pair of units and cached. Pressures follow the
+project convention 1 atm = 14.7 psi = 101.325 kPa.
+"""
+
+# value in the reference unit of the dimension = value * scale + offset
+Unit = namedtuple('Unit', ['dimension', 'scale', 'offset'])
+
+UNITS = OrderedDict([
+    # length, reference ft
+    ('ft', Unit('length', 1., 0.)),
+    ('in', Unit('length', 1 / 12, 0.)),
+    ('m', Unit('length', 1 / 0.3048, 0.)),
+    ('cm', Unit('length', 1 / 30.48, 0.)),
+    ('km', Unit('length', 1000 / 0.3048, 0.)),
+    # area, reference in^2
+    ('in^2', Unit('area', 1., 0.)),
+    ('ft^2', Unit('area', 144., 0.)),
+    ('mm^2', Unit('area', 1 / 645.16, 0.)),
+    ('cm^2', Unit('area', 1 / 6.4516, 0.)),
+    ('m^2', Unit('area', 1 / 0.00064516, 0.)),
+    # penetration rate, reference ft/hr
+    ('ft/hr', Unit('rate', 1., 0.)),
+    ('ft/min', Unit('rate', 60., 0.)),
+    ('in/min', Unit('rate', 60 / 12, 0.)),
+    ('m/hr', Unit('rate', 1 / 0.3048, 0.)),
+    ('m/min', Unit('rate', 60 / 0.3048, 0.)),
+    # force, reference lbf
+    ('lbf', Unit('force', 1., 0.)),
+    ('klbf', Unit('force', 1000., 0.)),
+    ('N', Unit('force', 0.22480894387096, 0.)),
+    ('daN', Unit('force', 2.2480894387096, 0.)),
+    ('kN', Unit('force', 224.80894387096, 0.)),
+    ('kDaN', Unit('force', 1000 * 2.2480894387096, 0.)),
+    # rotary speed, reference rev/min
+    ('rev/min', Unit('rotation', 1., 0.)),
+    ('rev/s', Unit('rotation', 60., 0.)),
+    ('rad/s', Unit('rotation', 60 / (2 * math.pi), 0.)),
+    # torque, reference in.lbf
+    ('in.lbf', Unit('torque', 1., 0.)),
+    ('ft.lbf', Unit('torque', 12., 0.)),
+    ('kft.lbf', Unit('torque', 12000., 0.)),
+    ('N.m', Unit('torque', 0.22480894387096 / 0.0254, 0.)),
+    ('kN.m', Unit('torque', 224.80894387096 / 0.0254, 0.)),
+    # pressure and moduli, reference psi
+    ('psi', Unit('pressure', 1., 0.)),
+    ('ksi', Unit('pressure', 1000., 0.)),
+    ('Pa', Unit('pressure', 14.7 / 101325, 0.)),
+    ('kPa', Unit('pressure', 1000 * 14.7 / 101325, 0.)),
+    ('MPa', Unit('pressure', 14.7 / 0.101325, 0.)),
+    ('GPa', Unit('pressure', 14.7 / 0.000101325, 0.)),
+    ('bar', Unit('pressure', 14.7 / 1.01325, 0.)),
+    ('atm', Unit('pressure', 14.7, 0.)),
+    # mud weight, reference ppg
+    ('ppg', Unit('density', 1., 0.)),
+    ('g/cm3', Unit('density', 8.345404, 0.)),
+    ('kg/m3', Unit('density', 0.008345404, 0.)),
+    ('lb/ft3', Unit('density', 1 / 7.48051948, 0.)),
+    # pressure gradient, reference psi/ft
+    ('psi/ft', Unit('gradient', 1., 0.)),
+    ('kPa/m', Unit('gradient', 1000 * 14.7 / 101325 * 0.3048, 0.)),
+    # angle, reference degree
+    ('deg', Unit('angle', 1., 0.)),
+    ('rad', Unit('angle', 180 / math.pi, 0.)),
+    # temperature, reference degC
+    ('degC', Unit('temperature', 1., 0.)),
+    ('degF', Unit('temperature', 5 / 9, -32 * 5 / 9)),
+    ('K', Unit('temperature', 1., -273.15)),
+    # gamma ray
+    ('API', Unit('gamma', 1., 0.)),
+    # porosity, reference fraction
+    ('fraction', Unit('fraction', 1., 0.)),
+    ('%', Unit('fraction', 0.01, 0.)),
+    # permeability, reference nD
+    ('nD', Unit('permeability', 1., 0.)),
+    ('uD', Unit('permeability', 1e3, 0.)),
+    ('mD', Unit('permeability', 1e6, 0.)),
+    ('D', Unit('permeability', 1e9, 0.)),
+])
+
+# other spellings found in LAS headers and input/LOG_UNITS.py
+UNIT_ALIASES = {
+    'feet': 'ft', 'f': 'ft', 'meter': 'm', 'meters': 'm', 'metre': 'm', 'metres': 'm',
+    'in2': 'in^2', 'ft2': 'ft^2', 'mm2': 'mm^2', 'cm2': 'cm^2', 'm2': 'm^2',
+    'ft/h': 'ft/hr', 'm/h': 'm/hr',
+    'klb': 'klbf', 'kip': 'klbf', 'lb': 'lbf',
+    'rpm': 'rev/min',
+    # torque is written in/lb in LOG_UNITS.py
+    'in/lb': 'in.lbf', 'in-lbf': 'in.lbf', 'lbf.in': 'in.lbf', 'in.lb': 'in.lbf',
+    'ft-lbf': 'ft.lbf', 'lbf.ft': 'ft.lbf', 'ft.lb': 'ft.lbf', 'kft-lbf': 'kft.lbf',
+    'nm': 'N.m', 'n-m': 'N.m', 'kn-m': 'kN.m',
+    'lb/gal': 'ppg', 'sg': 'g/cm3', 'g/cc': 'g/cm3',
+    'degree': 'deg', 'degrees': 'deg',
+    'degf': 'degF', 'degc': 'degC',
+    'gapi': 'API',
+    'frac': 'fraction', 'v/v': 'fraction', 'pu': '%',
+}
+
+# conversions the correlations were written with, kept exact instead of going through
+# the reference unit
+CONVERSIONS = {
+    ('kDaN', 'lbf'): 1000 * 2.2480894387096,
+    ('ft/hr', 'in/min'): 12 / 60,
+    ('kPa', 'psi'): 1000 * 14.7 / 101325,
+    ('psi', 'MPa'): 0.101325 / 14.7,
+    ('kPa', 'MPa'): 1 / 1000,
+}
+
+# lower case spelling -> unit, built once for case-insensitive lookups
+_UNIT_NAMES = dict((name.lower(), name) for name in UNITS)
+_UNIT_NAMES.update((alias.lower(), name) for alias, name in UNIT_ALIASES.items())
+
+
+def get_unit(unit):
+    """Name of a unit in UNITS, from any spelling of UNITS or UNIT_ALIASES"""
+    if unit in UNITS:
+        return unit
+    name = _UNIT_NAMES.get(str(unit).strip().lower())
+    if name is None:
+        raise ValueError('Unknown unit: %s.' % unit)
+    return name
+
+
+@lru_cache(maxsize=None)
+def get_conversion(from_unit, to_unit):
+    """Return (scale, offset) such that value in to_unit = value in from_unit * scale + offset"""
+    from_unit, to_unit = get_unit(from_unit), get_unit(to_unit)
+    if from_unit == to_unit:
+        return 1., 0.
+    if (from_unit, to_unit) in CONVERSIONS:
+        return CONVERSIONS[from_unit, to_unit], 0.
+    if (to_unit, from_unit) in CONVERSIONS:
+        return 1 / CONVERSIONS[to_unit, from_unit], 0.
+
+    source, target = UNITS[from_unit], UNITS[to_unit]
+    if source.dimension != target.dimension:
+        raise ValueError('Cannot convert %s (%s) to %s (%s).'
+                         % (from_unit, source.dimension, to_unit, target.dimension))
+    return source.scale / target.scale, (source.offset - target.offset) / target.scale
+
+
+def get_scale(from_unit, to_unit):
+    """Scale of a conversion without offset, to fold into the constants of a correlation"""
+    scale, offset = get_conversion(from_unit, to_unit)
+    if offset:
+        raise ValueError('Conversion from %s to %s has an offset.' % (from_unit, to_unit))
+    return scale
+
+
+def convert(values, from_unit, to_unit, out=None):
+    """Convert values from from_unit to to_unit
+    Input:
+        out: array to write into, e.g. values itself to convert in place
+    Return:
+        converted values, values itself if both units are the same and out is None
+    """
+    scale, offset = get_conversion(from_unit, to_unit)
+    if scale == 1 and not offset:
+        if out is None:
+            return values
+        np.copyto(out, values)
+        return out
+    out = np.multiply(values, scale, out=out)
+    if offset:
+        np.add(out, offset, out=out)
+    return out
+
+
+def unit_of(values, default=None):
+    """Unit carried by a LogArray, default for other arrays"""
+    return getattr(values, 'unit', None) or default
+
+
+class LogArray(np.ndarray):
+    """Values of a log that carry their unit
+
+    tor = LogArray(logs_dict['TOR'], 'kft.lbf')
+    tor.to('in.lbf')
+
+    Slices and views keep the unit, results of calculations are plain arrays since their
+    unit is not the unit of the log anymore.
+    """
+
+    def __new__(cls, values, unit=None):
+        log_array = np.asarray(values, dtype=np.float64).view(cls)
+        log_array.unit = get_unit(unit) if unit else unit_of(values)
+        return log_array
+
+    def __array_finalize__(self, obj):
+        self.unit = getattr(obj, 'unit', None)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, out=None, **kwargs):
+        inputs = [value.view(np.ndarray) if isinstance(value, LogArray) else value
+                  for value in inputs]
+        if out is not None:
+            kwargs['out'] = tuple(value.view(np.ndarray) if isinstance(value, LogArray) else value
+                                  for value in out)
+        results = getattr(ufunc, method)(*inputs, **kwargs)
+        # in-place operations give back the arrays written into, with their unit
+        if out is not None:
+            return out[0] if len(out) == 1 else out
+        return results
+
+    def __reduce__(self):
+        reconstruct, arguments, state = super().__reduce__()
+        return reconstruct, arguments, (state, self.unit)
+
+    def __setstate__(self, state):
+        state, self.unit = state
+        super().__setstate__(state)
+
+    def to(self, unit, inplace=False):
+        """Log converted to unit, converted in place if inplace"""
+        unit = get_unit(unit)
+        if self.unit is None:
+            raise ValueError('Log has no unit to convert from.')
+        if inplace:
+            convert(self, self.unit, unit, out=self)
+            self.unit = unit
+            return self
+        values = convert(self, self.unit, unit)
+        if values is self:
+            return self
+        values = values.view(LogArray)
+        values.unit = unit
+        return values
+
+
+def as_log_arrays(logs_reading_dict, units):
+    """Wrap the logs of a reading dict into LogArrays without copying them
+    Input:
+        units: dict of log name -> unit, e.g. WellStore.units, logs with an unknown
+            or empty unit are left as they are
+    """
+    log_arrays = OrderedDict()
+    for log_name, values in logs_reading_dict.items():
+        try:
+            log_arrays[log_name] = LogArray(values, units.get(log_name))
+        except ValueError:
+            log_arrays[log_name] = values
+    return log_arrays
+
+
+def convert_logs(logs_dict, units, to_units, inplace=False):
+    """Convert the logs of logs_dict to to_units in bulk
+    Input:
+        units: dict of log name -> unit of the logs
+        to_units: dict of log name -> wanted unit, other logs are left as they are
+        inplace: write the converted values into the arrays of logs_dict
+    Return:
+        OrderedDict of log name -> values
+        OrderedDict of log name -> unit
+    """
+    converted, converted_units = OrderedDict(), OrderedDict()
+    for log_name, values in logs_dict.items():
+        unit = units.get(log_name)
+        if log_name in to_units and unit:
+            values = convert(values, unit, to_units[log_name], out=values if inplace else None)
+            unit = to_units[log_name]
+        converted[log_name] = values
+        converted_units[log_name] = unit
+    return converted, converted_units
+
+
+if __name__ == '__main__':
+    print(get_conversion('kDaN', 'lbf'), get_conversion('degF', 'degC'))
+    wob = LogArray(np.array([10., 20.]), 'kDaN')
+    print(wob.to('klbf'), wob.to('klbf').unit, (wob * 2).__class__.__name__)